@@ -1,20 +1,25 @@
 # app.py
-from flask import Flask, render_template, request, jsonify, send_from_directory, redirect
+from flask import Flask, render_template, request, jsonify, send_from_directory, send_file, redirect, Response, stream_with_context
 import os
 import json
-import threading
 import time
 import jwt
 import hashlib
 from datetime import datetime, timedelta
 from functools import wraps
 from pathlib import Path
-from werkzeug.utils import secure_filename
+from werkzeug.utils import secure_filename, safe_join
 from flask_cors import CORS
 
 # Import các module xử lý
 from modules.processing_manager import ProcessingManager
 from modules.gallery_manager import GalleryManager
+from modules.question_store import QuestionStore, get_question_store, question_cache
+from modules.search_index import get_search_index
+from modules.ocr_results import get_ocr_result_log
+from modules.thumbnail_service import ThumbnailService, get_thumbnail_service
+from modules.job_scheduler import JobScheduler
+from config import Config
 
 app = Flask(__name__, 
            template_folder='templates',
@@ -342,37 +347,66 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 BOOKS_DIR = "books_cropped"
 DEFAULT_BOOK = "cropped"
 
+# Tham số query bật chế độ phân trang của GET /api/questions
+QUESTION_PAGE_ARGS = ('limit', 'cursor', 'offset', 'sort', 'q') + QuestionStore.FILTER_COLUMNS
+
+# Thumbnail cho Gallery: loại ảnh → thư mục gốc của các sách
+THUMBNAIL_ROOTS = {'cropped': BOOKS_DIR, 'detection': 'books_detections'}
+
+# Ảnh gọi với ?v=<mtime> khớp file hiện tại được cache 1 năm (immutable)
+IMAGE_MAX_AGE = 365 * 24 * 3600
+
 # Khởi tạo Managers
 processing_manager = ProcessingManager()
 gallery_manager = GalleryManager()
+thumbnail_service = get_thumbnail_service()
+job_scheduler = JobScheduler(
+    processing_manager,
+    db_path=Config.JOB_DB_PATH,
+    max_concurrent=Config.JOB_MAX_CONCURRENT,
+    stage_concurrency=Config.JOB_STAGE_CONCURRENCY
+)
+
+# `python app.py` chạy với reloader (debug=True): process cha không chạy job, chỉ process con phục vụ request
+if __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    job_scheduler.start()
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 # === UTILITY FUNCTIONS ===
-def load_questions(book_name=None):
-    """Load danh sách câu hỏi từ JSON file"""
-    if book_name is None:
-        book_name = DEFAULT_BOOK
-    
-    json_file = os.path.join(book_name, "mapping.json")
-    if os.path.exists(json_file):
+def send_image(directory, filename):
+    """
+    Serve ảnh kèm ETag/Last-Modified theo (mtime, size) và trả 304 khi client gửi
+    If-None-Match/If-Modified-Since trùng.
+    URL có ?v=<mtime> (Gallery API trả về) khớp file hiện tại → Cache-Control immutable,
+    trình duyệt không gọi lại server; ngược lại no-cache (luôn revalidate, chỉ tốn 304).
+    """
+    # Thư mục sách tính theo thư mục làm việc như Gallery/manifest (không theo app.root_path)
+    directory = os.path.abspath(directory)
+    versioned = False
+    version = request.args.get('v')
+    path = safe_join(directory, filename)
+    if version and path:
         try:
-            with open(json_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return []
-    return []
-
-def save_questions(questions, book_name=None):
-    """Lưu danh sách câu hỏi vào JSON file"""
-    if book_name is None:
-        book_name = DEFAULT_BOOK
+            versioned = version == GalleryManager.image_version(os.stat(path).st_mtime)
+        except OSError:
+            pass
     
-    os.makedirs(book_name, exist_ok=True)
-    json_file = os.path.join(book_name, "mapping.json")
-    with open(json_file, 'w', encoding='utf-8') as f:
-        json.dump(questions, f, ensure_ascii=False, indent=2)
+    response = send_from_directory(directory, filename, max_age=IMAGE_MAX_AGE if versioned else None)
+    if versioned:
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+def cached_json_response(body, etag):
+    """Response JSON dựng sẵn kèm ETag; trả 304 nếu client gửi If-None-Match trùng"""
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    # Luôn hỏi lại server, nhưng chỉ tải lại body khi dữ liệu đổi
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 def get_image_list(book_name=None):
     """Lấy danh sách tất cả ảnh PNG trong thư mục book"""
@@ -390,13 +424,6 @@ def get_image_list(book_name=None):
                         images.append(relative_path)
     return images
 
-def get_next_index(book_name=None):
-    """Lấy index tiếp theo cho câu hỏi mới"""
-    questions = load_questions(book_name)
-    if not questions:
-        return 1
-    return max(q.get('index', 0) for q in questions) + 1
-
 def get_book_list():
     """Lấy danh sách các sách có sẵn cho mapping questions (không phải Gallery)"""
     books = []
@@ -431,33 +458,6 @@ def get_book_list():
     return list(set(books))  # Remove duplicates
 
 # === BACKGROUND PROCESSING ===
-def process_pdf_background(pdf_path, book_name, status_id, processing_mode='complete'):
-    """
-    Xử lý PDF trong background thread
-    
-    Args:
-        pdf_path (str): Đường dẫn file PDF
-        book_name (str): Tên sách
-        status_id (str): ID theo dõi trạng thái
-        processing_mode (str): 'complete' hoặc 'step_by_step'
-    """
-    try:
-        if processing_mode == 'complete':
-            result = processing_manager.process_pdf_complete(pdf_path, book_name, status_id)
-        else:
-            # Có thể mở rộng để xử lý từng bước riêng biệt
-            result = processing_manager.process_pdf_complete(pdf_path, book_name, status_id)
-        
-        # Cleanup file upload sau khi xử lý xong
-        try:
-            if os.path.exists(pdf_path):
-                os.remove(pdf_path)
-        except:
-            pass  # Không quan trọng nếu không xóa được
-        
-    except Exception as e:
-        processing_manager._set_error(status_id, f"Lỗi trong background processing: {str(e)}")
-
 # === GALLERY ROUTES ===
 @app.route('/gallery')
 def gallery():
@@ -472,17 +472,25 @@ def get_gallery_books():
 
 @app.route('/api/gallery/detection')
 def get_detection_images():
-    """API lấy danh sách ảnh detection"""
+    """API lấy danh sách ảnh detection (phân trang khi có offset/limit/sort/... trong query)"""
     book_name = request.args.get('book', '')
-    result = gallery_manager.get_detection_images(book_name)
-    return jsonify(result)
+    if not any(arg in request.args for arg in GalleryManager.PAGE_ARGS):
+        return jsonify(gallery_manager.get_detection_images(book_name))
+    try:
+        return jsonify(gallery_manager.query_detection_images(book_name, request.args))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
 
 @app.route('/api/gallery/cropped')
 def get_cropped_images():
-    """API lấy danh sách ảnh crop"""
+    """API lấy danh sách ảnh crop (phân trang + lọc theo class/folder/ngày khi có tham số)"""
     book_name = request.args.get('book', '')
-    result = gallery_manager.get_cropped_images(book_name)
-    return jsonify(result)
+    if not any(arg in request.args for arg in GalleryManager.PAGE_ARGS):
+        return jsonify(gallery_manager.get_cropped_images(book_name))
+    try:
+        return jsonify(gallery_manager.query_cropped_images(book_name, request.args))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
 
 @app.route('/api/gallery/book-info/<book_name>')
 def get_gallery_book_info(book_name):
@@ -501,10 +509,43 @@ def serve_detection_image(book_name, filename):
     """Serve ảnh detection"""
     detection_dir = f"books_detections/{book_name}"
     if os.path.exists(detection_dir):
-        return send_from_directory(detection_dir, filename)
+        return send_image(detection_dir, filename)
     else:
         return "Detection images not found", 404
 
+@app.route('/thumbnails/<kind>/<book_name>/<path:filename>')
+def serve_thumbnail(kind, book_name, filename):
+    """Serve thumbnail (WebP/JPEG theo header Accept) của ảnh crop hoặc detection, tạo lần đầu khi được gọi"""
+    root = THUMBNAIL_ROOTS.get(kind)
+    source_path = safe_join(root, book_name, filename) if root else None
+    if source_path is None or not os.path.isfile(source_path):
+        return "Image not found", 404
+    
+    size = request.args.get('size', ThumbnailService.DEFAULT_SIZE, type=int)
+    fmt = thumbnail_service.choose_format(request.headers.get('Accept'))
+    try:
+        thumbnail_path, key = thumbnail_service.get(source_path, size, fmt)
+    except Exception as e:
+        app.logger.warning(f"Không tạo được thumbnail cho {source_path}: {e}")
+        return "Cannot create thumbnail", 500
+    
+    # v đổi theo mtime ảnh gốc - trình duyệt dùng lại thumbnail mà không hỏi lại server;
+    # không có v thì luôn revalidate bằng ETag
+    versioned = 'v' in request.args
+    response = send_file(
+        os.path.abspath(thumbnail_path),
+        mimetype=ThumbnailService.MIMETYPES[fmt],
+        conditional=True,
+        etag=key,
+        max_age=IMAGE_MAX_AGE if versioned else None
+    )
+    response.vary.add('Accept')
+    if versioned:
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
 # === PDF PROCESSING ROUTES ===
 @app.route('/upload_pdf', methods=['POST'])
 def upload_pdf():
@@ -517,6 +558,7 @@ def upload_pdf():
         file = request.files['pdf_file']
         book_name = request.form.get('book_name', '').strip()
         processing_mode = request.form.get('processing_mode', 'complete')  # complete hoặc step_by_step
+        priority = request.form.get('priority', 0, type=int)  # Số lớn được xử lý trước
         
         if file.filename == '':
             return jsonify({'success': False, 'error': 'Không có file được chọn'})
@@ -539,21 +581,17 @@ def upload_pdf():
             return jsonify({'success': False, 'error': error_message})
         
         # Tạo unique ID cho quá trình xử lý
-        status_id = f"{book_name}_{int(time.time())}"
+        status_id = f"{book_name}_{int(time.time() * 1000)}"
         
-        # Bắt đầu xử lý trong background thread
-        thread = threading.Thread(
-            target=process_pdf_background,
-            args=(file_path, book_name, status_id, processing_mode)
-        )
-        thread.daemon = True
-        thread.start()
+        # Đưa vào hàng đợi job (lưu trong SQLite, được chạy lại nếu server restart)
+        job = job_scheduler.submit(file_path, book_name, status_id, processing_mode, priority)
         
         return jsonify({
             'success': True,
-            'message': 'File đã được upload và bắt đầu xử lý',
+            'message': 'File đã được upload và đưa vào hàng đợi xử lý',
             'status_id': status_id,
-            'book_name': book_name
+            'book_name': book_name,
+            'queue_position': job.get('queue_position')
         })
         
     except Exception as e:
@@ -562,9 +600,54 @@ def upload_pdf():
 @app.route('/processing_status/<status_id>')
 def get_processing_status(status_id):
     """API lấy trạng thái xử lý"""
-    status = processing_manager.get_status(status_id)
+    status = job_scheduler.get_status(status_id)
     return jsonify(status)
 
+@app.route('/processing_events/<status_id>')
+def stream_processing_status(status_id):
+    """
+    Server-Sent Events: đẩy trạng thái xử lý ngay khi callback của các processor cập nhật status store.
+
+    Cập nhật theo từng trang được gộp lại: tối đa một event mỗi STATUS_STREAM_INTERVAL giây,
+    luôn là trạng thái mới nhất. Stream đóng sau event completed/error/cancelled.
+    """
+    store = processing_manager.status_store
+    interval = Config.STATUS_STREAM_INTERVAL
+    keepalive = Config.STATUS_STREAM_KEEPALIVE
+
+    def events():
+        version = store.version(status_id)
+        status = job_scheduler.get_status(status_id)
+        last_sent = time.monotonic()
+        idle_since = last_sent
+
+        while True:
+            yield f"event: status\ndata: {json.dumps(status, ensure_ascii=False)}\n\n"
+            if status.get('status') in ('completed', 'error', 'cancelled', 'not_found'):
+                return
+
+            # Gộp các cập nhật tới sát nhau: chờ hết khoảng tối thiểu rồi mới đọc bản mới nhất
+            wait = interval - (time.monotonic() - last_sent)
+            if wait > 0:
+                time.sleep(wait)
+
+            while True:
+                new_version, record = store.wait_for_change(status_id, version, keepalive)
+                if new_version != version:
+                    break
+                if time.monotonic() - idle_since >= keepalive:
+                    idle_since = time.monotonic()
+                    yield ": keepalive\n\n"
+
+            version = new_version
+            status = record if record is not None else job_scheduler.get_status(status_id)
+            last_sent = idle_since = time.monotonic()
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # nginx: không buffer stream
+    return response
+
 @app.route('/processing_summary/<status_id>')
 def get_processing_summary(status_id):
     """API lấy tóm tắt kết quả xử lý"""
@@ -581,30 +664,119 @@ def cleanup_processing_status(status_id):
 
 @app.route('/all_processing_statuses')
 def get_all_processing_statuses():
-    """API lấy tất cả trạng thái đang xử lý (debug)"""
+    """API lấy tất cả trạng thái đang xử lý (debug) - rút gọn, ?full=1 để kèm kết quả chi tiết"""
+    if request.args.get('full') == '1':
+        return jsonify(processing_manager.status_store.snapshot(compact=False))
     statuses = processing_manager.get_all_statuses()
     return jsonify(statuses)
 
+# === JOB QUEUE ROUTES ===
+@app.route('/api/jobs')
+def list_jobs():
+    """API danh sách job xử lý PDF (mới nhất trước), lọc theo ?state="""
+    try:
+        jobs = job_scheduler.list_jobs(
+            state=request.args.get('state'),
+            limit=request.args.get('limit', JobScheduler.LIST_LIMIT, type=int)
+        )
+        return jsonify({'success': True, 'jobs': jobs})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    """API thông tin một job"""
+    job = job_scheduler.get_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Không tìm thấy job'}), 404
+    return jsonify({'success': True, 'job': job})
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """API hủy job (đang chờ: hủy ngay, đang chạy: dừng trước bước kế tiếp)"""
+    if not job_scheduler.cancel(job_id):
+        return jsonify({'success': False, 'error': 'Job không tồn tại hoặc đã kết thúc'}), 409
+    return jsonify({'success': True, 'job': job_scheduler.get_job(job_id)})
+
+@app.route('/api/jobs/<job_id>/retry', methods=['POST'])
+def retry_job(job_id):
+    """API chạy lại job bị lỗi"""
+    if not job_scheduler.retry(job_id):
+        return jsonify({'success': False, 'error': 'Chỉ chạy lại được job lỗi còn file PDF'}), 409
+    return jsonify({'success': True, 'job': job_scheduler.get_job(job_id)})
+
+@app.route('/api/jobs/<job_id>/priority', methods=['POST'])
+def set_job_priority(job_id):
+    """API đổi priority của job đang chờ"""
+    data = request.get_json(silent=True) or {}
+    try:
+        priority = int(data.get('priority'))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'priority phải là số nguyên'}), 400
+    if not job_scheduler.set_priority(job_id, priority):
+        return jsonify({'success': False, 'error': 'Job không còn trong hàng đợi'}), 409
+    return jsonify({'success': True, 'job': job_scheduler.get_job(job_id)})
+
 # === IMAGE SERVING ROUTES ===
 @app.route('/images/<book_name>/<path:filename>')
 def serve_image(book_name, filename):
     """Serve ảnh từ thư mục book cụ thể"""
     if book_name == 'cropped' or os.path.exists(book_name):
-        return send_from_directory(book_name, filename)
+        return send_image(book_name, filename)
     else:
         return "Book not found", 404
 
 @app.route('/images/<path:filename>')
 def serve_image_legacy(filename):
     """Serve ảnh từ thư mục cropped (tương thích với cách cũ)"""
-    return send_from_directory(DEFAULT_BOOK, filename)
+    return send_image(DEFAULT_BOOK, filename)
 
 # === QUESTIONS MANAGEMENT ROUTES ===
 @app.route('/api/questions', methods=['GET'])
 def get_questions():
     """API lấy danh sách câu hỏi"""
     book_name = request.args.get('book', DEFAULT_BOOK)
-    return jsonify(load_questions(book_name))
+    page_args = [arg for arg in QUESTION_PAGE_ARGS if arg in request.args]
+    
+    if not page_args:
+        # Không có tham số phân trang/lọc → toàn bộ mảng như trước (từ cache)
+        if not os.path.isdir(book_name):
+            return jsonify([])
+        cached = question_cache.get(book_name)
+        return cached_json_response(cached.body, cached.etag)
+    
+    if not os.path.isdir(book_name):
+        return jsonify({'items': [], 'next_cursor': None, 'total': 0})
+    
+    try:
+        filters = {key: request.args.get(key) for key in QuestionStore.FILTER_COLUMNS if request.args.get(key)}
+        offset = request.args.get('offset')
+        cursor = request.args.get('cursor')
+        page = get_question_store(book_name).query_questions(
+            filters=filters,
+            search=request.args.get('q'),
+            sort=request.args.get('sort', 'order'),
+            limit=request.args.get('limit', type=int),
+            cursor=cursor,
+            offset=int(offset) if offset is not None else None,
+            # Chỉ đếm tổng ở trang đầu, các trang sau không phải quét lại
+            with_total=not cursor and not offset
+        )
+        return jsonify(page)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+@app.route('/api/questions/<int:question_id>', methods=['GET'])
+def get_question(question_id):
+    """API lấy một câu hỏi theo index"""
+    book_name = request.args.get('book', DEFAULT_BOOK)
+    if not os.path.isdir(book_name):
+        return jsonify({'success': False, 'error': 'Question not found'}), 404
+    
+    question = get_question_store(book_name).get_question(question_id)
+    if question is None:
+        return jsonify({'success': False, 'error': 'Question not found'}), 404
+    return jsonify(question)
 
 @app.route('/api/questions', methods=['POST'])
 def add_question():
@@ -613,9 +785,8 @@ def add_question():
         data = request.json
         book_name = data.get('book', DEFAULT_BOOK)
         
-        # Tạo câu hỏi mới
+        # Tạo câu hỏi mới (index được cấp trong transaction của store)
         new_question = {
-            'index': get_next_index(book_name),
             'question': data.get('question', ''),
             'answer': data.get('answer', ''),
             'image_question': data.get('image_question', []),
@@ -627,42 +798,65 @@ def add_question():
             'book': book_name.removeprefix("books_cropped/")
         }
         
-        # Load và thêm vào danh sách
-        questions = load_questions(book_name)
-        questions.append(new_question)
-        save_questions(questions, book_name)
+        new_question = get_question_store(book_name).add_question(new_question)
         
         return jsonify({'success': True, 'question': new_question})
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/questions/bulk', methods=['POST'])
+def bulk_questions():
+    """API áp dụng nhiều thao tác create/update/delete/reindex trong một transaction"""
+    try:
+        data = request.json or {}
+        book_name = data.get('book', DEFAULT_BOOK)
+        operations = data.get('operations')
+        
+        # Câu hỏi tạo mới mang tên sách giống API thêm từng câu
+        for operation in operations if isinstance(operations, list) else []:
+            if isinstance(operation, dict) and operation.get('op') == 'create' and isinstance(operation.get('question'), dict):
+                operation['question'].setdefault('book', book_name.removeprefix("books_cropped/"))
+        
+        diff = get_question_store(book_name).apply_bulk(operations, dry_run=bool(data.get('dry_run')))
+        return jsonify({'success': True, 'dry_run': bool(data.get('dry_run')), 'diff': diff})
+        
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/questions/<int:question_id>', methods=['PUT'])
 def update_question(question_id):
     """API cập nhật câu hỏi"""
     try:
         data = request.json
         book_name = data.get('book', DEFAULT_BOOK)
-        questions = load_questions(book_name)
-        
-        # Tìm và cập nhật câu hỏi
-        for i, q in enumerate(questions):
-            if q.get('index') == question_id:
-                questions[i].update({
-                    'question': data.get('question', q.get('question', '')),
-                    'answer': data.get('answer', q.get('answer', '')),
-                    'image_question': data.get('image_question', q.get('image_question', [])),
-                    'image_answer': data.get('image_answer', q.get('image_answer', [])),
-                    'difficulty': data.get('difficulty', q.get('difficulty', 'easy')),
-                    'chapter': data.get('chapter', q.get('chapter', '')),
-                    'subject': data.get('subject', q.get('subject', '')),
-                    'lesson': data.get('lesson', q.get('lesson', '')),
-                    'book': book_name.removeprefix("books_cropped/")
-                })
-                save_questions(questions, book_name)
-                return jsonify({'success': True, 'question': questions[i]})
+        store = get_question_store(book_name)
+        q = store.get_question(question_id)
+        if q is None:
+            return jsonify({'success': False, 'error': 'Question not found'}), 404
         
-        return jsonify({'success': False, 'error': 'Question not found'}), 404
+        # Cập nhật câu hỏi
+        fields = {
+            'question': data.get('question', q.get('question', '')),
+            'answer': data.get('answer', q.get('answer', '')),
+            'image_question': data.get('image_question', q.get('image_question', [])),
+            'image_answer': data.get('image_answer', q.get('image_answer', [])),
+            'difficulty': data.get('difficulty', q.get('difficulty', 'easy')),
+            'chapter': data.get('chapter', q.get('chapter', '')),
+            'subject': data.get('subject', q.get('subject', '')),
+            'lesson': data.get('lesson', q.get('lesson', '')),
+            'book': book_name.removeprefix("books_cropped/")
+        }
+        if q.get('needs_review'):
+            # Đã sửa sau khi trang nguồn đổi (upload lại PDF) - coi như đã xem lại
+            fields['needs_review'] = False
+        question = store.update_question(question_id, fields)
+        if question is None:
+            return jsonify({'success': False, 'error': 'Question not found'}), 404
+        
+        return jsonify({'success': True, 'question': question})
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -672,14 +866,9 @@ def delete_question(question_id):
     """API xóa câu hỏi"""
     try:
         book_name = request.args.get('book', DEFAULT_BOOK)
-        questions = load_questions(book_name)
         
-        # Tìm và xóa câu hỏi
-        for i, q in enumerate(questions):
-            if q.get('index') == question_id:
-                del questions[i]
-                save_questions(questions, book_name)
-                return jsonify({'success': True})
+        if get_question_store(book_name).delete_question(question_id):
+            return jsonify({'success': True})
         
         return jsonify({'success': False, 'error': 'Question not found'}), 404
         
@@ -747,19 +936,112 @@ def get_text_content(folder_name):
             })
     except Exception as e:
         return jsonify({'success': False, 'error': f'Lỗi khi đọc file: {str(e)}'}), 500
+
+@app.route('/api/ocr_results/<book_name>')
+def get_ocr_results(book_name):
+    """API lấy kết quả OCR có cấu trúc của một sách (?folder=image_XXXX, ?class=0..2)"""
+    book_dir = safe_join(BOOKS_DIR, book_name)
+    if book_dir is None or not os.path.isdir(book_dir):
+        return jsonify({'success': False, 'error': f'Không tìm thấy sách {book_name}'}), 404
+
+    records = get_ocr_result_log(book_dir).records(
+        folder=request.args.get('folder') or None,
+        class_id=request.args.get('class', type=int)
+    )
+    return jsonify({
+        'success': True,
+        'book': book_name,
+        'total': len(records),
+        'records': records
+    })
+# === SEARCH ROUTES ===
+@app.route('/api/search')
+def search():
+    """API tìm kiếm OCR text và câu hỏi của tất cả các sách (không phân biệt dấu)"""
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'success': False, 'error': 'Thiếu từ khóa (q)'}), 400
+        
+        kind = request.args.get('kind')
+        if kind not in (None, '', 'ocr', 'question'):
+            return jsonify({'success': False, 'error': "kind phải là 'ocr' hoặc 'question'"}), 400
+        
+        start = time.perf_counter()
+        index = get_search_index()
+        # Bắt thay đổi từ bên ngoài web app (run.py...), tối đa một lần mỗi REFRESH_INTERVAL
+        index.refresh(get_book_list())
+        hits = index.search(
+            query,
+            book=request.args.get('book') or None,
+            kind=kind or None,
+            limit=request.args.get('limit', type=int)
+        )
+        
+        for hit in hits:
+            if hit['kind'] == 'ocr' and hit['folder'] and hit['ref']:
+                hit['image_url'] = f"/images/{hit['book']}/{hit['folder']}/{hit['ref']}"
+        
+        return jsonify({
+            'success': True,
+            'query': query,
+            'hits': hits,
+            'took_ms': round((time.perf_counter() - start) * 1000, 2)
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 # === JSON EDITOR ROUTES ===
 @app.route('/api/json/raw', methods=['GET'])
 def get_json_raw():
     """API lấy nội dung JSON thô"""
     try:
         book_name = request.args.get('book', DEFAULT_BOOK)
-        json_file = os.path.join(book_name, "mapping.json")
-        if os.path.exists(json_file):
-            with open(json_file, 'r', encoding='utf-8') as f:
-                content = f.read()
-            return jsonify({'success': True, 'content': content})
-        else:
+        if not os.path.isdir(book_name):
             return jsonify({'success': True, 'content': '[]'})
+        
+        # Nội dung dựng từ cache (giống hệt mapping.json export từ store), không đọc lại file
+        body, etag = question_cache.get(book_name).raw_body()
+        return cached_json_response(body, etag)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+EXPORT_MIMETYPES = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'gzip': 'application/gzip',
+    'zstd': 'application/zstd'
+}
+
+@app.route('/api/json/export')
+def export_json():
+    """
+    API tải mapping của sách dạng file: format=json|ndjson, compress=gzip|zstd, download=1.
+    File được phục vụ từ disk theo từng chunk, hỗ trợ Range (tải tiếp) và ETag.
+    """
+    try:
+        book_name = request.args.get('book', DEFAULT_BOOK)
+        if not os.path.isdir(book_name):
+            return jsonify({'success': False, 'error': 'Không tìm thấy sách'}), 404
+        
+        fmt = request.args.get('format', 'json')
+        compression = request.args.get('compress') or None
+        path = get_question_store(book_name).export_file(fmt, compression)
+        
+        download_name = f"{os.path.basename(os.path.normpath(book_name))}.{fmt}"
+        download_name += QuestionStore.EXPORT_COMPRESSIONS[compression]
+        response = send_file(
+            os.path.abspath(path),
+            mimetype=EXPORT_MIMETYPES[compression or fmt],
+            as_attachment=request.args.get('download') == '1',
+            download_name=download_name,
+            conditional=True,
+            etag=True
+        )
+        response.cache_control.no_cache = True
+        return response
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -773,15 +1055,17 @@ def update_json_raw():
         
         # Validate JSON format
         try:
-            json.loads(content)
+            questions = json.loads(content)
         except json.JSONDecodeError as e:
             return jsonify({'success': False, 'error': f'JSON không hợp lệ: {str(e)}'}), 400
         
-        # Save to file
-        os.makedirs(book_name, exist_ok=True)
-        json_file = os.path.join(book_name, "mapping.json")
-        with open(json_file, 'w', encoding='utf-8') as f:
-            f.write(content)
+        if not isinstance(questions, list):
+            return jsonify({'success': False, 'error': 'JSON phải là một mảng câu hỏi'}), 400
+        
+        # Lưu vào store và export mapping.json ngay
+        store = get_question_store(book_name)
+        store.replace_all(questions)
+        store.export()
             
         return jsonify({'success': True, 'message': 'Cập nhật JSON thành công!'})
     except Exception as e:
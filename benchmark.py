@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import sys
+import json
+import glob
+import logging
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ['*.png', '*.jpg', '*.jpeg']
+
+def find_images(folder_path: str, limit: int = None) -> list:
+    """Find page images in folder (sorted, optionally limited)"""
+    image_files = []
+    for ext in IMAGE_EXTENSIONS:
+        image_files.extend(glob.glob(os.path.join(folder_path, ext)))
+    image_files = sorted(set(image_files))
+    return image_files[:limit] if limit else image_files
+
+def benchmark_backends(args):
+    """Accuracy/latency of ONNX Runtime / OpenVINO vs PyTorch CPU"""
+    from config import Config
+    from modules_auto_mapping.inference_backend import compare_backends
+
+    image_files = find_images(args.images_dir, args.limit)
+    if not image_files:
+        print(f"❌ No images found in: {args.images_dir}")
+        return None
+
+    config = Config()
+    config.YOLO_INT8 = args.int8
+
+    print(f"🔬 Comparing backends {args.backends} vs PyTorch CPU on {len(image_files)} images")
+    report = compare_backends(config, image_files, args.backends)
+
+    print(f"\n{'Backend':<10} {'Mean ms':>9} {'P95 ms':>9} {'Speedup':>8} {'Precision':>10} {'Recall':>8} {'mIoU':>7}")
+    for backend, entry in report.items():
+        accuracy = entry.get('accuracy_vs_pytorch_cpu', {})
+        print(f"{backend:<10} {entry['mean_latency_ms']:>9} {entry['p95_latency_ms']:>9} "
+              f"{str(entry['speedup_vs_pytorch_cpu']):>8} {str(accuracy.get('precision', '-')):>10} "
+              f"{str(accuracy.get('recall', '-')):>8} {str(accuracy.get('mean_iou', '-')):>7}")
+
+    return report
+
+def benchmark_decode(args):
+    """Decode+resize time per page: full-resolution decode vs detection-resolution decode"""
+    import time
+    import cv2
+    from modules_auto_mapping.utils import ImageUtils
+
+    image_files = find_images(args.images_dir, args.limit)
+    if not image_files:
+        print(f"❌ No images found in: {args.images_dir}")
+        return None
+
+    print(f"🔬 Decode benchmark at imgsz={args.imgsz} on {len(image_files)} images")
+    pages = []
+    for image_path in image_files:
+        # Baseline: what predict() does with a path - full decode, then resize to imgsz
+        start_time = time.perf_counter()
+        image = cv2.imread(image_path)
+        h, w = image.shape[:2]
+        ratio = args.imgsz / max(w, h)
+        cv2.resize(image, (round(w * ratio), round(h * ratio)), interpolation=cv2.INTER_LINEAR)
+        full_ms = 1000 * (time.perf_counter() - start_time)
+        del image
+
+        _, _, stats = ImageUtils.load_for_detection(image_path, args.imgsz)
+        pages.append({
+            "image": os.path.basename(image_path),
+            "full_size": [w, h],
+            "reduce_factor": stats["reduce_factor"],
+            "full_decode_resize_ms": round(full_ms, 2),
+            "detection_decode_resize_ms": stats["total_ms"],
+            "saved_ms": round(full_ms - stats["total_ms"], 2)
+        })
+        print(f"  {pages[-1]['image']}: {pages[-1]['full_decode_resize_ms']}ms -> "
+              f"{pages[-1]['detection_decode_resize_ms']}ms (x1/{stats['reduce_factor']} decode)")
+
+    full_total = sum(p["full_decode_resize_ms"] for p in pages)
+    detection_total = sum(p["detection_decode_resize_ms"] for p in pages)
+    report = {
+        "imgsz": args.imgsz,
+        "pages": pages,
+        "avg_full_ms": round(full_total / len(pages), 2),
+        "avg_detection_ms": round(detection_total / len(pages), 2),
+        "avg_saved_ms": round((full_total - detection_total) / len(pages), 2),
+        "speedup": round(full_total / detection_total, 2) if detection_total else None
+    }
+
+    print(f"\nAvg per page: {report['avg_full_ms']}ms -> {report['avg_detection_ms']}ms "
+          f"(saved {report['avg_saved_ms']}ms, x{report['speedup']})")
+    return report
+
+def benchmark_render(args):
+    """Pixels/time/disk per book: full-page render vs two-pass render (low-DPI pages + high-DPI clips)"""
+    import time
+    import tempfile
+    from config import Config
+    from modules.pdf_processor import PDFProcessor
+    from modules.yolo_processor import YOLOProcessor
+
+    if not os.path.exists(args.pdf_path):
+        print(f"❌ PDF not found: {args.pdf_path}")
+        return None
+
+    config = Config()
+    yolo_processor = YOLOProcessor(config=config)
+    success, message = yolo_processor.load_model()
+    if not success:
+        print(f"❌ {message}")
+        return None
+
+    pdf_processor = PDFProcessor()
+    pdf_processor.set_max_workers(yolo_processor.backend.cpu_budget.pdf_workers)
+    report = {"pdf": args.pdf_path}
+
+    for mode in ["full", "two_pass"]:
+        pdf_processor.set_dpi(args.crop_dpi)
+        pdf_processor.set_render_mode(mode, args.detection_dpi, args.crop_dpi)
+
+        with tempfile.TemporaryDirectory() as work_dir:
+            images_dir = os.path.join(work_dir, "pages")
+            start_time = time.perf_counter()
+            success, message, pdf_info = pdf_processor.convert_to_images(args.pdf_path, images_dir)
+            if not success:
+                print(f"❌ {message}")
+                return None
+            render_time = time.perf_counter() - start_time
+
+            success, message, yolo_info = yolo_processor.process_images(images_dir, work_dir, "benchmark")
+            if not success:
+                print(f"❌ {message}")
+                return None
+            total_time = time.perf_counter() - start_time
+
+            stats = yolo_info["render_stats"]
+            crop_bytes = sum(
+                os.path.getsize(os.path.join(root, name))
+                for root, _, files in os.walk(yolo_info["cropped_dir"]) for name in files
+            )
+            report[mode] = {
+                "pages": pdf_info["total_pages"],
+                "page_render_s": round(render_time, 2),
+                "render_detect_crop_s": round(total_time, 2),
+                "page_pixels": stats["page_pixels"],
+                "crop_pixels": stats["crop_pixels"],
+                "total_pixels_rendered": stats["total_pixels_rendered"],
+                "page_image_bytes": stats["page_image_bytes"],
+                "crop_bytes": crop_bytes
+            }
+
+    full, two_pass = report["full"], report["two_pass"]
+    report["pixel_savings"] = round(1 - two_pass["total_pixels_rendered"] / full["total_pixels_rendered"], 4)
+    report["disk_savings"] = round(
+        1 - (two_pass["page_image_bytes"] + two_pass["crop_bytes"]) / (full["page_image_bytes"] + full["crop_bytes"]), 4
+    )
+
+    print(f"\n{'Mode':<10} {'Pages':>6} {'Render s':>9} {'Total s':>8} {'Pixels (M)':>11} {'Disk (MB)':>10}")
+    for mode in ["full", "two_pass"]:
+        entry = report[mode]
+        print(f"{mode:<10} {entry['pages']:>6} {entry['page_render_s']:>9} {entry['render_detect_crop_s']:>8} "
+              f"{entry['total_pixels_rendered'] / 1e6:>11.1f} "
+              f"{(entry['page_image_bytes'] + entry['crop_bytes']) / 1e6:>10.1f}")
+    print(f"Pixels rendered: -{report['pixel_savings'] * 100:.1f}%, disk: -{report['disk_savings'] * 100:.1f}%")
+    return report
+
+def _make_synthetic_book(root: str, book: str, count: int, size: tuple, per_folder: int = 10):
+    """Write `count` noise crops (PNG) into books_cropped/<book>/image_XXXX folders"""
+    from PIL import Image
+
+    for index in range(count):
+        folder = os.path.join(root, "books_cropped", book, f"image_{index // per_folder + 1:04d}")
+        os.makedirs(folder, exist_ok=True)
+        Image.effect_noise(size, 48).save(
+            os.path.join(folder, f"crop_{index % per_folder:03d}_cls{index % 3}.png"), optimize=True
+        )
+
+class _BrowserCache:
+    """Minimal HTTP cache: honours max-age/immutable and revalidates with If-None-Match"""
+
+    def __init__(self, client):
+        self.client = client
+        self.entries = {}
+
+    def get(self, url: str) -> dict:
+        """Fetch url like a browser would; returns what went over the wire"""
+        cached = self.entries.get(url)
+        if cached and cached["fresh"]:
+            return {"requests": 0, "bytes": 0, "not_modified": 0}
+
+        headers = {"If-None-Match": cached["etag"]} if cached and cached["etag"] else {}
+        response = self.client.get(url, headers=headers)
+        header_bytes = sum(len(name) + len(value) + 4 for name, value in response.headers.items())
+        body_bytes = len(response.get_data())
+
+        if response.status_code == 200:
+            cache_control = response.cache_control
+            self.entries[url] = {
+                "etag": response.headers.get("ETag"),
+                "fresh": bool(cache_control.max_age) and not cache_control.no_cache
+            }
+        return {
+            "requests": 1,
+            "bytes": header_bytes + body_bytes,
+            "not_modified": int(response.status_code == 304)
+        }
+
+def benchmark_http_cache(args):
+    """Bytes transferred on first and repeat gallery views of a book: no caching vs ETag vs immutable URLs"""
+    import tempfile
+
+    original_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        width, height = (int(value) for value in args.size.lower().split("x"))
+        print(f"🔬 Generating {args.images} crops of {width}x{height} ...")
+        _make_synthetic_book(work_dir, "benchmark", args.images, (width, height))
+
+        # app.py resolves books relative to the working directory
+        os.chdir(work_dir)
+        try:
+            report = _measure_http_cache(args)
+        finally:
+            os.chdir(original_cwd)
+
+    print(f"\n{args.images} images, {report['image_bytes'] / 1e6:.1f} MB on disk")
+    print(f"{'Strategy':<20} {'1st MB':>8} {'Repeat requests':>16} {'Repeat 304':>11} {'Repeat KB':>10}")
+    for name in ("no_cache", "etag_revalidate", "immutable_versioned"):
+        first, repeat = report[name]["first_view"], report[name]["repeat_view"]
+        print(f"{name:<20} {first['bytes'] / 1e6:>8.2f} {repeat['requests']:>16} "
+              f"{repeat['not_modified']:>11} {repeat['bytes'] / 1e3:>10.1f}")
+    return report
+
+def _measure_http_cache(args) -> dict:
+    """Run the first/repeat view simulation against app.py in the current directory"""
+    os.environ.setdefault("DEEPSEAK_API_KEY", "benchmark")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as web_app
+
+    client = web_app.app.test_client()
+    urls, offset = [], 0
+    while offset is not None:
+        page = client.get(f"/api/gallery/cropped?book=benchmark&limit=500&offset={offset}").get_json()
+        urls.extend(image["url"] for image in page["images"])
+        offset = page["next_offset"]
+    plain_urls = [url.split("?")[0] for url in urls]
+
+    strategies = {
+        # Browser that re-downloads everything (e.g. cache disabled / no validators honoured)
+        "no_cache": (plain_urls, False),
+        # Unversioned URLs: every image revalidated, server answers 304
+        "etag_revalidate": (plain_urls, True),
+        # Versioned URLs from the gallery API: served immutable, repeat view hits the browser cache
+        "immutable_versioned": (urls, True)
+    }
+
+    report = {"images": len(urls), "image_bytes": sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, files in os.walk("books_cropped") for name in files if name.endswith(".png")
+    )}
+    for name, (strategy_urls, use_cache) in strategies.items():
+        browser = _BrowserCache(client)
+        views = []
+        for _ in range(2):
+            if not use_cache:
+                browser.entries.clear()
+            totals = {"requests": 0, "bytes": 0, "not_modified": 0}
+            for url in strategy_urls:
+                for key, value in browser.get(url).items():
+                    totals[key] += value
+            views.append(totals)
+        report[name] = {"first_view": views[0], "repeat_view": views[1]}
+    return report
+
+def main():
+    """Performance benchmarks for the processing pipeline"""
+    parser = argparse.ArgumentParser(description='Benchmarks for the document processing pipeline')
+    parser.add_argument('--output', help='Save benchmark report as JSON')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    backends_parser = subparsers.add_parser('backends', help='Compare CPU inference backends against PyTorch CPU')
+    backends_parser.add_argument('images_dir', help='Folder of rendered page images')
+    backends_parser.add_argument('--backends', nargs='+', default=['onnx', 'openvino'],
+                                 choices=['onnx', 'openvino'], help='Backends to compare (default: onnx openvino)')
+    backends_parser.add_argument('--int8', action='store_true', help='Benchmark INT8-quantized exports')
+    backends_parser.add_argument('--limit', type=int, default=20, help='Max images to benchmark (default: 20)')
+    backends_parser.set_defaults(func=benchmark_backends)
+
+    decode_parser = subparsers.add_parser('decode', help='Measure decode+resize savings of detection-resolution loading')
+    decode_parser.add_argument('images_dir', help='Folder of rendered page images')
+    decode_parser.add_argument('--imgsz', type=int, default=1024, help='Detection long side (default: 1024)')
+    decode_parser.add_argument('--limit', type=int, default=50, help='Max images to benchmark (default: 50)')
+    decode_parser.set_defaults(func=benchmark_decode)
+
+    render_parser = subparsers.add_parser('render', help='Compare full-page vs two-pass PDF rendering for one book')
+    render_parser.add_argument('pdf_path', help='PDF file to render')
+    render_parser.add_argument('--detection-dpi', type=int, default=100, help='Page DPI for detection (default: 100)')
+    render_parser.add_argument('--crop-dpi', type=int, default=300, help='DPI of full pages / crops (default: 300)')
+    render_parser.set_defaults(func=benchmark_render)
+
+    http_parser = subparsers.add_parser('http-cache', help='Bytes transferred on repeat gallery views of a synthetic book')
+    http_parser.add_argument('--images', type=int, default=2000, help='Crops in the synthetic book (default: 2000)')
+    http_parser.add_argument('--size', default='300x100', help='Crop size WxH (default: 300x100)')
+    http_parser.set_defaults(func=benchmark_http_cache)
+
+    args = parser.parse_args()
+    report = args.func(args)
+
+    if report is None:
+        sys.exit(1)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"📄 Report saved: {args.output}")
+
+if __name__ == "__main__":
+    main()
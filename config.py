@@ -8,7 +8,29 @@ class Config:
     YOLO_REPO_ID = "juliozhao/DocLayout-YOLO-DocStructBench"
     YOLO_FILENAME = "doclayout_yolo_docstructbench_imgsz1024.pt"
     YOLO_IMAGE_SIZE = 1024
-    YOLO_DEVICE = "cuda"
+    YOLO_DEVICE = "auto"  # "auto", "cuda", "cuda:N", "mps" or "cpu" (falls back to CPU if missing)
+    
+    # Inference Backend - "pytorch", "onnx" (ONNX Runtime) or "openvino" (both run on CPU)
+    YOLO_BACKEND = "pytorch"
+    YOLO_EXPORT_DIR = "models"  # Exported ONNX/OpenVINO models are cached here
+    YOLO_INT8 = False  # ONNX: dynamic quantization, OpenVINO: needs calibration data
+    YOLO_INT8_CALIBRATION_DATA = None  # Dataset yaml for OpenVINO INT8 calibration
+    
+    # CPU Thread Budget - cores shared by YOLO inference, crop workers and PDF render processes
+    CPU_THREADS = None  # None = all cores available to the process
+    CPU_BUDGET_SHARES = {"yolo": 0.5, "crop": 0.25, "pdf": 0.25}  # Used when YOLO runs on CPU
+
+    # Detection Resolution - decode a YOLO_IMAGE_SIZE copy of each page for detection,
+    # crops are still taken from the full-resolution page with rescaled boxes
+    DETECTION_DOWNSCALE = True
+    DETECTION_BATCH_SIZE = 16  # Pages decoded and predicted per batch in the web pipeline
+
+    # PDF Render Mode (web pipeline) - "full" renders whole pages at 300 DPI,
+    # "two_pass" renders pages at PDF_DETECTION_DPI for YOLO and only the detected
+    # regions at PDF_CROP_DPI (fitz clip) for crops/OCR
+    PDF_RENDER_MODE = "full"
+    PDF_DETECTION_DPI = 100
+    PDF_CROP_DPI = 300
     
     # Detection Settings - COMPLETE VERSION
     IOU_THRESHOLD = 0.7
@@ -16,15 +38,40 @@ class Config:
     TARGET_CLASSES = None  # None = detect all classes, [0,1,2] = specific classes
     OCR_CLASSES = [0, 1, 2]  # Classes that need OCR processing
     
+    # PDF Text Layer - born-digital pages take box text from the PDF, the vision API
+    # is only called when the text layer is missing, garbled or the box is an image
+    USE_PDF_TEXT_LAYER = True
+    TEXT_LAYER_MIN_CHARS = 2
+    TEXT_LAYER_MAX_GARBAGE_RATIO = 0.1  # Broken glyph/legacy font characters allowed
+    TEXT_LAYER_MAX_IMAGE_COVERAGE = 0.5  # Box mostly covered by an embedded image -> OCR
+    
     # DeepSeek Vision API
     DEEPSEAK_API_ENDPOINT = "https://ark.ap-southeast.bytepluses.com/api/v3/chat/completions"
     DEEPSEAK_API_KEY = os.getenv("DEEPSEAK_API_KEY")
     DEEPSEAK_MODEL = "skylark-vision-250515"
+    OCR_MAX_IN_FLIGHT = 8  # Vision API requests in flight at once (OCRStage, shared by all jobs)
     
     # OpenAI API
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
     OPENAI_MODEL = "gpt-4"
     
+    # Job Scheduler (web) - uploads are queued in SQLite and resumed after a restart
+    JOB_DB_PATH = "jobs.db"
+    JOB_MAX_CONCURRENT = 2  # Jobs running at the same time
+    JOB_STAGE_CONCURRENCY = {"pdf": 1, "yolo": 1, "ocr": 2}  # Jobs allowed inside each stage
+    
+    # PDF Folder Mode (CLI run.py) - books processed at the same time; one book renders while
+    # others detect (one model call at a time) or wait on OCR (OCR_MAX_IN_FLIGHT)
+    CLI_PARALLEL_BOOKS = 3
+    CLI_RENDER_SLOTS = 1  # Books rendering pages at once, each with the CPU budget's pdf workers
+    
+    # Processing Status (web) - finished jobs are dropped after STATUS_TTL seconds
+    STATUS_TTL = 3600
+    STATUS_MAX_ENTRIES = 500
+    STATUS_PERSIST_PATH = "processing_status.json"  # None = keep statuses in memory only
+    STATUS_STREAM_INTERVAL = 0.25  # Min seconds between two progress events of one job (SSE)
+    STATUS_STREAM_KEEPALIVE = 15  # Seconds between keepalive comments on an idle stream
+    
     # Retry Settings
     MAX_RETRIES = 5
     RETRY_DELAY = 2  # seconds
@@ -0,0 +1,214 @@
+# modules/book_checkpoint.py
+import os
+import json
+import time
+import copy
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class BookCheckpoint:
+    """
+    Checkpoint theo trang của một sách (books_cropped/<book>/checkpoint.json).
+
+    - Mỗi trang ghi lại các bước đã xong: render → detect → crop → ocr, kèm hash đầu vào của bước.
+      Hash nối tiếp nhau: render ← nội dung trang PDF + thiết lập render, detect ← render + model,
+      crop ← detect, ocr ← crop + model OCR. Trang PDF đổi (hoặc đổi DPI/model) thì mọi bước sau đổi theo.
+    - Một bước chỉ được bỏ qua khi hash đầu vào khớp và các file đầu ra của nó vẫn còn trên disk.
+    - Ghi file (temp file + rename) tối đa mỗi SAVE_INTERVAL giây, flush() khi hết mỗi bước;
+      process chết giữa chừng chỉ mất vài trang đã xong chứ không làm checkpoint hỏng.
+    """
+
+    FILENAME = "checkpoint.json"
+    VERSION = 1
+    STAGES = ('render', 'detect', 'crop', 'ocr')
+    SAVE_INTERVAL = 2.0
+
+    def __init__(self, book_name, cropped_root="books_cropped"):
+        """
+        Args:
+            book_name (str): Tên sách
+            cropped_root (str): Thư mục chứa các sách đã crop
+        """
+        self.book_name = book_name
+        self.book_dir = os.path.join(cropped_root, book_name)
+        self.path = os.path.join(self.book_dir, self.FILENAME)
+        self._lock = threading.Lock()
+        self._data = self._load() or self._empty()
+        self._dirty = False
+        self._last_save = 0.0
+
+    # === HASH ===
+    @staticmethod
+    def input_hash(*parts):
+        """sha1 của các thành phần đầu vào (str/dict/list đều được)"""
+        raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    # === LƯU / ĐỌC ===
+    def _empty(self):
+        return {'version': self.VERSION, 'pages': {}}
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == self.VERSION:
+                return data
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Không đọc được {self.path}, xử lý lại từ đầu: {e}")
+        return None
+
+    def _save_locked(self):
+        os.makedirs(self.book_dir, exist_ok=True)
+        tmp_path = f"{self.path}.tmp{os.getpid()}"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+            self._last_save = time.monotonic()
+        except OSError as e:
+            logger.warning(f"Không lưu được {self.path}: {e}")
+
+    def flush(self):
+        """Ghi các bước đã đánh dấu nhưng chưa lưu"""
+        with self._lock:
+            if self._dirty:
+                self._save_locked()
+
+    # === TRẠNG THÁI TỪNG TRANG ===
+    def record(self, page_no, stage):
+        """Bản sao record của một bước (None nếu chưa xong)"""
+        with self._lock:
+            record = self._data['pages'].get(str(page_no), {}).get(stage)
+            return copy.deepcopy(record) if record is not None else None
+
+    def is_done(self, page_no, stage, input_hash):
+        """Bước đã xong với đúng đầu vào này và file đầu ra còn nguyên"""
+        record = self.record(page_no, stage)
+        if record is None or record['input'] != input_hash:
+            return False
+        return all(os.path.exists(path) for path in record.get('outputs', []))
+
+    def mark(self, page_no, stage, input_hash, outputs=(), **data):
+        """
+        Đánh dấu một bước của trang đã xong
+
+        Args:
+            page_no (int): Số trang (1-based)
+            stage (str): Một trong STAGES
+            input_hash (str): Hash đầu vào của bước
+            outputs (iterable): File/thư mục đầu ra, phải còn tồn tại thì bước mới được bỏ qua lần sau
+            **data: Dữ liệu kèm theo (vd. box của bước detect)
+        """
+        if stage not in self.STAGES:
+            raise ValueError(f"Bước không hợp lệ: {stage}")
+        with self._lock:
+            page = self._data['pages'].setdefault(str(page_no), {})
+            page[stage] = {'input': input_hash, 'outputs': [str(path) for path in outputs],
+                           'done_at': time.time(), **data}
+            self._dirty = True
+            if time.monotonic() - self._last_save >= self.SAVE_INTERVAL:
+                self._save_locked()
+
+    def diff_pages(self, page_hashes):
+        """
+        So hash nội dung các trang của PDF mới với lần render trước (gọi trước khi đánh dấu render mới)
+
+        Trang được ghép theo hash nội dung chứ không theo vị trí: chèn/xóa một trang ở giữa sách
+        chỉ làm các trang phía sau dời chỗ (moved), không bị coi là đổi nội dung.
+
+        Args:
+            page_hashes (list): Hash từng trang của PDF mới (PDFProcessor.page_hashes)
+
+        Returns:
+            dict: {'previous_pages', 'total_pages', 'unchanged', 'changed', 'added', 'removed', 'moved'}
+                  - số trang 1-based. moved: [[trang cũ, trang mới]] cùng nội dung nhưng khác vị trí;
+                  changed: trang sửa tại chỗ; added / removed: nội dung mới / nội dung không còn trong PDF
+        """
+        with self._lock:
+            previous = {
+                int(page_no): page['render'].get('page_hash')
+                for page_no, page in self._data['pages'].items() if 'render' in page
+            }
+        report = {'previous_pages': max(previous, default=0), 'total_pages': len(page_hashes),
+                  'unchanged': [], 'changed': [], 'added': [], 'removed': [], 'moved': []}
+
+        # Trang cũ còn chưa ghép theo hash (nhiều trang có thể trùng nội dung, vd. trang trắng)
+        unmatched = {}
+        for page_no in sorted(previous):
+            if previous[page_no] is not None:
+                unmatched.setdefault(previous[page_no], []).append(page_no)
+
+        matched = {}
+        for page_no, page_hash in enumerate(page_hashes, 1):
+            if previous.get(page_no) == page_hash and page_no in unmatched.get(page_hash, []):
+                unmatched[page_hash].remove(page_no)
+                matched[page_no] = page_no
+        for page_no, page_hash in enumerate(page_hashes, 1):
+            if page_no not in matched and unmatched.get(page_hash):
+                matched[page_no] = unmatched[page_hash].pop(0)
+
+        gone = {page_no for page_nos in unmatched.values() for page_no in page_nos}
+        gone |= {page_no for page_no, page_hash in previous.items() if page_hash is None}
+        for page_no in range(1, len(page_hashes) + 1):
+            if matched.get(page_no) == page_no:
+                report['unchanged'].append(page_no)
+            elif page_no in matched:
+                report['moved'].append([matched[page_no], page_no])
+            elif page_no in gone:
+                # Nội dung cũ ở vị trí này không còn ở đâu trong PDF: trang được sửa tại chỗ
+                gone.discard(page_no)
+                report['changed'].append(page_no)
+            else:
+                report['added'].append(page_no)
+        report['removed'] = sorted(gone)
+        return report
+
+    def move_pages(self, moves, rewrite):
+        """
+        Chuyển record của các trang dời chỗ sang số trang mới
+
+        Args:
+            moves (list): [[trang cũ, trang mới]] (diff_pages()['moved'])
+            rewrite (callable): rewrite(stage, record, old_page_no, new_page_no) -> record đã sửa
+                                (đường dẫn đầu ra, hash đầu vào phụ thuộc vị trí)
+        """
+        if not moves:
+            return
+        with self._lock:
+            pages = self._data['pages']
+            moved = {
+                new_page_no: copy.deepcopy(pages.get(str(old_page_no), {}))
+                for old_page_no, new_page_no in moves
+            }
+            for old_page_no, _ in moves:
+                pages.pop(str(old_page_no), None)
+            for old_page_no, new_page_no in moves:
+                pages[str(new_page_no)] = {
+                    stage: rewrite(stage, record, old_page_no, new_page_no)
+                    for stage, record in moved[new_page_no].items()
+                }
+            self._dirty = True
+            self._save_locked()
+
+    def set_page_count(self, total_pages):
+        """Bỏ record của các trang không còn trong PDF hiện tại"""
+        with self._lock:
+            pages = self._data['pages']
+            removed = [page_no for page_no in pages if int(page_no) > total_pages]
+            for page_no in removed:
+                del pages[page_no]
+            if removed:
+                self._dirty = True
+
+    def summary(self):
+        """Số trang đã xong của từng bước"""
+        with self._lock:
+            pages = self._data['pages'].values()
+            return {stage: sum(1 for page in pages if stage in page) for stage in self.STAGES}
@@ -2,13 +2,30 @@
 import os
 import time
 import re
+from collections import Counter
 from pathlib import Path
+from .gallery_manifest import get_book_manifest
 
 class GalleryManager:
+    # Tham số phân trang/lọc của /api/gallery/detection và /api/gallery/cropped
+    PAGE_ARGS = ('offset', 'limit', 'sort', 'class', 'folder', 'date_from', 'date_to', 'q')
+    DEFAULT_PAGE_SIZE = 60
+    MAX_PAGE_SIZE = 500
+    THUMBNAIL_SIZE = 320
+    SORT_KEYS = {
+        'name': lambda row: (row[1], row[0] or ''),
+        'date': lambda row: (row[3], row[1]),
+        'size': lambda row: (row[2], row[1])
+    }
+    
     def __init__(self):
         self.books_detections_dir = "books_detections"
         self.books_cropped_dir = "books_cropped"
     
+    def _manifest(self, book_name):
+        """Manifest ảnh (crop + detection) của sách"""
+        return get_book_manifest(book_name, self.books_cropped_dir, self.books_detections_dir)
+    
     def get_available_books(self):
         """
         Lấy danh sách các sách có sẵn cho Gallery
@@ -58,24 +75,9 @@ class GalleryManager:
             if not os.path.exists(detection_dir):
                 return {'success': True, 'images': [], 'message': f'Thư mục {detection_dir} không tồn tại'}
             
-            # Lấy tất cả file ảnh trong thư mục
-            for file in sorted(os.listdir(detection_dir)):
-                if file.lower().endswith(('.jpg', '.jpeg', '.png')):
-                    file_path = os.path.join(detection_dir, file)
-                    
-                    try:
-                        file_stat = os.stat(file_path)
-                        
-                        images.append({
-                            'name': file,
-                            'url': f"/detection_images/{book_name}/{file}",
-                            'path': file_path,
-                            'size': f"{file_stat.st_size / 1024:.1f} KB",
-                            'date': time.strftime('%Y-%m-%d %H:%M', time.localtime(file_stat.st_mtime))
-                        })
-                    except Exception as e:
-                        print(f"Error processing file {file}: {e}")
-                        continue
+            # Danh sách file lấy từ manifest (không listdir + stat từng ảnh mỗi request)
+            for file, size, mtime in self._manifest(book_name).detection_files():
+                images.append(self._detection_item(book_name, file, size, mtime))
             
             return {'success': True, 'images': images}
             
@@ -102,41 +104,207 @@ class GalleryManager:
             if not os.path.exists(cropped_dir):
                 return {'success': True, 'images': [], 'message': f'Thư mục {cropped_dir} không tồn tại'}
             
-            # Duyệt qua các thư mục image_xxxx
-            for folder in sorted(os.listdir(cropped_dir)):
-                folder_path = os.path.join(cropped_dir, folder)
-                
-                if os.path.isdir(folder_path) and folder.startswith('image_'):
-                    # Duyệt qua các file ảnh trong thư mục
-                    for file in sorted(os.listdir(folder_path)):
-                        if file.lower().endswith('.png'):
-                            file_path = os.path.join(folder_path, file)
-                            
-                            try:
-                                file_stat = os.stat(file_path)
-                                
-                                # Extract class từ tên file (crop_xxx_clsN.png)
-                                class_match = re.search(r'cls(\d+)', file)
-                                class_id = int(class_match.group(1)) if class_match else None
-                                
-                                images.append({
-                                    'name': file,
-                                    'folder': folder,
-                                    'url': f"/images/{self.books_cropped_dir}/{book_name}/{folder}/{file}",
-                                    'path': file_path,
-                                    'size': f"{file_stat.st_size / 1024:.1f} KB",
-                                    'date': time.strftime('%Y-%m-%d %H:%M', time.localtime(file_stat.st_mtime)),
-                                    'class': class_id
-                                })
-                            except Exception as e:
-                                print(f"Error processing file {file}: {e}")
-                                continue
+            # Duyệt các crop theo manifest (thứ tự folder image_xxxx rồi tên file)
+            for folder, file, size, mtime, class_id in self._manifest(book_name).cropped_files():
+                images.append(self._cropped_item(book_name, folder, file, size, mtime, class_id))
             
             return {'success': True, 'images': images}
             
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
+    @staticmethod
+    def image_version(mtime):
+        """Tham số v của URL ảnh/thumbnail: đổi khi file đổi nên URL có v được cache immutable"""
+        return str(int(mtime * 1000))
+    
+    def _thumbnail_url(self, kind, relative_path, mtime):
+        """URL thumbnail cho grid; v theo mtime để cache phía trình duyệt không bị cũ"""
+        return f"/thumbnails/{kind}/{relative_path}?size={self.THUMBNAIL_SIZE}&v={self.image_version(mtime)}"
+    
+    def _detection_item(self, book_name, file, size, mtime):
+        return {
+            'name': file,
+            'url': f"/detection_images/{book_name}/{file}?v={self.image_version(mtime)}",
+            'thumb_url': self._thumbnail_url('detection', f"{book_name}/{file}", mtime),
+            'path': os.path.join(self.books_detections_dir, book_name, file),
+            'size': f"{size / 1024:.1f} KB",
+            'date': time.strftime('%Y-%m-%d %H:%M', time.localtime(mtime))
+        }
+    
+    def _cropped_item(self, book_name, folder, file, size, mtime, class_id):
+        return {
+            'name': file,
+            'folder': folder,
+            'url': f"/images/{self.books_cropped_dir}/{book_name}/{folder}/{file}?v={self.image_version(mtime)}",
+            'thumb_url': self._thumbnail_url('cropped', f"{book_name}/{folder}/{file}", mtime),
+            'path': os.path.join(self.books_cropped_dir, book_name, folder, file),
+            'size': f"{size / 1024:.1f} KB",
+            'date': time.strftime('%Y-%m-%d %H:%M', time.localtime(mtime)),
+            'class': class_id
+        }
+    
+    # === PHÂN TRANG / LỌC ===
+    @staticmethod
+    def _parse_date(value, end_of_day=False):
+        """'YYYY-MM-DD' → timestamp (giờ địa phương); end_of_day lấy mốc đầu ngày hôm sau"""
+        try:
+            timestamp = time.mktime(time.strptime(value, '%Y-%m-%d'))
+        except ValueError:
+            raise ValueError(f"Ngày không hợp lệ: {value} (định dạng YYYY-MM-DD)")
+        return timestamp + 86400 if end_of_day else timestamp
+    
+    def parse_page_args(self, args):
+        """
+        Đọc tham số phân trang/lọc từ query string
+        
+        Args:
+            args: request.args (hoặc dict)
+            
+        Returns:
+            dict: offset, limit, sort, descending, class_id, folder, date_from, date_to, q
+            
+        Raises:
+            ValueError: Tham số không hợp lệ
+        """
+        try:
+            offset = int(args.get('offset') or 0)
+            limit = int(args.get('limit') or self.DEFAULT_PAGE_SIZE)
+            class_id = args.get('class')
+            class_id = int(class_id) if class_id not in (None, '') else None
+        except ValueError:
+            raise ValueError("offset, limit và class phải là số nguyên")
+        if offset < 0 or limit < 1:
+            raise ValueError("offset phải >= 0 và limit phải >= 1")
+        
+        sort = args.get('sort') or 'name'
+        descending = sort.startswith('-')
+        sort = sort.lstrip('-')
+        if sort not in self.SORT_KEYS:
+            raise ValueError(f"sort phải là một trong: {', '.join(self.SORT_KEYS)}")
+        
+        date_from = args.get('date_from')
+        date_to = args.get('date_to')
+        return {
+            'offset': offset,
+            'limit': min(limit, self.MAX_PAGE_SIZE),
+            'sort': sort,
+            'descending': descending,
+            'class_id': class_id,
+            'folder': args.get('folder') or None,
+            'date_from': self._parse_date(date_from) if date_from else None,
+            'date_to': self._parse_date(date_to, end_of_day=True) if date_to else None,
+            'q': (args.get('q') or '').strip().lower() or None
+        }
+    
+    def _query_rows(self, rows, query):
+        """
+        Lọc + sắp xếp + cắt trang trên danh sách của manifest
+        
+        Args:
+            rows (list): [(folder, name, size, mtime, class_id)] - folder/class là None với ảnh detection
+            query (dict): Kết quả parse_page_args
+            
+        Returns:
+            tuple: (rows của trang, tổng số sau lọc)
+        """
+        class_id = query['class_id']
+        folder = query['folder']
+        date_from = query['date_from']
+        date_to = query['date_to']
+        q = query['q']
+        
+        matched = [
+            row for row in rows
+            if (class_id is None or row[4] == class_id)
+            and (folder is None or row[0] == folder)
+            and (date_from is None or row[3] >= date_from)
+            and (date_to is None or row[3] < date_to)
+            and (q is None or q in row[1].lower())
+        ]
+        matched.sort(key=self.SORT_KEYS[query['sort']], reverse=query['descending'])
+        
+        start = query['offset']
+        return matched[start:start + query['limit']], len(matched)
+    
+    @staticmethod
+    def _page_result(images, total, query):
+        end = query['offset'] + len(images)
+        return {
+            'success': True,
+            'images': images,
+            'total': total,
+            'offset': query['offset'],
+            'limit': query['limit'],
+            'next_offset': end if end < total else None
+        }
+    
+    def query_detection_images(self, book_name, args):
+        """
+        Một trang ảnh detection (lọc theo ngày / tên file, sắp xếp phía server)
+        
+        Args:
+            book_name (str): Tên sách
+            args: Tham số phân trang/lọc (xem PAGE_ARGS)
+            
+        Returns:
+            dict: {'success', 'images', 'total', 'offset', 'limit', 'next_offset'}
+            
+        Raises:
+            ValueError: Tham số không hợp lệ
+        """
+        if not book_name:
+            return {'success': False, 'error': 'Thiếu tên sách'}
+        query = self.parse_page_args(args)
+        
+        if not os.path.exists(os.path.join(self.books_detections_dir, book_name)):
+            return self._page_result([], 0, query)
+        
+        rows = [(None, file, size, mtime, None) for file, size, mtime in self._manifest(book_name).detection_files()]
+        page, total = self._query_rows(rows, query)
+        images = [self._detection_item(book_name, file, size, mtime) for _, file, size, mtime, _ in page]
+        return self._page_result(images, total, query)
+    
+    def query_cropped_images(self, book_name, args):
+        """
+        Một trang ảnh crop, lọc theo class id / folder / ngày / tên file.
+        Trang đầu (offset=0) kèm facets: số ảnh theo folder và theo class của cả sách.
+        
+        Args:
+            book_name (str): Tên sách
+            args: Tham số phân trang/lọc (xem PAGE_ARGS)
+            
+        Returns:
+            dict: {'success', 'images', 'total', 'offset', 'limit', 'next_offset', 'facets'?}
+            
+        Raises:
+            ValueError: Tham số không hợp lệ
+        """
+        if not book_name:
+            return {'success': False, 'error': 'Thiếu tên sách'}
+        query = self.parse_page_args(args)
+        
+        if not os.path.exists(os.path.join(self.books_cropped_dir, book_name)):
+            result = self._page_result([], 0, query)
+            if query['offset'] == 0:
+                result['facets'] = {'total': 0, 'folders': [], 'classes': []}
+            return result
+        
+        rows = self._manifest(book_name).cropped_files()
+        page, total = self._query_rows(rows, query)
+        images = [self._cropped_item(book_name, *row) for row in page]
+        result = self._page_result(images, total, query)
+        
+        if query['offset'] == 0:
+            folder_counts = Counter(row[0] for row in rows)
+            class_counts = Counter(row[4] for row in rows if row[4] is not None)
+            result['facets'] = {
+                'total': len(rows),
+                'folders': [{'name': name, 'count': folder_counts[name]} for name in sorted(folder_counts)],
+                'classes': [{'class': cls, 'count': class_counts[cls]} for cls in sorted(class_counts)]
+            }
+        return result
+    
     def get_book_info(self, book_name):
         """
         Lấy thông tin tổng quan về một sách
@@ -160,35 +328,9 @@ class GalleryManager:
                 'folders_count': 0
             }
             
-            # Đếm ảnh detection
-            if info['has_detection']:
-                try:
-                    detection_files = [f for f in os.listdir(detection_dir) 
-                                     if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-                    info['detection_count'] = len(detection_files)
-                except:
-                    pass
-            
-            # Đếm ảnh crop và folder
-            if info['has_cropped']:
-                try:
-                    folders = [f for f in os.listdir(cropped_dir) 
-                             if os.path.isdir(os.path.join(cropped_dir, f)) and f.startswith('image_')]
-                    info['folders_count'] = len(folders)
-                    
-                    # Đếm tổng số ảnh crop
-                    total_cropped = 0
-                    for folder in folders:
-                        folder_path = os.path.join(cropped_dir, folder)
-                        try:
-                            cropped_files = [f for f in os.listdir(folder_path) 
-                                           if f.lower().endswith('.png')]
-                            total_cropped += len(cropped_files)
-                        except:
-                            continue
-                    info['cropped_count'] = total_cropped
-                except:
-                    pass
+            # Đếm ảnh detection / crop / folder từ manifest
+            if info['has_detection'] or info['has_cropped']:
+                info.update(self._manifest(book_name).counts())
             
             return info
             
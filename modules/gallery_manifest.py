@@ -0,0 +1,215 @@
+# modules/gallery_manifest.py
+import os
+import re
+import json
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class BookManifest:
+    """
+    Manifest ảnh của một sách cho Gallery (crop + detection): tên file, size, mtime, class id.
+
+    - Được dựng lại ngay khi xử lý xong (ProcessingManager gọi rebuild()) và lưu ra
+      books_cropped/<book>/gallery_manifest.json để dùng lại sau khi restart server.
+    - Mỗi request chỉ stat thư mục crop + thư mục detection của sách (O(1) thao tác disk).
+      Khi mtime thư mục sách đổi, hoặc sau VERIFY_INTERVAL giây, mtime của từng folder
+      image_XXXX được so lại và chỉ folder đổi mới bị listdir + stat lại.
+    """
+
+    FILENAME = "gallery_manifest.json"
+    VERSION = 1
+    VERIFY_INTERVAL = 30.0  # giây
+    IMAGE_FOLDER_PREFIX = "image_"
+    CROP_EXTENSIONS = ('.png',)
+    DETECTION_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+    CLASS_PATTERN = re.compile(r'cls(\d+)')
+
+    def __init__(self, book_name, cropped_root="books_cropped", detections_root="books_detections"):
+        """
+        Args:
+            book_name (str): Tên sách
+            cropped_root (str): Thư mục chứa các sách đã crop
+            detections_root (str): Thư mục chứa ảnh detection
+        """
+        self.book_name = book_name
+        self.cropped_dir = os.path.join(cropped_root, book_name)
+        self.detection_dir = os.path.join(detections_root, book_name)
+        self.manifest_path = os.path.join(self.cropped_dir, self.FILENAME)
+        self._lock = threading.Lock()
+        self._data = None
+        self._last_verify = 0.0
+        self._cropped_list = None
+
+    # === LƯU / ĐỌC ===
+    def _empty(self):
+        return {
+            'version': self.VERSION,
+            'cropped': {'dir_mtime_ns': None, 'folders': {}},
+            'detection': {'dir_mtime_ns': None, 'files': []}
+        }
+
+    def _load(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == self.VERSION:
+                return data
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def _save(self):
+        if not os.path.isdir(self.cropped_dir):
+            return
+        tmp_path = f"{self.manifest_path}.tmp{os.getpid()}"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.manifest_path)
+        except OSError as e:
+            logger.warning(f"Không lưu được {self.manifest_path}: {e}")
+
+    # === QUÉT ===
+    @staticmethod
+    def _dir_mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _scan_files(self, folder_path, extensions, with_class=False):
+        """[[name, size, mtime, class_id?], ...] sắp theo tên"""
+        files = []
+        with os.scandir(folder_path) as entries:
+            for entry in entries:
+                if not entry.is_file() or not entry.name.lower().endswith(extensions):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                item = [entry.name, stat.st_size, stat.st_mtime]
+                if with_class:
+                    match = self.CLASS_PATTERN.search(entry.name)
+                    item.append(int(match.group(1)) if match else None)
+                files.append(item)
+        files.sort(key=lambda item: item[0])
+        return files
+
+    def _verify_cropped(self, cropped_mtime):
+        """So mtime từng folder image_XXXX, chỉ quét lại folder đổi. Trả về True nếu có thay đổi"""
+        cropped = self._data['cropped']
+        folders = cropped['folders']
+        changed = False
+
+        current = {}
+        if cropped_mtime is not None:
+            with os.scandir(self.cropped_dir) as entries:
+                for entry in entries:
+                    if entry.is_dir() and entry.name.startswith(self.IMAGE_FOLDER_PREFIX):
+                        current[entry.name] = entry.stat().st_mtime_ns
+
+        for folder in list(folders):
+            if folder not in current:
+                del folders[folder]
+                changed = True
+
+        for folder, mtime in current.items():
+            cached = folders.get(folder)
+            if cached is None or cached['mtime_ns'] != mtime:
+                folders[folder] = {
+                    'mtime_ns': mtime,
+                    'files': self._scan_files(os.path.join(self.cropped_dir, folder), self.CROP_EXTENSIONS, True)
+                }
+                changed = True
+
+        cropped['dir_mtime_ns'] = cropped_mtime
+        return changed
+
+    def _verify_detection(self, detection_mtime):
+        detection = self._data['detection']
+        if detection['dir_mtime_ns'] == detection_mtime:
+            return False
+        detection['files'] = (
+            self._scan_files(self.detection_dir, self.DETECTION_EXTENSIONS) if detection_mtime is not None else []
+        )
+        detection['dir_mtime_ns'] = detection_mtime
+        return True
+
+    def refresh(self, force=False):
+        """Cập nhật manifest nếu thư mục đã đổi (xem docstring của class)"""
+        with self._lock:
+            if self._data is None:
+                self._data = self._load() or self._empty()
+                force = True
+
+            cropped_mtime = self._dir_mtime(self.cropped_dir)
+            detection_mtime = self._dir_mtime(self.detection_dir)
+            now = time.monotonic()
+
+            changed = False
+            if (force or cropped_mtime != self._data['cropped']['dir_mtime_ns'] or
+                    now - self._last_verify > self.VERIFY_INTERVAL):
+                changed |= self._verify_cropped(cropped_mtime)
+                self._last_verify = now
+            changed |= self._verify_detection(detection_mtime)
+
+            if changed:
+                self._cropped_list = None
+                self._save()
+                # Ghi manifest làm đổi mtime thư mục sách - không coi đó là thay đổi ở request sau
+                if cropped_mtime is not None:
+                    self._data['cropped']['dir_mtime_ns'] = self._dir_mtime(self.cropped_dir)
+
+    def rebuild(self):
+        """Dựng lại toàn bộ manifest (gọi khi vừa xử lý xong sách)"""
+        with self._lock:
+            self._data = self._empty()
+            self._cropped_list = None
+        self.refresh(force=True)
+
+    # === ĐỌC MANIFEST ===
+    def cropped_files(self):
+        """[(folder, name, size, mtime, class_id)] theo thứ tự folder rồi tên file"""
+        self.refresh()
+        with self._lock:
+            if self._cropped_list is None:
+                folders = self._data['cropped']['folders']
+                self._cropped_list = [
+                    (folder, *item) for folder in sorted(folders) for item in folders[folder]['files']
+                ]
+            return self._cropped_list
+
+    def detection_files(self):
+        """[(name, size, mtime)] theo tên file"""
+        self.refresh()
+        with self._lock:
+            return [tuple(item) for item in self._data['detection']['files']]
+
+    def counts(self):
+        """{'folders_count', 'cropped_count', 'detection_count'}"""
+        self.refresh()
+        with self._lock:
+            folders = self._data['cropped']['folders']
+            return {
+                'folders_count': len(folders),
+                'cropped_count': sum(len(folder['files']) for folder in folders.values()),
+                'detection_count': len(self._data['detection']['files'])
+            }
+
+# === REGISTRY ===
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+def get_book_manifest(book_name, cropped_root="books_cropped", detections_root="books_detections"):
+    """Manifest dùng chung trong process của một sách"""
+    key = (cropped_root, detections_root, book_name)
+    with _manifests_lock:
+        manifest = _manifests.get(key)
+        if manifest is None:
+            manifest = BookManifest(book_name, cropped_root, detections_root)
+            _manifests[key] = manifest
+        return manifest
@@ -0,0 +1,376 @@
+# modules/job_scheduler.py
+import os
+import time
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+class JobCancelled(BaseException):
+    """
+    Job bị hủy trong lúc chạy - ném ra ở ranh giới bước và trong callback tiến trình (từng trang / crop).
+
+    Kế thừa BaseException để đi xuyên qua các khối `except Exception` của bước đang chạy (không bị đổi
+    thành lỗi hay chạy fallback), trong khi các khối finally vẫn hủy việc còn chờ (vd. future OCR).
+    """
+
+class JobScheduler:
+    """
+    Hàng đợi job xử lý PDF lưu trong SQLite, thay cho mỗi upload một thread riêng.
+
+    - Tối đa max_concurrent job chạy cùng lúc; job được lấy theo priority (cao trước) rồi thời gian tạo.
+    - Mỗi bước (pdf / yolo / ocr) có giới hạn số job chạy đồng thời riêng (stage_concurrency),
+      ví dụ chỉ một job dùng GPU cho YOLO trong khi job khác đang OCR.
+    - Hủy: job đang chờ bị hủy ngay; job đang chạy dừng ở lần cập nhật tiến trình kế tiếp
+      (sau trang render / ảnh crop / crop OCR đang chạy), các crop OCR còn chờ bị bỏ.
+    - Restart server: job đang chạy dở được đưa lại vào hàng đợi và chạy lại (file PDF upload
+      chỉ bị xóa khi job hoàn thành hoặc bị hủy).
+    """
+
+    DEFAULT_PATH = "jobs.db"
+    STATES = ('queued', 'running', 'completed', 'error', 'cancelled')
+    FINISHED_STATES = ('completed', 'error', 'cancelled')
+    POLL_INTERVAL = 2.0  # giây - worker tự kiểm tra hàng đợi (job do process khác thêm vào)
+    LIST_LIMIT = 100
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            book_name TEXT NOT NULL,
+            pdf_path TEXT NOT NULL,
+            mode TEXT NOT NULL DEFAULT 'complete',
+            priority INTEGER NOT NULL DEFAULT 0,
+            state TEXT NOT NULL DEFAULT 'queued',
+            stage TEXT,
+            message TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS ix_jobs_queue ON jobs(state, priority DESC, created_at);
+    """
+
+    def __init__(self, processing_manager, db_path=DEFAULT_PATH, max_concurrent=2, stage_concurrency=None):
+        """
+        Args:
+            processing_manager (ProcessingManager): Chạy các bước xử lý của job
+            db_path (str): File SQLite của hàng đợi
+            max_concurrent (int): Số job chạy cùng lúc
+            stage_concurrency (dict): Số job tối đa trong từng bước, vd {'pdf': 1, 'yolo': 1, 'ocr': 2}
+        """
+        self.manager = processing_manager
+        self.db_path = db_path
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.stage_concurrency = {stage: max(1, int(limit)) for stage, limit in (stage_concurrency or {}).items()}
+        self.stage_slots = {stage: threading.BoundedSemaphore(limit) for stage, limit in self.stage_concurrency.items()}
+        self._local = threading.local()
+        self._claim_lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._cancel_requested = set()
+        self._workers = []
+        self._stopped = threading.Event()
+
+        self._conn().executescript(self.SCHEMA)
+        self._recover()
+        # ProcessingManager xin slot của scheduler trước mỗi bước và hỏi có bị hủy ở mỗi lần cập nhật tiến trình
+        self.manager.stage_gate = self.stage_slot
+        self.manager.cancel_check = self.check_cancelled
+
+    def _conn(self):
+        """Mỗi thread một connection"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _update(self, job_id, **fields):
+        assignments = ', '.join(f"{column} = ?" for column in fields)
+        self._conn().execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _set_status(self, job_id, **fields):
+        """Cập nhật trạng thái mà /processing_status/<id> trả về"""
+        self.manager.status_store.update(job_id, fields)
+
+    def _queued_status(self, job):
+        return {
+            'stage': 'queued',
+            'status': 'queued',
+            'progress': 0,
+            'message': job.get('message') or 'Đang chờ trong hàng đợi...',
+            'book_name': job['book_name'],
+            'priority': job['priority']
+        }
+
+    def _recover(self):
+        """Job còn 'running' từ lần chạy trước (server bị tắt giữa chừng) → đưa lại vào hàng đợi"""
+        conn = self._conn()
+        rows = conn.execute("SELECT * FROM jobs WHERE state = 'running'").fetchall()
+        for row in rows:
+            message = 'Tiếp tục sau khi khởi động lại server'
+            conn.execute(
+                "UPDATE jobs SET state = 'queued', stage = NULL, message = ? WHERE id = ?", (message, row['id'])
+            )
+            logger.info(f"Job {row['id']} ({row['book_name']}) được đưa lại vào hàng đợi")
+
+        # Trạng thái đọc lại từ file (nếu có) của các job này đã cũ
+        for job in self.list_jobs(state='queued', limit=None):
+            self.manager.status_store.set(job['id'], self._queued_status(job))
+
+    # === WORKERS ===
+    def start(self):
+        """Khởi động các worker thread (gọi một lần)"""
+        if self._workers:
+            return
+        for number in range(self.max_concurrent):
+            worker = threading.Thread(target=self._worker_loop, name=f"job-worker-{number + 1}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        logger.info(f"Job scheduler: {self.max_concurrent} worker, stage slots {self.stage_concurrency}")
+
+    def stop(self):
+        """Dừng nhận job mới (job đang chạy vẫn chạy tới hết)"""
+        self._stopped.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def _worker_loop(self):
+        while not self._stopped.is_set():
+            try:
+                job = self._claim_next()
+            except sqlite3.Error as e:
+                logger.error(f"Không lấy được job từ hàng đợi: {e}")
+                job = None
+
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(self.POLL_INTERVAL)
+                continue
+            self._run(job)
+
+    def _claim_next(self):
+        """Lấy job ưu tiên nhất và đánh dấu 'running' trong một transaction"""
+        with self._claim_lock:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE state = 'queued' ORDER BY priority DESC, created_at, rowid LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                conn.execute(
+                    "UPDATE jobs SET state = 'running', started_at = ?, message = NULL, attempts = attempts + 1 "
+                    "WHERE id = ?",
+                    (time.time(), row['id'])
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return dict(row)
+
+    def _run(self, job):
+        job_id = job['id']
+        logger.info(f"▶ Job {job_id}: {job['book_name']} (priority {job['priority']}, lần {job['attempts'] + 1})")
+
+        if not os.path.exists(job['pdf_path']):
+            message = 'File PDF upload không còn tồn tại'
+            self._finish(job, 'error', message)
+            self.manager.status_store.set(job_id, {'status': 'error', 'message': message, 'progress': 0})
+            return
+
+        try:
+            # Chế độ step_by_step hiện vẫn chạy đủ các bước như trước
+            result = self.manager.process_pdf_complete(job['pdf_path'], job['book_name'], job_id)
+        except JobCancelled:
+            logger.info(f"Job {job_id} dừng theo yêu cầu hủy")
+            result = {'status': 'cancelled'}
+        except Exception as e:
+            logger.exception(f"Job {job_id} lỗi ngoài dự kiến")
+            result = {'status': 'error', 'message': str(e)}
+
+        if result.get('status') == 'completed':
+            self._finish(job, 'completed', result.get('message'))
+        elif job_id in self._cancel_requested:
+            self._finish(job, 'cancelled', 'Đã hủy')
+            self._set_status(job_id, status='cancelled', message='Đã hủy xử lý', end_time=time.time())
+        else:
+            # Giữ file PDF để có thể chạy lại (retry)
+            self._finish(job, 'error', result.get('message'))
+
+    def _finish(self, job, state, message):
+        self._cancel_requested.discard(job['id'])
+        self._update(job['id'], state=state, message=message, stage=None, finished_at=time.time())
+        if state in ('completed', 'cancelled'):
+            try:
+                if os.path.exists(job['pdf_path']):
+                    os.remove(job['pdf_path'])
+            except OSError:
+                pass  # Không quan trọng nếu không xóa được
+        logger.info(f"■ Job {job['id']}: {state}")
+
+    def check_cancelled(self, job_id):
+        """
+        Gọi từ callback tiến trình của job đang chạy
+
+        Raises:
+            JobCancelled: Job đã bị yêu cầu hủy
+        """
+        if job_id in self._cancel_requested:
+            raise JobCancelled(f"Job {job_id} đã bị hủy")
+
+    @contextmanager
+    def stage_slot(self, job_id, stage):
+        """
+        Chờ slot của một bước (giới hạn theo stage_concurrency) trước khi chạy bước đó
+
+        Raises:
+            JobCancelled: Job đã bị yêu cầu hủy
+        """
+        self.check_cancelled(job_id)
+
+        slot = self.stage_slots.get(stage)
+        if slot is not None and not slot.acquire(blocking=False):
+            self._set_status(job_id, message=f'Đang chờ tới lượt bước {stage}...')
+            while not slot.acquire(timeout=1.0):
+                self.check_cancelled(job_id)
+        try:
+            self.check_cancelled(job_id)
+            self._update(job_id, stage=stage)
+            yield
+        finally:
+            if slot is not None:
+                slot.release()
+
+    # === API ===
+    def submit(self, pdf_path, book_name, job_id, mode='complete', priority=0):
+        """
+        Thêm job vào hàng đợi
+
+        Args:
+            pdf_path (str): File PDF đã upload
+            book_name (str): Tên sách
+            job_id (str): ID job (cũng là status_id)
+            mode (str): 'complete' hoặc 'step_by_step'
+            priority (int): Số lớn được chạy trước
+
+        Returns:
+            dict: Job vừa thêm
+        """
+        self._conn().execute(
+            "INSERT INTO jobs (id, book_name, pdf_path, mode, priority, state, created_at) "
+            "VALUES (?, ?, ?, ?, ?, 'queued', ?)",
+            (job_id, book_name, pdf_path, mode, int(priority), time.time())
+        )
+        job = self.get_job(job_id)
+        self.manager.status_store.set(job_id, self._queued_status(job))
+        with self._wakeup:
+            self._wakeup.notify()
+        return job
+
+    def get_job(self, job_id):
+        """Job theo ID (kèm vị trí trong hàng đợi nếu đang chờ) hoặc None"""
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        if job['state'] == 'queued':
+            job['queue_position'] = self._conn().execute(
+                "SELECT COUNT(*) FROM jobs WHERE state = 'queued' AND "
+                "(priority > ? OR (priority = ? AND created_at < ?))",
+                (job['priority'], job['priority'], job['created_at'])
+            ).fetchone()[0] + 1
+        return job
+
+    def list_jobs(self, state=None, limit=LIST_LIMIT):
+        """Các job mới nhất (lọc theo state nếu có)"""
+        sql = "SELECT * FROM jobs"
+        params = []
+        if state:
+            if state not in self.STATES:
+                raise ValueError(f"state phải là một trong: {', '.join(self.STATES)}")
+            sql += " WHERE state = ?"
+            params.append(state)
+        sql += " ORDER BY created_at DESC"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        return [dict(row) for row in self._conn().execute(sql, params)]
+
+    def get_status(self, job_id):
+        """Trạng thái xử lý của job (tiến trình chi tiết từ ProcessingManager nếu còn)"""
+        status = self.manager.get_status(job_id)
+        if status.get('status') != 'not_found':
+            return status
+
+        job = self.get_job(job_id)
+        if job is None:
+            return status
+        if job['state'] == 'queued':
+            return self._queued_status(job)
+        return {
+            'status': job['state'],
+            'stage': job['stage'],
+            'message': job['message'] or '',
+            'book_name': job['book_name'],
+            'progress': 100 if job['state'] == 'completed' else 0
+        }
+
+    def cancel(self, job_id):
+        """
+        Hủy job: đang chờ → hủy ngay, đang chạy → dừng ở lần cập nhật tiến trình kế tiếp
+
+        Returns:
+            bool: False nếu job không tồn tại hoặc đã kết thúc
+        """
+        cursor = self._conn().execute(
+            "UPDATE jobs SET state = 'cancelled', message = 'Đã hủy', finished_at = ? "
+            "WHERE id = ? AND state = 'queued'",
+            (time.time(), job_id)
+        )
+        if cursor.rowcount:
+            job = self.get_job(job_id)
+            try:
+                os.remove(job['pdf_path'])
+            except OSError:
+                pass
+            self._set_status(job_id, status='cancelled', message='Đã hủy xử lý')
+            return True
+
+        job = self.get_job(job_id)
+        if job is None or job['state'] != 'running':
+            return False
+        self._cancel_requested.add(job_id)
+        self._set_status(job_id, message='Đang hủy...')
+        return True
+
+    def retry(self, job_id):
+        """
+        Đưa job lỗi vào lại hàng đợi
+
+        Returns:
+            bool: False nếu job không ở trạng thái lỗi hoặc file PDF không còn
+        """
+        job = self.get_job(job_id)
+        if job is None or job['state'] != 'error' or not os.path.exists(job['pdf_path']):
+            return False
+        self._update(job_id, state='queued', message=None, stage=None, finished_at=None)
+        self.manager.status_store.set(job_id, self._queued_status(self.get_job(job_id)))
+        with self._wakeup:
+            self._wakeup.notify()
+        return True
+
+    def set_priority(self, job_id, priority):
+        """Đổi priority của job đang chờ; trả về False nếu job không còn chờ"""
+        cursor = self._conn().execute(
+            "UPDATE jobs SET priority = ? WHERE id = ? AND state = 'queued'", (int(priority), job_id)
+        )
+        return cursor.rowcount > 0
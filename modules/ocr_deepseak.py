@@ -3,40 +3,58 @@ import os
 import glob
 import re
 import json
-import base64
-import requests
 import time
+from concurrent.futures import as_completed
 from pathlib import Path
 from dotenv import load_dotenv
 from typing import List, Tuple, Dict, Any, Optional, Callable
+from config import Config
+from modules_auto_mapping.engine import OCRStage, CropStage
+from .ocr_results import get_ocr_result_log
 
 load_dotenv()
 
 
 class OCRProcessor:
-    """OCR Processor sử dụng DeepSeek Vision API"""
+    """
+    OCR Processor sử dụng DeepSeek Vision API
+    
+    Gọi API, retry, prompt và định dạng text.txt dùng chung OCRStage của ProcessingEngine với run.py.
+    Các crop của mọi folder được gửi lên API song song qua thread pool của OCRStage: số request
+    đang chờ API không vượt quá max_in_flight, kể cả khi nhiều job OCR cùng lúc.
+    
+    Khi có PDF gốc, crop được lấy text từ text layer của PDF trước (như run.py), chỉ gọi API khi
+    text layer thiếu / lỗi font / box là ảnh.
+    
+    Kết quả từng crop được ghi nối vào ocr_results.jsonl của sách ngay khi xong (xem OCRResultLog);
+    text.txt của mỗi folder là view dạng chữ sinh từ cùng kết quả.
+    """
     
     # Constants
-    NUM_CLASSES = 3  # cls0, cls1, cls2
     IMAGE_FOLDER_PREFIX = 'image_'
     IMAGE_FOLDER_LENGTH = 10
     OUTPUT_FILENAME = 'text.txt'
     CROP_PATTERN = 'crop*_cls{}.png'
+    CROP_INDEX_FILENAME = CropStage.INDEX_FILENAME  # Do bước crop ghi: class, bbox, confidence của từng crop
     
-    # DeepSeek API Configuration
-    DEEPSEEK_API_ENDPOINT = "https://ark.ap-southeast.bytepluses.com/api/v3/chat/completions"
-    DEEPSEEK_MODEL_NAME = "skylark-vision-250515"
-    DEEPSEEK_API_KEY = os.getenv("DEEPSEAK_API_KEY")
-    
-    # Retry Configuration
-    MAX_RETRY_ATTEMPTS = 3
-    RETRY_DELAY = 1  # seconds
+    # Số request API chạy song song tối đa (toàn instance)
+    MAX_IN_FLIGHT = 8
     
-    def __init__(self):
-        self.api_key = self.DEEPSEEK_API_KEY
+    def __init__(self, max_in_flight: int = MAX_IN_FLIGHT, ocr_stage: Optional[OCRStage] = None, config=None):
+        """
+        Args:
+            max_in_flight (int): Số request API chạy cùng lúc (khi tự tạo OCRStage)
+            ocr_stage (OCRStage): Bước OCR dùng chung (vd. của ProcessingEngine bên YOLOProcessor)
+            config: Config (mặc định Config())
+        """
+        self.ocr_stage = ocr_stage or OCRStage(config or Config(), max_in_flight=max_in_flight)
+        self.api_key = self.ocr_stage.api_key
         
         if not self.api_key:
             raise ValueError("DEEPSEAK_API_KEY không được tìm thấy trong biến môi trường")
+        
+        self.max_in_flight = self.ocr_stage.max_in_flight
+        self.ocr_classes = sorted(self.ocr_stage.config.OCR_CLASSES)  # Class cần OCR (Config.OCR_CLASSES)
     
     def _update_status(self, callback: Optional[Callable], **kwargs) -> None:
         """Helper method để update status qua callback"""
@@ -50,99 +68,6 @@ class OCRProcessor:
         self._update_status(callback, stage='error', message=error_msg)
         return False, error_msg
     
-    def _image_to_base64(self, image_path: str) -> str:
-        """Chuyển đổi ảnh thành base64 string với Data URI"""
-        if not os.path.exists(image_path):
-            raise FileNotFoundError(f"File ảnh không tồn tại: {image_path}")
-        
-        # Xác định MIME type
-        if image_path.lower().endswith('.png'):
-            mime_type = "image/png"
-        elif image_path.lower().endswith(('.jpg', '.jpeg')):
-            mime_type = "image/jpeg"
-        else:
-            raise ValueError("Định dạng ảnh không được hỗ trợ (chỉ .png, .jpg, .jpeg)")
-        
-        with open(image_path, "rb") as image_file:
-            encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-        
-        return f"data:{mime_type};base64,{encoded_string}"
-    
-    def _create_deepseek_prompt(self) -> str:
-        """Tạo prompt cho DeepSeek Vision API - giống file thứ 2"""
-        return """Extract the text from the following image exactly as it appears. 
-                        Do not add, remove, or modify any words or characters. 
-                        Preserve the original language and formatting of the text in the image."""
-    
-    def _call_deepseek_vision_api_with_retry(self, image_base64_url: str, prompt_text: str) -> Optional[str]:
-        """Gọi DeepSeek Vision API với retry logic"""
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
-        
-        payload = {
-            "model": self.DEEPSEEK_MODEL_NAME,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": image_base64_url
-                            }
-                        },
-                        {
-                            "type": "text",
-                            "text": prompt_text
-                        }
-                    ]
-                }
-            ]
-        }
-        
-        last_error = None
-        
-        # Retry logic - thử tối đa 3 lần
-        for attempt in range(self.MAX_RETRY_ATTEMPTS):
-            try:
-                response = requests.post(
-                    self.DEEPSEEK_API_ENDPOINT, 
-                    headers=headers, 
-                    data=json.dumps(payload),
-                    timeout=30
-                )
-                response.raise_for_status()
-                
-                api_response = response.json()
-                
-                if api_response.get("choices"):
-                    for choice in api_response["choices"]:
-                        if choice.get("message") and choice["message"].get("content"):
-                            return choice["message"]["content"].strip()
-                
-                # Nếu không có content, coi như lỗi và retry
-                last_error = "Không nhận được nội dung từ API"
-                
-            except requests.exceptions.RequestException as e:
-                last_error = f"Lỗi khi gọi DeepSeek API (lần {attempt + 1}): {e}"
-                print(last_error)
-                if hasattr(e, 'response') and e.response is not None:
-                    print(f"Phản hồi lỗi từ server: {e.response.text}")
-                    
-            except Exception as e:
-                last_error = f"Lỗi không mong muốn (lần {attempt + 1}): {e}"
-                print(last_error)
-            
-            # Nếu không phải lần cuối, chờ trước khi retry
-            if attempt < self.MAX_RETRY_ATTEMPTS - 1:
-                print(f"Đang thử lại sau {self.RETRY_DELAY} giây...")
-                time.sleep(self.RETRY_DELAY)
-        
-        print(f"Đã thử {self.MAX_RETRY_ATTEMPTS} lần nhưng vẫn thất bại. Lỗi cuối: {last_error}")
-        return None
-    
     def load_reader(self, status_callback: Optional[Callable] = None) -> Tuple[bool, str]:
         """Kiểm tra kết nối API DeepSeek"""
         try:
@@ -182,14 +107,6 @@ class OCRProcessor:
         
         return image_folders
     
-    def _count_images_in_folder(self, folder_path: str) -> int:
-        """Đếm tổng số ảnh cần xử lý trong folder"""
-        total = 0
-        for cls_num in range(self.NUM_CLASSES):
-            pattern = os.path.join(folder_path, self.CROP_PATTERN.format(cls_num))
-            total += len(glob.glob(pattern))
-        return total
-    
     def _get_class_images(self, folder_path: str, cls_num: int) -> List[str]:
         """Lấy danh sách ảnh của một class cụ thể"""
         pattern = os.path.join(folder_path, self.CROP_PATTERN.format(cls_num))
@@ -197,95 +114,98 @@ class OCRProcessor:
     
     def _process_single_image_file(self, image_path: str) -> Dict[str, Any]:
         """Xử lý OCR cho một file ảnh bằng DeepSeek Vision API"""
-        filename = os.path.basename(image_path)
-        result = {
-            'filename': filename,
-            'success': False,
-            'text': '',
-            'error': None
-        }
-        
+        return self.ocr_stage.ocr_file(image_path)
+    
+    def _load_crop_index(self, folder_path: str) -> Dict[str, Dict[str, Any]]:
+        """crops.json của folder theo tên file ({} nếu folder được crop trước khi có file này)"""
         try:
-            # Chuyển ảnh sang base64
-            base64_image = self._image_to_base64(image_path)
-            
-            # Tạo prompt
-            prompt = self._create_deepseek_prompt()
-            
-            # Gọi DeepSeek API với retry
-            api_result = self._call_deepseek_vision_api_with_retry(base64_image, prompt)
-            
-            if api_result:
-                result.update({
-                    'success': True,
-                    'text': api_result
-                })
-            else:
-                result['error'] = "Không nhận được phản hồi từ DeepSeek API sau 3 lần thử"
-            
-        except Exception as e:
-            result['error'] = str(e)
-        
-        return result
+            with open(os.path.join(folder_path, self.CROP_INDEX_FILENAME), 'r', encoding='utf-8') as f:
+                return {crop['crop_filename']: crop for crop in json.load(f)}
+        except (OSError, ValueError, KeyError, TypeError):
+            return {}
     
-    def _write_ocr_result_to_file(self, file_handle, result: Dict[str, Any]) -> None:
-        """Ghi kết quả OCR vào file - chỉ DeepSeek Vision API result"""
-        # Header với tên file
-        file_handle.write("=" * 30 + "\n")
-        file_handle.write(f"FILE: {result['filename']}\n")
-        file_handle.write("=" * 30 + "\n\n")
-        
-        if result['success']:
-            # Chỉ có một phần: kết quả từ DeepSeek Vision API
-            file_handle.write(result['text'])
-            file_handle.write("\n\n")
+    def _crop_record(self, folder_name: str, result: Dict[str, Any],
+                     crop_info: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Record có cấu trúc của một crop cho ocr_results.jsonl"""
+        if crop_info:
+            cls_num = crop_info.get('class_id')
         else:
-            # Ghi lỗi nếu có
-            file_handle.write("❌ ERROR:\n")
-            file_handle.write("-" * 30 + "\n")
-            file_handle.write(f"Lỗi: {result['error']}")
-            file_handle.write("\n\n")
+            match = re.search(r'_cls(\d+)\.', result['filename'])
+            cls_num = int(match.group(1)) if match else None
+        return {
+            'folder': folder_name,
+            'filename': result['filename'],
+            'class': cls_num,
+            'bbox': crop_info.get('bbox') if crop_info else None,
+            'confidence': crop_info.get('confidence') if crop_info else None,
+            'text': result['text'],
+            'success': result['success'],
+            'error': result['error'],
+            'latency_ms': result.get('latency_ms'),
+            'text_source': result.get('text_source', 'ocr'),
+            'model': self.ocr_stage.model,
+            'created_at': time.time()
+        }
     
-    def _process_single_folder(self, folder_path: str) -> Dict[str, Any]:
-        """OCR tất cả ảnh trong một folder"""
-        folder_name = os.path.basename(folder_path)
+    def _list_folder_images(self, folder_path: str) -> List[str]:
+        """Ảnh cần OCR của folder theo thứ tự ghi vào text.txt (theo OCR_CLASSES, trong mỗi class theo tên)"""
+        return [
+            image_file
+            for cls_num in self.ocr_classes
+            for image_file in self._get_class_images(folder_path, cls_num)
+        ]
+    
+    def _write_folder_text(self, folder_path: str, ocr_results: List[Dict[str, Any]]) -> str:
+        """Ghi text.txt của folder một lần, theo thứ tự crop (temp file + rename, không bao giờ ghi dở)"""
+        return self.ocr_stage.write_text(folder_path, ocr_results)
+    
+    def _folder_result(self, folder_path: str, ocr_results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Ghi text.txt và tổng kết OCR của một folder"""
         result = {
-            'folder_name': folder_name,
+            'folder_name': os.path.basename(folder_path),
             'status': 'success',
-            'processed_files': 0,
-            'total_files': 0,
-            'output_file': None,
+            'processed_files': sum(1 for ocr_result in ocr_results if ocr_result['success']),
+            'total_files': len(ocr_results),
+            'output_file': os.path.join(folder_path, self.OUTPUT_FILENAME),
             'error': None
         }
-        
         try:
-            output_file = os.path.join(folder_path, self.OUTPUT_FILENAME)
-            result['output_file'] = output_file
-            result['total_files'] = self._count_images_in_folder(folder_path)
-            
-            with open(output_file, 'w', encoding='utf-8') as f:
-                # Xử lý từng class
-                for cls_num in range(self.NUM_CLASSES):
-                    image_files = self._get_class_images(folder_path, cls_num)
-                    
-                    for image_file in image_files:
-                        ocr_result = self._process_single_image_file(image_file)
-                        self._write_ocr_result_to_file(f, ocr_result)
-                        
-                        if ocr_result['success']:
-                            result['processed_files'] += 1
-            
+            self._write_folder_text(folder_path, ocr_results)
         except Exception as e:
             result.update({
                 'status': 'error',
                 'error': str(e)
             })
-        
         return result
     
+    def _text_layer_result(self, image_file: str, pdf_path: Optional[str],
+                           crop_info: Optional[Dict[str, Any]], stats: Dict) -> Optional[Dict[str, Any]]:
+        """Kết quả lấy từ text layer của PDF (cùng dạng với OCR), None nếu crop cần gọi API"""
+        text = self.ocr_stage.crop_text(pdf_path, crop_info, stats)
+        if text is None:
+            return None
+        return {
+            'filename': os.path.basename(image_file),
+            'success': True,
+            'text': text,
+            'error': None,
+            'latency_ms': 0,
+            'text_source': 'pdf_text_layer'
+        }
+    
     def process_directories(self, base_path: str, 
-                          status_callback: Optional[Callable] = None) -> Tuple[bool, str, Optional[Dict]]:
-        """OCR tất cả ảnh cls0-cls2 trong các thư mục image_xxxx"""
+                          status_callback: Optional[Callable] = None,
+                          folders: Optional[List[str]] = None,
+                          folder_callback: Optional[Callable] = None,
+                          pdf_path: Optional[str] = None) -> Tuple[bool, str, Optional[Dict]]:
+        """
+        OCR tất cả ảnh thuộc OCR_CLASSES trong các thư mục image_xxxx
+        
+        Args:
+            folders (list): Chỉ OCR các folder có tên này, None = tất cả
+            folder_callback (function): folder_callback(folder_name, result) sau khi OCR xong từng folder
+            pdf_path (str): PDF gốc của sách - crop lấy text từ text layer trước khi gọi API
+        """
         try:
             self._update_status(status_callback, 
                               stage='ocr', 
@@ -300,34 +220,104 @@ class OCRProcessor:
             image_folders = self._find_image_folders(base_path)
             if not image_folders:
                 return False, "Không tìm thấy thư mục image_xxxx nào", None
+            if folders is not None:
+                folders = set(folders)
+                image_folders = [path for path in image_folders if os.path.basename(path) in folders]
             
             total_folders = len(image_folders)
+            folder_images = {folder_path: self._list_folder_images(folder_path) for folder_path in image_folders}
+            crop_indexes = {folder_path: self._load_crop_index(folder_path) for folder_path in image_folders}
+            
+            # Kết quả cũ của các folder này bị thay bởi lần OCR này
+            result_log = get_ocr_result_log(base_path)
+            result_log.reset_folders([os.path.basename(folder_path) for folder_path in image_folders])
+            total_crops = sum(len(images) for images in folder_images.values())
             self._update_status(status_callback,
                               total_folders=total_folders,
                               current_folder=0,
-                              message=f'Tìm thấy {total_folders} folder để OCR')
+                              total_crops=total_crops,
+                              current_crop=0,
+                              message=f'Tìm thấy {total_folders} folder ({total_crops} ảnh) để OCR')
+            
+            # Gửi mọi crop vào pool; folder nào đủ kết quả thì ghi text.txt ngay (theo thứ tự crop gốc)
+            folder_results = {folder_path: [None] * len(images) for folder_path, images in folder_images.items()}
+            remaining = {folder_path: len(images) for folder_path, images in folder_images.items()}
+            results_by_folder = {}
+            
+            completed_crops = 0
+            text_layer_stats = OCRStage.new_stats()
             
-            # Process folders
-            ocr_results = []
-            processed_folders = 0
+            def finish_folder(folder_path):
+                result = self._folder_result(folder_path, folder_results.pop(folder_path))
+                results_by_folder[folder_path] = result
+                if folder_callback:
+                    folder_callback(result['folder_name'], result)
             
-            for i, folder_path in enumerate(image_folders):
-                folder_name = os.path.basename(folder_path)
+            def record_crop(folder_path, position, crop_result):
+                nonlocal completed_crops
+                folder_results[folder_path][position] = crop_result
+                try:
+                    result_log.append([self._crop_record(
+                        os.path.basename(folder_path), crop_result,
+                        crop_indexes[folder_path].get(crop_result['filename'])
+                    )])
+                except OSError as e:
+                    print(f"Không ghi được {result_log.path}: {e}")
+                remaining[folder_path] -= 1
+                if remaining[folder_path] == 0:
+                    finish_folder(folder_path)
                 
+                completed_crops += 1
                 self._update_status(status_callback,
-                                  current_folder=i + 1,
-                                  message=f'Đang OCR folder {folder_name} ({i + 1}/{total_folders})')
+                                  current_crop=completed_crops,
+                                  current_folder=len(results_by_folder),
+                                  message=f'Đã OCR {completed_crops}/{total_crops} ảnh '
+                                          f'({len(results_by_folder)}/{total_folders} folder)')
+            
+            # Text layer của PDF trước (tại chỗ, không tốn request API), còn lại gửi vào pool
+            executor = self.ocr_stage.executor()
+            futures = {}
+            text_layer_results = []
+            for folder_path, images in folder_images.items():
+                for position, image_file in enumerate(images):
+                    crop_result = self._text_layer_result(
+                        image_file, pdf_path, crop_indexes[folder_path].get(os.path.basename(image_file)),
+                        text_layer_stats
+                    )
+                    if crop_result is None:
+                        futures[executor.submit(self._process_single_image_file, image_file)] = (folder_path, position)
+                    else:
+                        text_layer_results.append((folder_path, position, crop_result))
+            try:
+                for folder_path, count in remaining.items():
+                    if count == 0:
+                        finish_folder(folder_path)
                 
-                result = self._process_single_folder(folder_path)
-                ocr_results.append(result)
+                for folder_path, position, crop_result in text_layer_results:
+                    record_crop(folder_path, position, crop_result)
                 
-                if result['status'] == 'success':
-                    processed_folders += 1
+                for future in as_completed(futures):
+                    folder_path, position = futures[future]
+                    record_crop(folder_path, position, future.result())
+            finally:
+                # Lỗi giữa chừng: không để các crop còn lại chiếm pool dùng chung
+                for future in futures:
+                    future.cancel()
+            
+            result_log.compact()
+            
+            ocr_results = [results_by_folder[folder_path] for folder_path in image_folders]
+            processed_folders = sum(1 for result in ocr_results if result['status'] == 'success')
             
             return True, f"Đã OCR {processed_folders}/{total_folders} folder thành công", {
                 'total_folders': total_folders,
                 'processed_folders': processed_folders,
-                'results': ocr_results
+                'results': ocr_results,
+                'text_layer': {
+                    'text_layer_crops': text_layer_stats['text_layer_boxes'],
+                    'vision_api_crops': len(futures),
+                    'fallback_reasons': text_layer_stats['fallback_reasons']
+                }
             }
             
         except Exception as e:
@@ -340,14 +330,8 @@ class OCRProcessor:
             if not success:
                 return False, message, None
             
-            # Chuyển ảnh sang base64
-            base64_image = self._image_to_base64(image_path)
-            
-            # Tạo prompt
-            prompt = self._create_deepseek_prompt()
-            
             # Gọi DeepSeek API với retry
-            api_result = self._call_deepseek_vision_api_with_retry(base64_image, prompt)
+            api_result = self.ocr_stage.call_api(image_path)
             
             if api_result:
                 # Tách text thành các dòng và loại bỏ dòng trống
@@ -358,7 +342,7 @@ class OCRProcessor:
                 
                 return True, texts, confidences
             else:
-                return False, "Không nhận được phản hồi từ DeepSeek API sau 3 lần thử", None
+                return False, f"Không nhận được phản hồi từ DeepSeek API sau {self.ocr_stage.config.MAX_RETRIES} lần thử", None
                 
         except Exception as e:
             return False, f"Lỗi khi OCR ảnh: {str(e)}", None
\ No newline at end of file
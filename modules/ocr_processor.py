@@ -251,8 +251,16 @@ class OCRProcessor:
         return result
     
     def process_directories(self, base_path: str, 
-                          status_callback: Optional[Callable] = None) -> Tuple[bool, str, Optional[Dict]]:
-        """OCR tất cả ảnh cls0-cls2 trong các thư mục image_xxxx"""
+                          status_callback: Optional[Callable] = None,
+                          folders: Optional[List[str]] = None,
+                          folder_callback: Optional[Callable] = None) -> Tuple[bool, str, Optional[Dict]]:
+        """
+        OCR tất cả ảnh cls0-cls2 trong các thư mục image_xxxx
+        
+        Args:
+            folders (list): Chỉ OCR các folder có tên này, None = tất cả
+            folder_callback (function): folder_callback(folder_name, result) sau khi OCR xong từng folder
+        """
         try:
             self._update_status(status_callback, 
                               stage='ocr', 
@@ -267,6 +275,9 @@ class OCRProcessor:
             image_folders = self._find_image_folders(base_path)
             if not image_folders:
                 return False, "Không tìm thấy thư mục image_xxxx nào", None
+            if folders is not None:
+                folders = set(folders)
+                image_folders = [path for path in image_folders if os.path.basename(path) in folders]
             
             total_folders = len(image_folders)
             self._update_status(status_callback,
@@ -287,6 +298,8 @@ class OCRProcessor:
                 
                 result = self._process_single_folder(folder_path)
                 ocr_results.append(result)
+                if folder_callback:
+                    folder_callback(folder_name, result)
                 
                 if result['status'] == 'success':
                     processed_folders += 1
@@ -0,0 +1,150 @@
+# modules/ocr_results.py
+import os
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class OCRResultLog:
+    """
+    Kết quả OCR có cấu trúc của một sách: books_cropped/<book>/ocr_results.jsonl, mỗi dòng một crop
+    (folder, filename, class, bbox, confidence, text, success, error, latency_ms, model, created_at).
+
+    - Ghi nối (append) ngay khi từng crop OCR xong, không phải đợi cả folder hay cả sách.
+    - Trước khi OCR lại một folder, một dòng {"folder": ..., "reset": true} được ghi: các record
+      cũ hơn của folder đó bị bỏ (crop đổi tên/ít đi sau khi upload lại PDF không để lại record rác).
+    - records() đọc bản mới nhất, không cần parse text.txt; text.txt chỉ là view dạng chữ
+      sinh ra từ cùng kết quả. compact() ghi lại file chỉ với record còn hiệu lực.
+    """
+
+    FILENAME = "ocr_results.jsonl"
+    # Compact khi số dòng vượt COMPACT_RATIO lần số record còn hiệu lực
+    COMPACT_RATIO = 2
+
+    def __init__(self, book_dir):
+        """
+        Args:
+            book_dir (str): Thư mục sách (chứa các folder image_XXXX)
+        """
+        self.book_dir = book_dir
+        self.path = os.path.join(book_dir, self.FILENAME)
+        self._lock = threading.Lock()
+
+    # === GHI ===
+    def _append_lines(self, items):
+        with self._lock:
+            self._append_lines_locked(items)
+
+    def _append_lines_locked(self, items):
+        with open(self.path, 'a+b') as f:
+            # Dòng cuối bị ghi dở (process chết giữa chừng) - bắt đầu dòng mới
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+            f.write(b''.join(
+                json.dumps(item, ensure_ascii=False).encode('utf-8') + b'\n' for item in items
+            ))
+
+    def append(self, records):
+        """Ghi thêm các record (mỗi record một crop)"""
+        if records:
+            self._append_lines(records)
+
+    def reset_folders(self, folders):
+        """Bỏ toàn bộ record hiện có của các folder (gọi trước khi OCR lại / khi folder bị xóa)"""
+        if folders:
+            self._append_lines({'folder': folder, 'reset': True} for folder in folders)
+
+    def move_folders(self, moves):
+        """
+        Chuyển record sang folder mới khi trang dời chỗ (upload lại PDF có chèn/xóa trang)
+
+        Args:
+            moves (dict): {folder cũ: folder mới}, đổi đồng thời (vd. image_0002 → image_0003 → image_0004)
+        """
+        if not moves:
+            return
+        with self._lock:
+            latest, _ = self._read_latest()
+            records = [
+                {**record, 'folder': moves[record['folder']]}
+                for record in latest.values() if record['folder'] in moves
+            ]
+            folders = sorted(set(moves) | set(moves.values()))
+            self._append_lines_locked([{'folder': folder, 'reset': True} for folder in folders] + records)
+
+    # === ĐỌC ===
+    def _read_latest(self):
+        """({(folder, filename): record}, số dòng hợp lệ)"""
+        latest = {}
+        lines = 0
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        item = json.loads(line)
+                    except ValueError:
+                        continue  # Dòng ghi dở
+                    lines += 1
+                    if item.get('reset'):
+                        for key in [key for key in latest if key[0] == item['folder']]:
+                            del latest[key]
+                    else:
+                        latest[(item['folder'], item['filename'])] = item
+        except FileNotFoundError:
+            pass
+        return latest, lines
+
+    def records(self, folder=None, class_id=None):
+        """
+        Record mới nhất của từng crop theo thứ tự folder → class → tên file (cùng thứ tự text.txt)
+
+        Args:
+            folder (str): Chỉ lấy một folder image_XXXX
+            class_id (int): Chỉ lấy một class
+        """
+        with self._lock:
+            latest, _ = self._read_latest()
+        records = [
+            record for record in latest.values()
+            if (folder is None or record['folder'] == folder)
+            and (class_id is None or record.get('class') == class_id)
+        ]
+        records.sort(key=lambda record: (record['folder'], record.get('class') is None,
+                                         record.get('class') or 0, record['filename']))
+        return records
+
+    def compact(self, force=False):
+        """
+        Ghi lại file chỉ với các record còn hiệu lực (temp file + rename)
+
+        Returns:
+            bool: True nếu đã compact
+        """
+        with self._lock:
+            latest, lines = self._read_latest()
+            if not force and lines <= self.COMPACT_RATIO * max(1, len(latest)):
+                return False
+            tmp_path = f"{self.path}.tmp{os.getpid()}"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for record in latest.values():
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            os.replace(tmp_path, self.path)
+        logger.debug(f"Compact {self.path}: {lines} → {len(latest)} dòng")
+        return True
+
+# === REGISTRY ===
+_logs = {}
+_logs_lock = threading.Lock()
+
+def get_ocr_result_log(book_dir):
+    """OCRResultLog dùng chung trong process của một sách"""
+    key = os.path.abspath(book_dir)
+    with _logs_lock:
+        log = _logs.get(key)
+        if log is None:
+            log = OCRResultLog(book_dir)
+            _logs[key] = log
+        return log
@@ -4,9 +4,17 @@ import os
 import multiprocessing as mp
 from pathlib import Path
 from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import hashlib
 import logging
+import numpy as np
 from typing import Callable, Optional, Tuple, Dict, List, Any
 import time
+from contextlib import nullcontext
+
+# File ghi lại cách trang được render (dpi, mode, pdf gốc) để bước YOLO biết cách crop
+RENDER_INFO_FILE = "render_info.json"
+RENDER_MODES = ("full", "two_pass")
 
 def process_pdf_page(args):
     """
@@ -33,7 +41,7 @@ def process_pdf_page(args):
         pix = page.get_pixmap(matrix=mat, alpha=False)
         
         # Tạo tên file ảnh
-        image_name = f"{pdf_name}_page_{page_num + 1:03d}.png"
+        image_name = PDFProcessor.image_name(pdf_name, page_num)
         image_path = os.path.join(output_dir, image_name)
         
         # Lưu ảnh
@@ -48,6 +56,34 @@ def process_pdf_page(args):
     except Exception as e:
         return False, page_num, None, str(e)
 
+def render_clip(page, clip_points, dpi):
+    """
+    Render một vùng của trang PDF (tọa độ point, 1/72 inch) ở DPI cho trước
+    
+    Args:
+        page: fitz.Page đang mở
+        clip_points (list): [x1, y1, x2, y2] theo point
+        dpi (int): DPI render
+    
+    Returns:
+        np.ndarray: Ảnh RGB của vùng
+    """
+    zoom_factor = dpi / 72
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom_factor, zoom_factor),
+                          clip=fitz.Rect(*clip_points), alpha=False)
+    return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n).copy()
+
+def load_render_info(images_dir):
+    """Đọc render_info.json của thư mục ảnh trang (None nếu không có)"""
+    info_path = os.path.join(images_dir, RENDER_INFO_FILE)
+    if not os.path.exists(info_path):
+        return None
+    try:
+        with open(info_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
 class PDFProcessor:
     def __init__(self, max_workers: int = 8, max_memory_gb: float = 8.0):
         """
@@ -58,6 +94,11 @@ class PDFProcessor:
             max_memory_gb (float): Giới hạn RAM sử dụng (GB) (default: 8.0)
         """
         self.dpi = 300
+        # "full": render cả trang ở self.dpi; "two_pass": render trang ở detection_dpi để detect,
+        # chỉ các vùng được detect mới render lại ở crop_dpi (xem YOLOProcessor)
+        self.render_mode = "full"
+        self.detection_dpi = 100
+        self.crop_dpi = 300
         self.max_workers = max_workers
         self.max_memory_gb = max_memory_gb
         
@@ -90,7 +131,9 @@ class PDFProcessor:
         return max(1, optimal_workers)
     
     def convert_to_images(self, pdf_file: str, output_dir: str, 
-                         status_callback: Optional[Callable] = None) -> Tuple[bool, str, Optional[Dict]]:
+                         status_callback: Optional[Callable] = None,
+                         pages: Optional[List[int]] = None,
+                         image_prefix: Optional[str] = None) -> Tuple[bool, str, Optional[Dict]]:
         """
         Convert PDF to high quality PNG images using multiprocessing
         
@@ -98,6 +141,8 @@ class PDFProcessor:
             pdf_file (str): Path to PDF file
             output_dir (str): Output directory
             status_callback (function): Callback function to update status
+            pages (list): Số trang (0-based) cần render, None = tất cả (trang khác giữ ảnh đã có)
+            image_prefix (str): Tiền tố tên ảnh, mặc định là tên file PDF
         
         Returns:
             tuple: (success, message, info)
@@ -115,7 +160,7 @@ class PDFProcessor:
             os.makedirs(output_dir, exist_ok=True)
             
             # Lấy tên file để đặt tên ảnh
-            pdf_name = Path(pdf_file).stem
+            pdf_name = image_prefix or Path(pdf_file).stem
             
             # Mở file PDF để lấy thông tin cơ bản
             doc = fitz.open(pdf_file)
@@ -125,14 +170,22 @@ class PDFProcessor:
             if total_pages == 0:
                 return False, "PDF không có trang nào", None
             
+            # Ảnh của PDF cũ (tên khác / trang không còn) làm YOLO xử lý nhầm
+            self._prune_images(output_dir, pdf_name, total_pages)
+            
+            page_numbers = list(range(total_pages)) if pages is None else sorted(pages)
+            render_count = len(page_numbers)
+            
             # Tính số worker tối ưu
-            optimal_workers = self._calculate_optimal_workers(total_pages)
+            optimal_workers = self._calculate_optimal_workers(max(1, render_count))
+            render_dpi = self.detection_dpi if self.render_mode == "two_pass" else self.dpi
             
-            self.logger.info(f"Xử lý {total_pages} trang với {optimal_workers} workers")
+            self.logger.info(f"Xử lý {render_count}/{total_pages} trang với {optimal_workers} workers "
+                             f"(mode={self.render_mode}, dpi={render_dpi})")
             
             if status_callback:
                 status_callback({
-                    'total_pages': total_pages,
+                    'total_pages': render_count,
                     'current_page': 0,
                     'workers': optimal_workers,
                     'message': f'Bắt đầu xử lý với {optimal_workers} CPU cores...'
@@ -140,8 +193,8 @@ class PDFProcessor:
             
             # Chuẩn bị arguments cho các worker
             worker_args = [
-                (pdf_file, page_num, output_dir, pdf_name, self.dpi, total_pages)
-                for page_num in range(total_pages)
+                (pdf_file, page_num, output_dir, pdf_name, render_dpi, total_pages)
+                for page_num in page_numbers
             ]
             
             converted_images = []
@@ -149,12 +202,12 @@ class PDFProcessor:
             completed_pages = 0
             
             # Sử dụng ProcessPoolExecutor để quản lý multiprocessing
-            with ProcessPoolExecutor(max_workers=optimal_workers) as executor:
+            with ProcessPoolExecutor(max_workers=optimal_workers) if worker_args else nullcontext() as executor:
                 # Submit tất cả tasks
                 future_to_page = {
                     executor.submit(process_pdf_page, args): args[1] 
                     for args in worker_args
-                }
+                } if worker_args else {}
                 
                 # Thu thập kết quả khi hoàn thành
                 for future in as_completed(future_to_page):
@@ -175,12 +228,12 @@ class PDFProcessor:
                         
                         # Cập nhật tiến độ
                         if status_callback:
-                            progress_percent = (completed_pages / total_pages) * 100
+                            progress_percent = (completed_pages / render_count) * 100
                             status_callback({
                                 'current_page': completed_pages,
-                                'total_pages': total_pages,
+                                'total_pages': render_count,
                                 'progress_percent': progress_percent,
-                                'message': f'Đã xử lý {completed_pages}/{total_pages} trang ({progress_percent:.1f}%)'
+                                'message': f'Đã xử lý {completed_pages}/{render_count} trang ({progress_percent:.1f}%)'
                             })
                     
                     except Exception as e:
@@ -200,7 +253,7 @@ class PDFProcessor:
             # Tạo thông báo kết quả
             if failed_pages:
                 if success_count > 0:
-                    message = f"Hoàn thành với một số lỗi: {success_count}/{total_pages} trang thành công"
+                    message = f"Hoàn thành với một số lỗi: {success_count}/{render_count} trang thành công"
                 else:
                     message = f"Thất bại: Không thể chuyển đổi trang nào"
                     return False, message, {
@@ -209,17 +262,37 @@ class PDFProcessor:
                         'failed_pages': failed_pages,
                         'processing_time': processing_time
                     }
+            elif render_count < total_pages:
+                message = (f"Chuyển đổi {render_count} trang trong {processing_time:.2f} giây "
+                           f"({total_pages - render_count} trang đã có ảnh)")
             else:
                 message = f"Chuyển đổi thành công {total_pages} trang trong {processing_time:.2f} giây"
             
+            render_info = {
+                'pdf_path': os.path.abspath(pdf_file),
+                'render_mode': self.render_mode,
+                'dpi': render_dpi,
+                'crop_dpi': self.crop_dpi if self.render_mode == "two_pass" else render_dpi,
+                'pixels_rendered': self.count_pixels(pdf_file, render_dpi),
+                'full_render_pixels': self.count_pixels(pdf_file, self.crop_dpi if self.render_mode == "two_pass" else render_dpi),
+                'output_bytes': sum(
+                    os.path.getsize(os.path.join(output_dir, name))
+                    for name in os.listdir(output_dir) if name.endswith('.png')
+                )
+            }
+            with open(os.path.join(output_dir, RENDER_INFO_FILE), 'w', encoding='utf-8') as f:
+                json.dump(render_info, f, indent=2)
+            
             return True, message, {
                 'total_pages': total_pages,
                 'successful_pages': success_count,
+                'rendered_pages': render_count,
                 'failed_pages': failed_pages,
                 'output_dir': output_dir,
                 'converted_images': converted_images,
                 'processing_time': processing_time,
-                'workers_used': optimal_workers
+                'workers_used': optimal_workers,
+                'render_info': render_info
             }
             
         except Exception as e:
@@ -227,6 +300,53 @@ class PDFProcessor:
             self.logger.error(error_msg)
             return False, error_msg, None
     
+    @staticmethod
+    def image_name(image_prefix: str, page_num: int) -> str:
+        """Tên file ảnh của trang (page_num 0-based)"""
+        return f"{image_prefix}_page_{page_num + 1:03d}.png"
+    
+    def _prune_images(self, output_dir: str, image_prefix: str, total_pages: int):
+        """Xóa ảnh trang không thuộc PDF hiện tại (upload trước có tên khác hoặc nhiều trang hơn)"""
+        expected = {self.image_name(image_prefix, page_num) for page_num in range(total_pages)}
+        removed = 0
+        for name in os.listdir(output_dir):
+            if name.endswith('.png') and name not in expected:
+                os.remove(os.path.join(output_dir, name))
+                removed += 1
+        if removed:
+            self.logger.info(f"Xóa {removed} ảnh trang cũ trong {output_dir}")
+    
+    @staticmethod
+    def page_hashes(pdf_file: str) -> List[str]:
+        """
+        Hash nội dung từng trang (content stream, ảnh/XObject được tham chiếu, kích thước, góc xoay)
+        
+        Không cần render: hash giống nhau nghĩa là trang render ra giống nhau.
+        
+        Returns:
+            list: sha1 hex theo thứ tự trang
+        """
+        hashes = []
+        with fitz.open(pdf_file) as doc:
+            for page in doc:
+                digest = hashlib.sha1()
+                digest.update(f"{tuple(page.rect)}|{page.rotation}".encode())
+                digest.update(page.read_contents())
+                xrefs = sorted({item[0] for item in page.get_images(full=True)} |
+                               {item[0] for item in page.get_xobjects()})
+                for xref in xrefs:
+                    digest.update(doc.xref_stream_raw(xref) or b'')
+                hashes.append(digest.hexdigest())
+        return hashes
+    
+    def render_signature(self) -> Dict[str, Any]:
+        """Thiết lập render ảnh hưởng tới ảnh trang và vùng crop (dùng làm một phần hash đầu vào)"""
+        return {
+            'render_mode': self.render_mode,
+            'dpi': self.detection_dpi if self.render_mode == "two_pass" else self.dpi,
+            'crop_dpi': self.crop_dpi if self.render_mode == "two_pass" else None
+        }
+    
     def get_pdf_info(self, pdf_file: str) -> Dict[str, Any]:
         """
         Lấy thông tin cơ bản của file PDF
@@ -251,10 +371,35 @@ class PDFProcessor:
         except Exception as e:
             return {'error': str(e)}
     
+    @staticmethod
+    def count_pixels(pdf_file: str, dpi: int) -> int:
+        """Tổng số pixel khi render toàn bộ các trang ở DPI cho trước (chỉ đọc kích thước trang)"""
+        zoom_factor = dpi / 72
+        with fitz.open(pdf_file) as doc:
+            return sum(
+                round(page.rect.width * zoom_factor) * round(page.rect.height * zoom_factor)
+                for page in doc
+            )
+    
     def set_dpi(self, dpi: int):
         """Thiết lập DPI cho ảnh output"""
         self.dpi = max(72, min(600, dpi))  # Giới hạn DPI từ 72-600
     
+    def set_render_mode(self, mode: str, detection_dpi: int = 100, crop_dpi: int = 300):
+        """
+        Thiết lập chế độ render
+        
+        Args:
+            mode (str): "full" (cả trang ở self.dpi) hoặc "two_pass" (trang ở detection_dpi, vùng crop ở crop_dpi)
+            detection_dpi (int): DPI render trang cho YOLO ở chế độ two_pass
+            crop_dpi (int): DPI render vùng crop/OCR ở chế độ two_pass
+        """
+        if mode not in RENDER_MODES:
+            raise ValueError(f"Render mode không hợp lệ: {mode} (chỉ hỗ trợ {RENDER_MODES})")
+        self.render_mode = mode
+        self.detection_dpi = max(72, min(600, detection_dpi))
+        self.crop_dpi = max(72, min(600, crop_dpi))
+    
     def set_max_workers(self, max_workers: int):
         """Thiết lập số worker tối đa"""
         self.max_workers = max(1, min(mp.cpu_count(), max_workers))
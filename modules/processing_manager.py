@@ -1,14 +1,24 @@
 # modules/processing_manager.py
 import os
+import re
+import json
 import time
+import shutil
 import logging
 import traceback
 import sys
+from contextlib import nullcontext
 from pathlib import Path
 from datetime import datetime
 from .pdf_processor import PDFProcessor
 from .yolo_processor import YOLOProcessor
 from .ocr_deepseak import OCRProcessor
+from .search_index import get_search_index
+from .gallery_manifest import get_book_manifest
+from .status_store import StatusStore
+from .book_checkpoint import BookCheckpoint
+from .question_store import QuestionStore, get_question_store
+from .ocr_results import get_ocr_result_log
 # from .ocr_processor import OCRProcessor
 
 class ProcessingManager:
@@ -44,12 +54,38 @@ class ProcessingManager:
                 self.yolo_processor = YOLOProcessor()
                 self.logger.info("✓ YOLOProcessor OK (legacy mode)")
             
-            # Khởi tạo OCRProcessor  
+            # Chia CPU core giữa YOLO inference, crop workers và PDF render processes
+            cpu_budget = self.yolo_processor.backend.cpu_budget
+            self.pdf_processor.set_max_workers(cpu_budget.pdf_workers)
+            self.logger.info(f"✓ CPU budget: {cpu_budget.as_dict()}")
+            
+            # Chế độ render PDF: full (300 DPI cả trang) hoặc two_pass (DPI thấp để detect, vùng crop ở DPI cao)
+            config = self.yolo_processor.config
+            self.pdf_processor.set_render_mode(
+                getattr(config, 'PDF_RENDER_MODE', 'full'),
+                getattr(config, 'PDF_DETECTION_DPI', 100),
+                getattr(config, 'PDF_CROP_DPI', 300)
+            )
+            self.logger.info(f"✓ PDF render mode: {self.pdf_processor.render_mode}")
+            
+            # Khởi tạo OCRProcessor - dùng chung OCRStage trong ProcessingEngine của YOLOProcessor
+            # (cùng engine với run.py: giới hạn OCR_MAX_IN_FLIGHT, retry, prompt, định dạng text.txt)
             self.logger.info("Khởi tạo OCRProcessor...")
-            self.ocr_processor = OCRProcessor()
+            self.engine = self.yolo_processor.engine
+            self.ocr_processor = OCRProcessor(ocr_stage=self.engine.ocr)
             self.logger.info("✓ OCRProcessor OK")
             
-            self.status_data = {}
+            # Trạng thái job: có lock, tự xóa job đã xong sau STATUS_TTL, lưu file nếu có STATUS_PERSIST_PATH
+            self.status_store = StatusStore(
+                ttl=getattr(config, 'STATUS_TTL', StatusStore.DEFAULT_TTL),
+                max_entries=getattr(config, 'STATUS_MAX_ENTRIES', StatusStore.DEFAULT_MAX_ENTRIES),
+                persist_path=getattr(config, 'STATUS_PERSIST_PATH', None)
+            )
+            
+            # JobScheduler thay bằng stage_slot để giới hạn số job trong từng bước và hủy job
+            self.stage_gate = lambda status_id, stage: nullcontext()
+            # JobScheduler thay bằng check_cancelled: ném JobCancelled từ callback tiến trình khi job bị hủy
+            self.cancel_check = lambda status_id: None
             
             self.logger.info("=== PROCESSING MANAGER KHỞI TẠO THÀNH CÔNG ===")
             
@@ -95,7 +131,22 @@ class ProcessingManager:
         if self.debug_mode:
             self.logger.error("Full traceback:")
             self.logger.error(traceback.format_exc())
-    
+
+    def _index_ocr_text(self, cropped_path):
+        """Cập nhật search index với text.txt vừa OCR (lỗi index không làm hỏng job)"""
+        try:
+            stats = get_search_index().index_book(cropped_path, kinds=('ocr',))
+            self.logger.info(f"✓ Search index: {stats['sources_updated']} file, {stats['documents']} document")
+        except Exception as e:
+            self._log_exception(e, "search index")
+
+    def _rebuild_gallery_manifest(self, book_name):
+        """Dựng manifest Gallery ngay khi có crop/detection mới (lỗi không làm hỏng job)"""
+        try:
+            get_book_manifest(book_name).rebuild()
+        except Exception as e:
+            self._log_exception(e, "gallery manifest")
+
     def process_pdf_complete(self, pdf_path, book_name, status_id):
         """
         Xử lý hoàn chỉnh một file PDF qua tất cả các bước:
@@ -103,6 +154,9 @@ class ProcessingManager:
         2. YOLO detection và crop
         3. OCR
         
+        Từng trang được ghi vào BookCheckpoint sau mỗi bước: chạy lại job lỗi hoặc upload lại
+        cùng sách chỉ xử lý các trang còn thiếu hoặc đã đổi nội dung.
+        
         Args:
             pdf_path (str): Đường dẫn tới file PDF
             book_name (str): Tên sách (dùng làm tên thư mục)
@@ -117,23 +171,26 @@ class ProcessingManager:
             self.logger.info(f"=== BẮT ĐẦU XỬ LÝ PDF: {book_name} ===")
             
             # Khởi tạo trạng thái
-            self.status_data[status_id] = {
+            self.status_store.set(status_id, {
                 'stage': 'starting',
                 'message': 'Bắt đầu xử lý PDF...',
                 'progress': 0,
                 'status': 'processing',
                 'start_time': start_time
-            }
+            })
             
             # Tạo callback function để cập nhật trạng thái
             def update_status(data):
                 try:
-                    if status_id in self.status_data:
-                        self.status_data[status_id].update(data)
+                    if self.status_store.update(status_id, data):
                         if self.debug_mode and 'message' in data:
                             self.logger.debug(f"Update: {data['message']}")
                 except Exception as e:
                     self.logger.error(f"Lỗi update_status: {e}")
+                # Hủy giữa bước: dừng ngay tại trang / crop vừa xong (JobCancelled đi xuyên qua các except Exception)
+                self.cancel_check(status_id)
+            
+            checkpoint = BookCheckpoint(book_name)
             
             # STEP 1: Convert PDF to images
             self.logger.info("STEP 1: Convert PDF to images")
@@ -141,46 +198,101 @@ class ProcessingManager:
                 self._update_progress(status_id, 10, 'Bắt đầu chuyển đổi PDF...')
                 
                 images_dir = f"books_to_images/{book_name}"
-                success, message, pdf_info = self.pdf_processor.convert_to_images(
-                    pdf_path, images_dir, update_status
-                )
+                render_signature = self.pdf_processor.render_signature()
+                page_hashes = self.pdf_processor.page_hashes(pdf_path)
+                render_keys = [
+                    checkpoint.input_hash('render', page_hash, render_signature)
+                    for page_hash in page_hashes
+                ]
+                # Upload lại sách đã có: trang nào đổi / thêm / bớt / dời chỗ so với lần trước
+                page_diff = checkpoint.diff_pages(page_hashes)
+                if page_diff['previous_pages']:
+                    self._apply_page_diff(book_name, page_diff, checkpoint, images_dir, render_keys)
+                checkpoint.set_page_count(len(render_keys))
+                to_render = [
+                    page_num for page_num, render_key in enumerate(render_keys)
+                    if not checkpoint.is_done(page_num + 1, 'render', render_key)
+                ]
+                
+                with self.stage_gate(status_id, 'pdf'):
+                    success, message, pdf_info = self.pdf_processor.convert_to_images(
+                        pdf_path, images_dir, update_status, pages=to_render, image_prefix=book_name
+                    )
                 
                 if not success:
                     error_msg = f"Lỗi convert PDF: {message}"
                     self.logger.error(error_msg)
                     self._set_error(status_id, error_msg)
-                    return self.status_data[status_id]
+                    return self.get_status(status_id)
                 
-                self.logger.info(f"✓ PDF converted: {pdf_info.get('total_pages', 0)} pages")
+                converted = set(pdf_info.get('converted_images', []))
+                for page_num in to_render:
+                    image_path = os.path.join(images_dir, PDFProcessor.image_name(book_name, page_num))
+                    if image_path in converted:
+                        checkpoint.mark(page_num + 1, 'render', render_keys[page_num], outputs=[image_path],
+                                        page_hash=page_hashes[page_num])
+                checkpoint.flush()
+                
+                self.logger.info(f"✓ PDF converted: {len(converted)}/{len(render_keys)} pages "
+                                 f"({len(render_keys) - len(to_render)} từ checkpoint)")
                 self._update_progress(status_id, 30, f"Đã convert {pdf_info.get('total_pages', 0)} trang thành ảnh")
                 
             except Exception as e:
                 self._log_exception(e, "PDF conversion")
                 self._set_error(status_id, f"Lỗi convert PDF: {str(e)}")
-                return self.status_data[status_id]
+                return self.get_status(status_id)
             
             # STEP 2: YOLO processing
             self.logger.info("STEP 2: YOLO processing")
             try:
                 self._update_progress(status_id, 35, 'Bắt đầu YOLO detection...')
                 
-                success, message, yolo_info = self.yolo_processor.process_images(
-                    images_dir, ".", book_name, update_status
-                )
+                pages = self._checkpoint_pages(checkpoint, images_dir, render_keys)
+                to_crop = [page for page in pages if not checkpoint.is_done(page['page_no'], 'crop', page['crop_key'])]
+                # Trang đã detect nhưng chưa crop xong: dùng lại box, không predict lại
+                known_boxes = {
+                    page['index']: checkpoint.record(page['page_no'], 'detect')
+                    for page in to_crop if checkpoint.is_done(page['page_no'], 'detect', page['detect_key'])
+                }
+                
+                if to_crop:
+                    try:
+                        with self.stage_gate(status_id, 'yolo'):
+                            success, message, yolo_info = self.yolo_processor.process_images(
+                                images_dir, ".", book_name, update_status,
+                                image_indexes=[page['index'] for page in to_crop],
+                                known_boxes=known_boxes,
+                                page_callback=self._checkpoint_callback(checkpoint, pages)
+                            )
+                    finally:
+                        # Kể cả khi job bị hủy giữa chừng: trang đã crop không phải làm lại
+                        checkpoint.flush()
+                else:
+                    success, message, yolo_info = True, 'Tất cả trang đã được crop', {
+                        'total_images': 0,
+                        'skipped_images': len(pages),
+                        'cropped_dir': f"books_cropped/{book_name}",
+                        'results': []
+                    }
                 
                 if not success:
                     error_msg = f"Lỗi YOLO processing: {message}"
                     self.logger.error(error_msg)
                     self._set_error(status_id, error_msg)
-                    return self.status_data[status_id]
+                    return self.get_status(status_id)
+                
+                self.logger.info(f"✓ YOLO processed: {yolo_info.get('total_images', 0)} images "
+                                 f"({yolo_info.get('skipped_images', 0)} từ checkpoint)")
                 
-                self.logger.info(f"✓ YOLO processed: {yolo_info.get('total_images', 0)} images")
+                self._rebuild_gallery_manifest(book_name)
+                if yolo_info.get('render_stats'):
+                    self.logger.info(f"✓ Render stats: {yolo_info['render_stats']}")
                 self._update_progress(status_id, 70, f"Đã xử lý {yolo_info.get('total_images', 0)} ảnh với YOLO")
                 
             except Exception as e:
                 self._log_exception(e, "YOLO processing")
                 self._set_error(status_id, f"Lỗi YOLO processing: {str(e)}")
-                return self.status_data[status_id]
+                return self.get_status(status_id)
             
             # STEP 3: OCR processing
             self.logger.info("STEP 3: OCR processing")
@@ -188,46 +300,329 @@ class ProcessingManager:
                 self._update_progress(status_id, 75, 'Bắt đầu OCR...')
                 
                 cropped_path = f"books_cropped/{book_name}"
-                success, message, ocr_info = self.ocr_processor.process_directories(
-                    cropped_path, update_status
-                )
+                ocr_signature = self.engine.ocr.signature()
+                to_ocr = {}
+                for page in pages:
+                    page['ocr_key'] = checkpoint.input_hash('ocr', page['crop_key'], ocr_signature)
+                    if (checkpoint.is_done(page['page_no'], 'crop', page['crop_key']) and
+                            not checkpoint.is_done(page['page_no'], 'ocr', page['ocr_key'])):
+                        to_ocr[page['folder']] = page
+                
+                if to_ocr:
+                    try:
+                        with self.stage_gate(status_id, 'ocr'):
+                            success, message, ocr_info = self.ocr_processor.process_directories(
+                                cropped_path, update_status,
+                                folders=list(to_ocr),
+                                folder_callback=self._checkpoint_ocr_callback(checkpoint, to_ocr),
+                                pdf_path=pdf_path
+                            )
+                    finally:
+                        checkpoint.flush()
+                else:
+                    success, message, ocr_info = True, 'Tất cả folder đã được OCR', {
+                        'total_folders': 0,
+                        'processed_folders': 0,
+                        'results': []
+                    }
                 
                 if not success:
                     error_msg = f"Lỗi OCR: {message}"
                     self.logger.error(error_msg)
                     self._set_error(status_id, error_msg)
-                    return self.status_data[status_id]
+                    return self.get_status(status_id)
                 
-                self.logger.info("✓ OCR completed")
+                self.logger.info(f"✓ OCR completed ({len(pages) - len(to_ocr)} folder từ checkpoint)")
+                if to_ocr or page_diff['removed'] or page_diff['moved']:
+                    self._index_ocr_text(cropped_path)
                 
             except Exception as e:
                 self._log_exception(e, "OCR processing")
                 self._set_error(status_id, f"Lỗi OCR: {str(e)}")
-                return self.status_data[status_id]
+                return self.get_status(status_id)
             
             # STEP 4: Hoàn thành
             total_time = time.time() - start_time
             self._update_progress(status_id, 100, 'Hoàn thành tất cả các bước!')
             
-            self.status_data[status_id].update({
+            message = 'Hoàn thành xử lý PDF!'
+            if page_diff['previous_pages']:
+                message += (f" ({len(page_diff['changed'])} trang thay đổi, {len(page_diff['added'])} trang mới, "
+                            f"{len(page_diff['removed'])} trang bị bỏ, {len(page_diff['moved'])} trang dời chỗ)")
+            self.status_store.update(status_id, {
                 'status': 'completed',
-                'message': 'Hoàn thành xử lý PDF!',
+                'message': message,
                 'book_name': book_name,
                 'end_time': time.time(),
                 'results': {
                     'pdf_info': pdf_info,
                     'yolo_info': yolo_info,
-                    'ocr_info': ocr_info
+                    'ocr_info': ocr_info,
+                    'checkpoint': checkpoint.summary(),
+                    'page_diff': page_diff
                 }
             })
             
             self.logger.info(f"=== HOÀN THÀNH: {book_name} ({total_time:.2f}s) ===")
-            return self.status_data[status_id]
+            return self.get_status(status_id)
             
         except Exception as e:
             self._log_exception(e, "process_pdf_complete")
             self._set_error(status_id, f"Lỗi không xác định: {str(e)}")
-            return self.status_data[status_id]
+            return self.get_status(status_id)
+    
+    def _checkpoint_pages(self, checkpoint, images_dir, render_keys):
+        """
+        Các ảnh trang cần detect/crop cùng hash đầu vào của từng bước
+        
+        Returns:
+            list: [{'index', 'page_no', 'folder', 'detect_key', 'crop_key'}] theo thứ tự ảnh
+        """
+        detect_signature = self.yolo_processor.detection_signature()
+        crop_signature = self.engine.cropper.signature()
+        pages = []
+        for index, image_path in enumerate(self.yolo_processor.list_images(images_dir)):
+            page_no = self.yolo_processor._page_index(image_path, index) + 1
+            if page_no > len(render_keys):
+                continue
+            folder = self.engine.cropper.folder_name(page_no - 1)
+            detect_key = checkpoint.input_hash('detect', render_keys[page_no - 1], detect_signature)
+            pages.append({
+                'index': index,
+                'page_no': page_no,
+                'folder': folder,
+                'detect_key': detect_key,
+                # Folder đổi (vd. sách cũ đặt tên folder theo vị trí ảnh) thì crop cũ nằm sai chỗ
+                'crop_key': checkpoint.input_hash('crop', detect_key, folder, crop_signature)
+            })
+        return pages
+    
+    REPROCESS_REPORT_FILENAME = "reprocess_report.json"
+    
+    def _apply_page_diff(self, book_name, page_diff, checkpoint, images_dir, render_keys):
+        """
+        Cập nhật sách tại chỗ sau khi upload lại bản PDF đã sửa (gọi trước khi render)
+
+        - Trang dời chỗ (cùng hash nội dung, khác vị trí - vd. chèn/xóa một trang ở giữa): ảnh trang,
+          folder image_XXXX, ảnh detection, record checkpoint, kết quả OCR và đường dẫn ảnh trong
+          mapping.json được chuyển sang vị trí mới, không render/detect/OCR lại
+        - Xóa folder image_XXXX / ảnh detection / kết quả OCR (ocr_results.jsonl) của các vị trí không còn trong PDF
+        - Đánh dấu câu hỏi trong mapping.json dùng ảnh của trang đã đổi hoặc bị bỏ (needs_review),
+          bỏ các đường dẫn ảnh không còn tồn tại
+        - Ghi báo cáo diff ra books_cropped/<book>/reprocess_report.json
+        """
+        cropped_dir = os.path.join("books_cropped", book_name)
+        detection_dir = os.path.join("books_detections", book_name)
+        folder_of = lambda page_no: self.engine.cropper.folder_name(page_no - 1)
+        ocr_log = get_ocr_result_log(cropped_dir)
+        
+        moves = page_diff['moved']
+        folder_moves = {folder_of(old_page_no): folder_of(new_page_no) for old_page_no, new_page_no in moves}
+        self._move_page_outputs(book_name, images_dir, moves)
+        checkpoint.move_pages(moves, self._moved_record_rewriter(book_name, render_keys))
+        ocr_log.move_folders(folder_moves)
+        
+        removed_folders = []
+        if os.path.isdir(cropped_dir):
+            for name in sorted(os.listdir(cropped_dir)):
+                path = os.path.join(cropped_dir, name)
+                if (os.path.isdir(path) and name.startswith('image_') and name[6:].isdigit()
+                        and int(name[6:]) >= page_diff['total_pages']):
+                    shutil.rmtree(path, ignore_errors=True)
+                    detection_path = os.path.join(detection_dir, f"{name}_detections.jpg")
+                    if os.path.exists(detection_path):
+                        os.remove(detection_path)
+                    removed_folders.append(name)
+        ocr_log.reset_folders(removed_folders)
+        
+        # Folder mà nội dung cũ không còn ở đâu trong PDF mới
+        changed_folders = {folder_of(page_no) for page_no in page_diff['changed'] + page_diff['removed']}
+        flagged = self._update_questions(cropped_dir, folder_moves, changed_folders)
+        
+        page_diff.update({
+            'changed_folders': sorted(changed_folders),
+            'removed_folders': removed_folders,
+            'moved_folders': folder_moves,
+            'flagged_questions': flagged
+        })
+        report_path = os.path.join(cropped_dir, self.REPROCESS_REPORT_FILENAME)
+        try:
+            os.makedirs(cropped_dir, exist_ok=True)
+            with open(report_path, 'w', encoding='utf-8') as f:
+                json.dump({**page_diff, 'created_at': datetime.now().isoformat()}, f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            self.logger.warning(f"Không ghi được {report_path}: {e}")
+        
+        self.logger.info(f"✓ Page diff: {len(page_diff['changed'])} đổi, {len(page_diff['added'])} mới, "
+                         f"{len(page_diff['removed'])} bỏ, {len(moves)} dời chỗ, {len(flagged)} câu hỏi cần xem lại")
+    
+    def _move_page_outputs(self, book_name, images_dir, moves):
+        """
+        Dời ảnh trang, folder image_XXXX và ảnh detection của các trang dời chỗ sang vị trí mới
+        
+        Các vị trí thường nối đuôi nhau (trang 3 → 4, 4 → 5, ...) nên mọi nguồn được đổi sang tên tạm trước.
+        crops.json của folder được sửa page_index theo trang mới.
+        """
+        cropped_dir = os.path.join("books_cropped", book_name)
+        detection_dir = os.path.join("books_detections", book_name)
+        
+        def page_paths(page_no):
+            folder = self.engine.cropper.folder_name(page_no - 1)
+            return [
+                os.path.join(images_dir, PDFProcessor.image_name(book_name, page_no - 1)),
+                os.path.join(cropped_dir, folder),
+                os.path.join(detection_dir, f"{folder}_detections.jpg")
+            ]
+        
+        staged = []
+        for old_page_no, new_page_no in moves:
+            for source, target in zip(page_paths(old_page_no), page_paths(new_page_no)):
+                if os.path.exists(source):
+                    os.replace(source, f"{source}.moving")
+                    staged.append((f"{source}.moving", target))
+        for temp_path, target in staged:
+            # Đích còn là đầu ra của nội dung cũ đã bị sửa/bỏ
+            if os.path.isdir(target):
+                shutil.rmtree(target)
+            elif os.path.exists(target):
+                os.remove(target)
+            os.replace(temp_path, target)
+        
+        for _, new_page_no in moves:
+            index_path = os.path.join(page_paths(new_page_no)[1], self.engine.cropper.INDEX_FILENAME)
+            try:
+                with open(index_path, 'r', encoding='utf-8') as f:
+                    crops = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for crop in crops:
+                if 'page_index' in crop:
+                    crop['page_index'] = new_page_no - 1
+            self.engine.cropper.write_index(Path(index_path).parent, crops)
+    
+    def _moved_record_rewriter(self, book_name, render_keys):
+        """
+        rewrite() cho BookCheckpoint.move_pages: đổi đường dẫn đầu ra sang vị trí mới và tính lại
+        hash crop/OCR (phụ thuộc tên folder) - bước chỉ còn "xong" nếu hash cũ khớp thiết lập hiện tại
+        """
+        detect_signature = self.yolo_processor.detection_signature()
+        crop_signature = self.engine.cropper.signature()
+        ocr_signature = self.engine.ocr.signature()
+        
+        def rewrite(stage, record, old_page_no, new_page_no):
+            old_folder = self.engine.cropper.folder_name(old_page_no - 1)
+            new_folder = self.engine.cropper.folder_name(new_page_no - 1)
+            names = {
+                PDFProcessor.image_name(book_name, old_page_no - 1): PDFProcessor.image_name(book_name, new_page_no - 1),
+                old_folder: new_folder,
+                f"{old_folder}_detections.jpg": f"{new_folder}_detections.jpg"
+            }
+            relocate = lambda path: ''.join(names.get(part, part) for part in re.split(r'([\\/])', path))
+            
+            record = dict(record, outputs=[relocate(path) for path in record.get('outputs', [])])
+            if record.get('detection_image'):
+                record['detection_image'] = relocate(record['detection_image'])
+            if stage in ('crop', 'ocr') and new_page_no <= len(render_keys):
+                detect_key = BookCheckpoint.input_hash('detect', render_keys[new_page_no - 1], detect_signature)
+                crop_keys = {
+                    folder: BookCheckpoint.input_hash('crop', detect_key, folder, crop_signature)
+                    for folder in (old_folder, new_folder)
+                }
+                if stage == 'crop':
+                    record['folder'] = new_folder
+                    if record['input'] == crop_keys[old_folder]:
+                        record['input'] = crop_keys[new_folder]
+                elif record['input'] == BookCheckpoint.input_hash('ocr', crop_keys[old_folder], ocr_signature):
+                    record['input'] = BookCheckpoint.input_hash('ocr', crop_keys[new_folder], ocr_signature)
+            return record
+        return rewrite
+    
+    def _update_questions(self, cropped_dir, folder_moves, changed_folders):
+        """
+        Cập nhật câu hỏi theo page diff (lỗi không làm hỏng job)
+        
+        - Ảnh thuộc folder dời chỗ: đổi đường dẫn sang folder mới, câu hỏi không bị đánh dấu
+        - Ảnh thuộc folder đã đổi/bị bỏ: đánh dấu needs_review, bỏ ảnh không còn tồn tại
+          (hoặc folder nay chứa trang khác dời tới)
+        
+        Returns:
+            list: 'index' của các câu hỏi đã đánh dấu
+        """
+        has_questions = any(
+            os.path.exists(os.path.join(cropped_dir, name))
+            for name in (QuestionStore.DB_FILENAME, QuestionStore.MAPPING_FILENAME)
+        )
+        if not (folder_moves or changed_folders) or not has_questions:
+            return []
+        
+        move_targets = set(folder_moves.values())
+        
+        def keep(path):
+            folder = path.split('/')[0]
+            if folder in changed_folders:
+                return folder not in move_targets and os.path.exists(os.path.join(cropped_dir, path))
+            return True
+        
+        def relocate(path):
+            folder, sep, rest = path.partition('/')
+            return folder_moves[folder] + sep + rest if folder in folder_moves else path
+        
+        try:
+            store = get_question_store(cropped_dir)
+            operations = []
+            flagged = []
+            for question in store.list_questions():
+                images = {key: question.get(key) for key in ('image_question', 'image_answer')
+                          if isinstance(question.get(key), list)}
+                folders = {path.split('/')[0] for paths in images.values() for path in paths if isinstance(path, str)}
+                affected = sorted(folders & changed_folders)
+                if not (affected or folders & set(folder_moves)) or question.get('index') is None:
+                    continue
+                fields = {
+                    key: [relocate(path) if isinstance(path, str) else path
+                          for path in paths if not isinstance(path, str) or keep(path)]
+                    for key, paths in images.items()
+                }
+                if affected:
+                    fields.update({'needs_review': True, 'changed_folders': affected})
+                    flagged.append(question['index'])
+                operations.append({'op': 'update', 'index': question['index'], 'set': fields})
+            
+            if operations:
+                store.apply_bulk(operations)
+                store.export()
+            return flagged
+        except Exception as e:
+            self._log_exception(e, "update questions")
+            return []
+    
+    def _checkpoint_callback(self, checkpoint, pages):
+        """page_callback cho YOLOProcessor: ghi bước detect/crop của từng trang vào checkpoint"""
+        by_index = {page['index']: page for page in pages}
+        
+        def on_page(stage, index, data):
+            page = by_index.get(index)
+            if page is None:
+                return
+            if stage == 'detect':
+                detection_image = data.get('detection_image')
+                checkpoint.mark(page['page_no'], 'detect', page['detect_key'],
+                                outputs=[detection_image] if detection_image else [],
+                                boxes=data['boxes'], detection_image=detection_image)
+            elif stage == 'crop' and data and data.get('status') in ('success', 'no_detection'):
+                outputs = [data['cropped_folder']] + [item['crop_path'] for item in data.get('bbox_results', [])]
+                checkpoint.mark(page['page_no'], 'crop', page['crop_key'], outputs=outputs, folder=page['folder'])
+        return on_page
+    
+    def _checkpoint_ocr_callback(self, checkpoint, to_ocr):
+        """folder_callback cho OCRProcessor: folder chỉ được coi là xong khi mọi ảnh đều OCR thành công"""
+        def on_folder(folder_name, result):
+            page = to_ocr.get(folder_name)
+            if page is None or result.get('status') != 'success':
+                return
+            if result.get('processed_files') == result.get('total_files'):
+                checkpoint.mark(page['page_no'], 'ocr', page['ocr_key'], outputs=[result['output_file']])
+        return on_folder
     
     def process_pdf_step_by_step(self, pdf_path, book_name, status_id, steps_to_run=None):
         """
@@ -248,7 +643,8 @@ class ProcessingManager:
             self.logger.info(f"=== XỬ LÝ STEP BY STEP: {book_name} ===")
             self.logger.info(f"Steps: {steps_to_run}")
             
-            self.status_data[status_id] = {
+            completed_steps = []
+            self.status_store.set(status_id, {
                 'stage': 'starting',
                 'message': 'Bắt đầu xử lý theo bước...',
                 'progress': 0,
@@ -256,16 +652,17 @@ class ProcessingManager:
                 'start_time': start_time,
                 'steps_to_run': steps_to_run,
                 'completed_steps': []
-            }
+            })
             
             def update_status(data):
                 try:
-                    if status_id in self.status_data:
-                        self.status_data[status_id].update(data)
+                    if self.status_store.update(status_id, data):
                         if self.debug_mode and 'message' in data:
                             self.logger.debug(f"Update: {data['message']}")
                 except Exception as e:
                     self.logger.error(f"Lỗi update_status: {e}")
+                # Hủy giữa bước: dừng ngay tại trang / crop vừa xong (JobCancelled đi xuyên qua các except Exception)
+                self.cancel_check(status_id)
             
             results = {}
             
@@ -276,25 +673,27 @@ class ProcessingManager:
                     self._update_progress(status_id, 10, 'Đang chuyển đổi PDF thành ảnh...')
                     
                     images_dir = f"books_to_images/{book_name}"
-                    success, message, pdf_info = self.pdf_processor.convert_to_images(
-                        pdf_path, images_dir, update_status
-                    )
+                    with self.stage_gate(status_id, 'pdf'):
+                        success, message, pdf_info = self.pdf_processor.convert_to_images(
+                            pdf_path, images_dir, update_status
+                        )
                     
                     if not success:
                         error_msg = f"Lỗi convert PDF: {message}"
                         self.logger.error(error_msg)
                         self._set_error(status_id, error_msg)
-                        return self.status_data[status_id]
+                        return self.get_status(status_id)
                     
                     results['pdf'] = pdf_info
-                    self.status_data[status_id]['completed_steps'].append('pdf')
+                    completed_steps.append('pdf')
+                    self.status_store.update(status_id, {'completed_steps': list(completed_steps)})
                     self.logger.info("✓ PDF step completed")
                     self._update_progress(status_id, 33, 'Hoàn thành chuyển đổi PDF')
                     
                 except Exception as e:
                     self._log_exception(e, "PDF step")
                     self._set_error(status_id, f"Lỗi PDF step: {str(e)}")
-                    return self.status_data[status_id]
+                    return self.get_status(status_id)
             
             # Step 2: YOLO Processing
             if 'yolo' in steps_to_run:
@@ -303,25 +702,28 @@ class ProcessingManager:
                     self._update_progress(status_id, 35, 'Đang xử lý YOLO detection...')
                     
                     images_dir = f"books_to_images/{book_name}"
-                    success, message, yolo_info = self.yolo_processor.process_images(
-                        images_dir, ".", book_name, update_status
-                    )
+                    with self.stage_gate(status_id, 'yolo'):
+                        success, message, yolo_info = self.yolo_processor.process_images(
+                            images_dir, ".", book_name, update_status
+                        )
                     
                     if not success:
                         error_msg = f"Lỗi YOLO processing: {message}"
                         self.logger.error(error_msg)
                         self._set_error(status_id, error_msg)
-                        return self.status_data[status_id]
+                        return self.get_status(status_id)
                     
                     results['yolo'] = yolo_info
-                    self.status_data[status_id]['completed_steps'].append('yolo')
+                    self._rebuild_gallery_manifest(book_name)
+                    completed_steps.append('yolo')
+                    self.status_store.update(status_id, {'completed_steps': list(completed_steps)})
                     self.logger.info("✓ YOLO step completed")
                     self._update_progress(status_id, 66, 'Hoàn thành YOLO detection')
                     
                 except Exception as e:
                     self._log_exception(e, "YOLO step")
                     self._set_error(status_id, f"Lỗi YOLO step: {str(e)}")
-                    return self.status_data[status_id]
+                    return self.get_status(status_id)
             
             # Step 3: OCR Processing
             if 'ocr' in steps_to_run:
@@ -330,29 +732,32 @@ class ProcessingManager:
                     self._update_progress(status_id, 70, 'Đang thực hiện OCR...')
                     
                     cropped_path = f"books_cropped/{book_name}"
-                    success, message, ocr_info = self.ocr_processor.process_directories(
-                        cropped_path, update_status
-                    )
+                    with self.stage_gate(status_id, 'ocr'):
+                        success, message, ocr_info = self.ocr_processor.process_directories(
+                            cropped_path, update_status, pdf_path=pdf_path
+                        )
                     
                     if not success:
                         error_msg = f"Lỗi OCR: {message}"
                         self.logger.error(error_msg)
                         self._set_error(status_id, error_msg)
-                        return self.status_data[status_id]
+                        return self.get_status(status_id)
                     
                     results['ocr'] = ocr_info
-                    self.status_data[status_id]['completed_steps'].append('ocr')
+                    self._index_ocr_text(cropped_path)
+                    completed_steps.append('ocr')
+                    self.status_store.update(status_id, {'completed_steps': list(completed_steps)})
                     self.logger.info("✓ OCR step completed")
                     self._update_progress(status_id, 100, 'Hoàn thành OCR')
                     
                 except Exception as e:
                     self._log_exception(e, "OCR step")
                     self._set_error(status_id, f"Lỗi OCR step: {str(e)}")
-                    return self.status_data[status_id]
+                    return self.get_status(status_id)
             
             # Hoàn thành
             total_time = time.time() - start_time
-            self.status_data[status_id].update({
+            self.status_store.update(status_id, {
                 'status': 'completed',
                 'message': f'Hoàn thành các bước: {", ".join(steps_to_run)}',
                 'book_name': book_name,
@@ -361,45 +766,45 @@ class ProcessingManager:
             })
             
             self.logger.info(f"=== HOÀN THÀNH STEP BY STEP: {book_name} ({total_time:.2f}s) ===")
-            return self.status_data[status_id]
+            return self.get_status(status_id)
             
         except Exception as e:
             self._log_exception(e, "process_pdf_step_by_step")
             self._set_error(status_id, f"Lỗi không xác định: {str(e)}")
-            return self.status_data[status_id]
+            return self.get_status(status_id)
     
     def get_status(self, status_id):
-        """Lấy trạng thái xử lý"""
-        return self.status_data.get(status_id, {
-            'status': 'not_found',
-            'message': 'Không tìm thấy tiến trình xử lý'
-        })
+        """Lấy trạng thái xử lý (bản sao)"""
+        status = self.status_store.get(status_id)
+        if status is None:
+            return {
+                'status': 'not_found',
+                'message': 'Không tìm thấy tiến trình xử lý'
+            }
+        return status
     
     def cleanup_status(self, status_id):
         """Xóa trạng thái sau khi hoàn thành"""
-        if status_id in self.status_data:
-            del self.status_data[status_id]
+        self.status_store.delete(status_id)
     
     def get_all_statuses(self):
-        """Lấy tất cả trạng thái đang xử lý"""
-        return self.status_data
+        """Lấy tất cả trạng thái (rút gọn, không kèm kết quả chi tiết)"""
+        return self.status_store.snapshot(compact=True)
     
     def _update_progress(self, status_id, progress, message):
         """Cập nhật tiến trình"""
-        if status_id in self.status_data:
-            self.status_data[status_id].update({
-                'progress': progress,
-                'message': message
-            })
+        self.status_store.update(status_id, {
+            'progress': progress,
+            'message': message
+        })
     
     def _set_error(self, status_id, error_message):
         """Đặt trạng thái lỗi"""
-        if status_id in self.status_data:
-            self.status_data[status_id].update({
-                'status': 'error',
-                'message': error_message,
-                'end_time': time.time()
-            })
+        self.status_store.update(status_id, {
+            'status': 'error',
+            'message': error_message,
+            'end_time': time.time()
+        })
     
     def validate_inputs(self, pdf_path, book_name):
         """
@@ -460,11 +865,10 @@ class ProcessingManager:
         Returns:
             dict: Tóm tắt kết quả
         """
-        if status_id not in self.status_data:
+        status = self.status_store.get(status_id)
+        if status is None:
             return None
         
-        status = self.status_data[status_id]
-        
         if status['status'] != 'completed':
             return {
                 'status': status['status'],
@@ -496,6 +900,7 @@ class ProcessingManager:
             summary['results']['yolo'] = {
                 'total_images': yolo_info.get('total_images', 0),
                 'output_dir': yolo_info.get('output_dir', ''),
+                'render_stats': yolo_info.get('render_stats'),
                 'status': 'success'
             }
         
@@ -0,0 +1,1008 @@
+# modules/question_store.py
+import os
+import json
+import gzip
+import base64
+import atexit
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from .search_index import get_search_index
+from modules_auto_mapping.mapping_writer import MappingWriter
+
+try:
+    import zstandard
+except ImportError:  # Nén zstd là tùy chọn
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+class QuestionStore:
+    """
+    Kho câu hỏi SQLite (WAL) cho một sách.
+
+    - Mỗi câu hỏi là một row, thứ tự trong mapping.json = thứ tự rowid (id), field 'index' có index riêng
+      nên thêm/sửa/xóa là O(log n) thay vì đọc + ghi lại toàn bộ mapping.json.
+    - mapping.json chỉ còn là file export: được ghi lại (temp file + rename) sau khi có thay đổi,
+      gom nhiều thay đổi liên tiếp trong EXPORT_DELAY giây thành một lần ghi.
+    - Nếu mapping.json bị ghi từ bên ngoài (run.py, MappingGenerator...), store tự import lại.
+      Mỗi thay đổi chưa export cũng được ghi vào pending_changes (cùng transaction) và được áp lại
+      lên bản vừa import, nên sửa trên web trong lúc chờ export không bị bản từ bên ngoài ghi đè.
+    - subject/chapter/lesson/difficulty/folder được trích ra cột có index, question/answer vào FTS5
+      để phân trang + lọc + tìm kiếm ở server (query_questions).
+    """
+
+    DB_FILENAME = "questions.db"
+    MAPPING_FILENAME = "mapping.json"
+    EXPORT_DELAY = 1.0  # giây
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS questions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idx INTEGER,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS pending_changes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            op TEXT NOT NULL,
+            before TEXT,
+            after TEXT
+        );
+    """
+
+    # Cột trích từ JSON để lọc/tìm kiếm bằng index (thêm vào DB cũ bằng ALTER TABLE)
+    FILTER_COLUMNS = ('subject', 'chapter', 'lesson', 'difficulty', 'folder')
+    TEXT_COLUMNS = ('question', 'answer')
+
+    # Index lọc + FTS5 (bảng external-content, giữ đồng bộ bằng trigger)
+    INDEXES = (
+        "CREATE INDEX IF NOT EXISTS ix_questions_idx ON questions(idx)",
+        "CREATE INDEX IF NOT EXISTS ix_questions_subject ON questions(subject)",
+        "CREATE INDEX IF NOT EXISTS ix_questions_chapter ON questions(chapter)",
+        "CREATE INDEX IF NOT EXISTS ix_questions_lesson ON questions(lesson)",
+        "CREATE INDEX IF NOT EXISTS ix_questions_difficulty ON questions(difficulty)",
+        "CREATE INDEX IF NOT EXISTS ix_questions_folder ON questions(folder)",
+        """CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5(
+            question, answer,
+            content='questions', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )""",
+        """CREATE TRIGGER IF NOT EXISTS questions_fts_ai AFTER INSERT ON questions BEGIN
+            INSERT INTO questions_fts(rowid, question, answer) VALUES (new.id, new.question, new.answer);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS questions_fts_ad AFTER DELETE ON questions BEGIN
+            INSERT INTO questions_fts(questions_fts, rowid, question, answer)
+            VALUES ('delete', old.id, old.question, old.answer);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS questions_fts_au AFTER UPDATE ON questions BEGIN
+            INSERT INTO questions_fts(questions_fts, rowid, question, answer)
+            VALUES ('delete', old.id, old.question, old.answer);
+            INSERT INTO questions_fts(rowid, question, answer) VALUES (new.id, new.question, new.answer);
+        END""",
+    )
+
+    SORT_KEYS = {'order': 'id', 'index': 'idx'}
+    DEFAULT_PAGE_SIZE = 50
+    MAX_PAGE_SIZE = 500
+
+    def __init__(self, book_dir):
+        """
+        Args:
+            book_dir (str): Thư mục sách (chứa mapping.json)
+        """
+        self.book_dir = book_dir
+        self.db_path = os.path.join(book_dir, self.DB_FILENAME)
+        self.mapping_path = os.path.join(book_dir, self.MAPPING_FILENAME)
+        self.writer = MappingWriter(book_dir)
+        self._local = threading.local()
+        self._export_lock = threading.Lock()
+        self._export_timer = None
+
+        os.makedirs(book_dir, exist_ok=True)
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+        self._migrate()
+        self._sync_from_mapping()
+
+    # === KẾT NỐI ===
+    def _conn(self):
+        """Mỗi thread một connection (sqlite3 không chia sẻ connection giữa các thread)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        """Transaction ghi (BEGIN IMMEDIATE) - serialize các writer giữa thread và process"""
+        return _Transaction(self._conn())
+
+    @staticmethod
+    def _get_meta(conn, key, default=None):
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    @staticmethod
+    def _set_meta(conn, key, value):
+        conn.execute(
+            "INSERT INTO meta(key, value) VALUES(?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, str(value))
+        )
+
+    def _migrate(self):
+        """Thêm cột lọc + FTS cho DB tạo từ phiên bản cũ và điền dữ liệu từ JSON"""
+        conn = self._conn()
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(questions)")}
+        missing = [c for c in self.FILTER_COLUMNS + self.TEXT_COLUMNS if c not in columns]
+        has_fts = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'questions_fts'"
+        ).fetchone() is not None
+        if not missing and has_fts:
+            return
+
+        with self._transaction() as conn:
+            # Kiểm tra lại trong transaction (process khác có thể vừa migrate xong)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(questions)")}
+            for column in self.FILTER_COLUMNS + self.TEXT_COLUMNS:
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE questions ADD COLUMN {column} TEXT")
+
+            rows = conn.execute("SELECT id, data FROM questions").fetchall()
+            conn.executemany(
+                "UPDATE questions SET subject = ?, chapter = ?, lesson = ?, difficulty = ?, folder = ?, "
+                "question = ?, answer = ? WHERE id = ?",
+                [self._row_values(json.loads(data))[2:] + (row_id,) for row_id, data in rows]
+            )
+            for statement in self.INDEXES:
+                conn.execute(statement)
+            conn.execute("INSERT INTO questions_fts(questions_fts) VALUES ('rebuild')")
+
+        logger.info(f"Đã cập nhật schema {self.db_path} ({len(rows)} câu hỏi)")
+
+    def _bump_revision(self, conn):
+        """Tăng revision sau mỗi thay đổi (dùng cho cache/ETag và để biết cần export)"""
+        revision = int(self._get_meta(conn, 'revision', 0)) + 1
+        self._set_meta(conn, 'revision', revision)
+        return revision
+
+    # === ĐỒNG BỘ VỚI mapping.json ===
+    def _mapping_signature(self):
+        """(mtime_ns, size) của mapping.json + journal hoặc None nếu chưa có"""
+        return self.writer.signature()
+
+    def _sync_from_mapping(self, schedule_export=True):
+        """
+        Import lại mapping.json nếu file đã đổi từ lần import/export gần nhất.
+        Thay đổi của store chưa kịp export (pending_changes) được áp lại lên bản vừa import.
+
+        Args:
+            schedule_export (bool): Hẹn export khi có thay đổi được áp lại (export() tự ghi ngay nên không cần)
+        """
+        signature = self._mapping_signature()
+        if signature is None:
+            return
+
+        conn = self._conn()
+        if self._get_meta(conn, 'mapping_signature') == signature:
+            return
+
+        try:
+            # mapping.json + các thao tác journal chưa compact (run.py đang ghi dở)
+            questions = self.writer.read()
+        except (OSError, ValueError) as e:
+            logger.error(f"Không đọc được {self.mapping_path}: {e}")
+            return
+
+        if not isinstance(questions, list):
+            logger.error(f"{self.mapping_path} không phải mảng câu hỏi, bỏ qua import")
+            return
+
+        with self._transaction() as conn:
+            # Kiểm tra lại trong transaction (process/thread khác có thể vừa import xong)
+            if self._get_meta(conn, 'mapping_signature') == signature:
+                return
+            pending = conn.execute("SELECT op, before, after FROM pending_changes ORDER BY id").fetchall()
+            if pending:
+                logger.warning(f"{self.mapping_path} bị sửa từ bên ngoài khi store còn {len(pending)} thay đổi "
+                               f"chưa export - áp lại các thay đổi này lên bản mapping.json")
+                questions = self._merge_changes(questions, pending)
+            self._replace_rows(conn, questions)
+            revision = self._bump_revision(conn)
+            self._set_meta(conn, 'mapping_signature', signature)
+            if not pending:
+                self._set_meta(conn, 'exported_revision', revision)
+
+        logger.info(f"Đã import {len(questions)} câu hỏi từ {self.mapping_path}")
+        if pending and schedule_export:
+            self._schedule_export()
+
+    @staticmethod
+    def _merge_changes(questions, changes):
+        """
+        Áp lại các thay đổi chưa export lên danh sách câu hỏi vừa import (so khớp theo nội dung, không theo rowid)
+
+        - create: thêm nếu chưa có câu hỏi giống hệt
+        - update: thay câu hỏi giống 'before' (không còn thì câu cùng 'index'; không có nữa thì thêm vào cuối)
+        - delete: xóa câu hỏi giống 'before' nếu còn
+        - replace: danh sách 'after' + các câu hỏi bên ngoài thêm vào (không có trong 'before' lẫn 'after')
+
+        Args:
+            questions (list): Câu hỏi từ mapping.json + journal
+            changes (list): [(op, before JSON, after JSON)] theo thứ tự ghi
+
+        Returns:
+            list: Câu hỏi sau khi áp lại
+        """
+        questions = list(questions)
+        for op, before, after in changes:
+            before = json.loads(before) if before is not None else None
+            after = json.loads(after) if after is not None else None
+            if op == 'create':
+                if after not in questions:
+                    questions.append(after)
+            elif op == 'update':
+                if after in questions:
+                    continue
+                if before in questions:
+                    questions[questions.index(before)] = after
+                    continue
+                same_index = [
+                    position for position, question in enumerate(questions)
+                    if before.get('index') is not None and question.get('index') == before.get('index')
+                ]
+                if same_index:
+                    logger.warning(f"Câu hỏi index {before.get('index')} bị sửa cả hai phía - giữ bản sửa trên web")
+                    questions[same_index[0]] = after
+                else:
+                    questions.append(after)
+            elif op == 'delete':
+                if before in questions:
+                    questions.remove(before)
+            elif op == 'replace':
+                # Bỏ câu hỏi đã có trong before/after (áp lại nhiều lần vẫn cho cùng kết quả)
+                known = list(before) + list(after)
+                added = []
+                for question in questions:
+                    if question in known:
+                        known.remove(question)
+                    else:
+                        added.append(question)
+                questions = list(after) + added
+        return questions
+
+    @staticmethod
+    def _record_change(conn, op, before=None, after=None):
+        """Ghi một thay đổi chưa export (trong transaction của thay đổi đó)"""
+        conn.execute(
+            "INSERT INTO pending_changes(op, before, after) VALUES(?, ?, ?)",
+            (op,
+             json.dumps(before, ensure_ascii=False) if before is not None else None,
+             json.dumps(after, ensure_ascii=False) if after is not None else None)
+        )
+
+    INSERT_SQL = (
+        "INSERT INTO questions(idx, data, subject, chapter, lesson, difficulty, folder, question, answer) "
+        "VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    )
+
+    @staticmethod
+    def question_folder(question):
+        """Folder ảnh của câu hỏi (image_XXXX của ảnh đầu tiên, giống cách UI nhận diện)"""
+        for key in ('image_question', 'image_answer'):
+            images = question.get(key) or []
+            if isinstance(images, list) and images and isinstance(images[0], str) and '/' in images[0]:
+                return images[0].split('/')[0]
+        return None
+
+    @classmethod
+    def _row_values(cls, question):
+        """(idx, data, subject, chapter, lesson, difficulty, folder, question, answer) cho một câu hỏi"""
+        data = json.dumps(question, ensure_ascii=False)
+        if not isinstance(question, dict):
+            return (None, data) + (None,) * 7
+
+        def text(key):
+            value = question.get(key)
+            return None if value is None else str(value)
+
+        return (
+            question.get('index'), data,
+            text('subject'), text('chapter'), text('lesson'), text('difficulty'),
+            cls.question_folder(question), text('question'), text('answer')
+        )
+
+    @classmethod
+    def _replace_rows(cls, conn, questions):
+        conn.execute("DELETE FROM questions")
+        conn.executemany(cls.INSERT_SQL, [cls._row_values(q) for q in questions])
+
+    # === ĐỌC ===
+    @property
+    def revision(self):
+        """Revision hiện tại của dữ liệu"""
+        self._sync_from_mapping()
+        return int(self._get_meta(self._conn(), 'revision', 0))
+
+    def list_questions(self):
+        """Toàn bộ câu hỏi theo thứ tự trong sách"""
+        return self.snapshot()[1]
+
+    def snapshot(self):
+        """
+        (revision, questions) đọc trong cùng một transaction - revision luôn khớp với danh sách
+
+        Returns:
+            tuple: (int, list)
+        """
+        self._sync_from_mapping()
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            revision = int(self._get_meta(conn, 'revision', 0))
+            rows = conn.execute("SELECT data FROM questions ORDER BY id").fetchall()
+        finally:
+            conn.execute("COMMIT")
+        return revision, [json.loads(row[0]) for row in rows]
+
+    def get_question(self, index):
+        """Câu hỏi theo field 'index' (None nếu không có)"""
+        self._sync_from_mapping()
+        row = self._conn().execute(
+            "SELECT data FROM questions WHERE idx = ? ORDER BY id LIMIT 1", (index,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def count(self):
+        """Số câu hỏi trong sách"""
+        self._sync_from_mapping()
+        return self._conn().execute("SELECT COUNT(*) FROM questions").fetchone()[0]
+
+    def next_index(self):
+        """Index cho câu hỏi mới (max + 1)"""
+        self._sync_from_mapping()
+        return self._next_index(self._conn())
+
+    @staticmethod
+    def _next_index(conn):
+        row = conn.execute("SELECT MAX(idx) FROM questions").fetchone()
+        return (row[0] or 0) + 1
+
+    @staticmethod
+    def _fts_query(search):
+        """Chuỗi tìm kiếm của người dùng → truy vấn FTS5 (mỗi từ là một prefix, AND với nhau)"""
+        terms = [term.replace('"', '') for term in search.split()]
+        return " ".join(f'"{term}"*' for term in terms if term)
+
+    @staticmethod
+    def _encode_cursor(key, row_id):
+        raw = json.dumps([key, row_id]).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def _decode_cursor(cursor):
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            key, row_id = json.loads(raw)
+            return key, int(row_id)
+        except (ValueError, TypeError):
+            raise ValueError("cursor không hợp lệ")
+
+    def query_questions(self, filters=None, search=None, sort='order', limit=None,
+                        cursor=None, offset=None, with_total=False):
+        """
+        Một trang câu hỏi, lọc bằng index của các cột trích xuất và FTS5 - chi phí mỗi trang
+        không phụ thuộc số câu hỏi của sách.
+
+        Args:
+            filters (dict): {subject, chapter, lesson, difficulty, folder} → so khớp chính xác
+            search (str): Từ khóa tìm trong question/answer (không phân biệt dấu)
+            sort (str): 'order' (thứ tự trong sách) hoặc 'index', thêm '-' phía trước để giảm dần
+            limit (int): Số câu hỏi mỗi trang (tối đa MAX_PAGE_SIZE)
+            cursor (str): next_cursor của trang trước (keyset pagination)
+            offset (int): Phân trang theo offset thay cho cursor
+            with_total (bool): Đếm tổng số câu hỏi khớp điều kiện
+
+        Returns:
+            dict: {'items', 'next_cursor', 'limit', 'total'?, 'next_offset'?}
+        """
+        descending = sort.startswith('-')
+        column = self.SORT_KEYS.get(sort.lstrip('-'))
+        if column is None:
+            raise ValueError(f"sort không hợp lệ: {sort}")
+
+        limit = min(max(int(limit or self.DEFAULT_PAGE_SIZE), 1), self.MAX_PAGE_SIZE)
+
+        where, params = [], []
+        for key, value in (filters or {}).items():
+            if key not in self.FILTER_COLUMNS:
+                raise ValueError(f"Không lọc được theo '{key}'")
+            if value not in (None, ''):
+                where.append(f"{key} = ?")
+                params.append(value)
+
+        if search and search.strip():
+            match = self._fts_query(search)
+            if match:
+                where.append("id IN (SELECT rowid FROM questions_fts WHERE questions_fts MATCH ?)")
+                params.append(match)
+
+        self._sync_from_mapping()
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            result = {'limit': limit}
+            if with_total:
+                sql = "SELECT COUNT(*) FROM questions" + (" WHERE " + " AND ".join(where) if where else "")
+                result['total'] = conn.execute(sql, params).fetchone()[0]
+
+            page_where, page_params = list(where), list(params)
+            if cursor and offset is None:
+                page_where.append(self._cursor_condition(column, descending))
+                page_params.extend(self._cursor_params(column, descending, *self._decode_cursor(cursor)))
+
+            direction = "DESC" if descending else "ASC"
+            order = f"{column} {direction}" if column == 'id' else f"{column} {direction}, id {direction}"
+            sql = (
+                f"SELECT id, {column}, data FROM questions"
+                + (" WHERE " + " AND ".join(f"({w})" for w in page_where) if page_where else "")
+                + f" ORDER BY {order} LIMIT ?"
+            )
+            page_params.append(limit + 1)
+            if offset is not None:
+                sql += " OFFSET ?"
+                page_params.append(max(int(offset), 0))
+
+            rows = conn.execute(sql, page_params).fetchall()
+        finally:
+            conn.execute("COMMIT")
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        result['items'] = [json.loads(row[2]) for row in rows]
+        result['next_cursor'] = self._encode_cursor(rows[-1][1], rows[-1][0]) if has_more else None
+        if offset is not None:
+            result['next_offset'] = max(int(offset), 0) + limit if has_more else None
+        return result
+
+    @staticmethod
+    def _cursor_condition(column, descending):
+        """Điều kiện keyset cho (column, id); idx NULL đứng đầu khi tăng dần (giống SQLite)"""
+        if column == 'id':
+            return "id < ?" if descending else "id > ?"
+        op = "<" if descending else ">"
+        if descending:
+            # Giảm dần: các giá trị rồi mới tới NULL
+            return (f"(? IS NULL AND {column} IS NULL AND id < ?) OR "
+                    f"(? IS NOT NULL AND (({column}, id) {op} (?, ?) OR {column} IS NULL))")
+        return (f"(? IS NULL AND ({column} IS NOT NULL OR id > ?)) OR "
+                f"(? IS NOT NULL AND ({column}, id) {op} (?, ?))")
+
+    @staticmethod
+    def _cursor_params(column, descending, key, row_id):
+        if column == 'id':
+            return [row_id]
+        return [key, row_id, key, key, row_id]
+
+    # === GHI ===
+    def add_question(self, question):
+        """
+        Thêm câu hỏi vào cuối sách. Nếu chưa có 'index', cấp index mới trong cùng transaction
+        nên hai request đồng thời không bị trùng index.
+
+        Returns:
+            dict: Câu hỏi đã lưu
+        """
+        self._sync_from_mapping()
+        question = dict(question)
+        with self._transaction() as conn:
+            if question.get('index') is None:
+                question.pop('index', None)
+                question = {'index': self._next_index(conn), **question}
+            conn.execute(self.INSERT_SQL, self._row_values(question))
+            self._record_change(conn, 'create', after=question)
+            self._bump_revision(conn)
+
+        self._schedule_export()
+        return question
+
+    def update_question(self, index, fields):
+        """
+        Cập nhật các field của câu hỏi theo 'index'
+
+        Returns:
+            dict | None: Câu hỏi sau khi cập nhật, None nếu không tìm thấy
+        """
+        self._sync_from_mapping()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT id, data FROM questions WHERE idx = ? ORDER BY id LIMIT 1", (index,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            before = json.loads(row[1])
+            question = {**before, **fields}
+            self._write_row(conn, row[0], question)
+            self._record_change(conn, 'update', before, question)
+            self._bump_revision(conn)
+
+        self._schedule_export()
+        return question
+
+    def delete_question(self, index):
+        """
+        Xóa câu hỏi theo 'index'
+
+        Returns:
+            bool: True nếu đã xóa
+        """
+        self._sync_from_mapping()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT id, data FROM questions WHERE idx = ? ORDER BY id LIMIT 1", (index,)
+            ).fetchone()
+            if row is None:
+                return False
+            conn.execute("DELETE FROM questions WHERE id = ?", (row[0],))
+            self._record_change(conn, 'delete', before=json.loads(row[1]))
+            self._bump_revision(conn)
+
+        self._schedule_export()
+        return True
+
+    def replace_all(self, questions):
+        """Thay toàn bộ câu hỏi của sách (JSON editor, import)"""
+        with self._transaction() as conn:
+            before = [json.loads(row[0]) for row in conn.execute("SELECT data FROM questions ORDER BY id")]
+            self._replace_rows(conn, questions)
+            self._record_change(conn, 'replace', before, list(questions))
+            self._bump_revision(conn)
+
+        self._schedule_export()
+
+    BULK_OPS = ('create', 'update', 'delete', 'reindex')
+
+    @staticmethod
+    def _is_int(value):
+        return isinstance(value, int) and not isinstance(value, bool)
+
+    def _select_rows(self, conn, operation):
+        """Các row (id, data) mà thao tác update/delete nhắm tới: theo 'index' hoặc 'where'"""
+        if 'index' in operation:
+            if not self._is_int(operation['index']):
+                raise ValueError("'index' phải là số nguyên")
+            return conn.execute(
+                "SELECT id, data FROM questions WHERE idx = ? ORDER BY id", (operation['index'],)
+            ).fetchall()
+
+        where = operation.get('where')
+        if not isinstance(where, dict) or not where:
+            raise ValueError("cần 'index' hoặc 'where'")
+
+        clauses, params = [], []
+        for key, value in where.items():
+            if key == 'indexes':
+                if not isinstance(value, list) or not all(self._is_int(item) for item in value):
+                    raise ValueError("'indexes' phải là mảng số nguyên")
+                values = value
+                clauses.append(f"idx IN ({', '.join('?' * len(values))})" if values else "0")
+                params.extend(values)
+            elif key in self.FILTER_COLUMNS:
+                clauses.append(f"{key} IS ?")
+                params.append(value)
+            else:
+                raise ValueError(f"không lọc được theo '{key}'")
+        return conn.execute(
+            f"SELECT id, data FROM questions WHERE {' AND '.join(clauses)} ORDER BY id", params
+        ).fetchall()
+
+    def _write_row(self, conn, row_id, question):
+        conn.execute(
+            "UPDATE questions SET idx = ?, data = ?, subject = ?, chapter = ?, lesson = ?, "
+            "difficulty = ?, folder = ?, question = ?, answer = ? WHERE id = ?",
+            self._row_values(question) + (row_id,)
+        )
+
+    def apply_bulk(self, operations, dry_run=False):
+        """
+        Áp dụng nhiều thao tác trong MỘT transaction (lỗi ở bất kỳ thao tác nào → không thay đổi gì)
+        và một lần export mapping.json.
+
+        Thao tác:
+            {'op': 'create', 'question': {...}}
+            {'op': 'update', 'index': 5 | 'where': {...}, 'set': {...}}
+            {'op': 'delete', 'index': 5 | 'where': {...}}
+            {'op': 'reindex', 'start': 1}  - đánh lại index theo thứ tự trong sách
+        'where' lọc theo subject/chapter/lesson/difficulty/folder và/hoặc 'indexes': [...]
+
+        Args:
+            operations (list): Danh sách thao tác
+            dry_run (bool): Chỉ tính diff rồi rollback
+
+        Returns:
+            dict: Diff {'created', 'updated' [{'before', 'after'}], 'deleted',
+                  'reindexed' {id row: {'before', 'after'}} (index có thể trùng nhau nên không dùng làm khóa), 'revision'}
+        """
+        if not isinstance(operations, list) or not operations:
+            raise ValueError("operations phải là mảng không rỗng")
+
+        self._sync_from_mapping()
+        diff = {'created': [], 'updated': [], 'deleted': [], 'reindexed': {}}
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for position, operation in enumerate(operations):
+                op = operation.get('op') if isinstance(operation, dict) else None
+                if op not in self.BULK_OPS:
+                    raise ValueError(f"thao tác #{position}: op phải là một trong {', '.join(self.BULK_OPS)}")
+                try:
+                    self._apply_operation(conn, operation, diff)
+                except ValueError as e:
+                    raise ValueError(f"thao tác #{position} ({op}): {e}")
+
+            changed = diff['created'] or diff['updated'] or diff['deleted'] or diff['reindexed']
+            if dry_run or not changed:
+                conn.execute("ROLLBACK")
+                diff['revision'] = int(self._get_meta(conn, 'revision', 0))
+            else:
+                diff['revision'] = self._bump_revision(conn)
+                conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+
+        if changed and not dry_run:
+            self._schedule_export()
+        return diff
+
+    def _apply_operation(self, conn, operation, diff):
+        op = operation['op']
+        if op == 'create':
+            question = operation.get('question')
+            if not isinstance(question, dict):
+                raise ValueError("cần 'question' là object")
+            question = dict(question)
+            if question.get('index') is None:
+                question.pop('index', None)
+                question = {'index': self._next_index(conn), **question}
+            conn.execute(self.INSERT_SQL, self._row_values(question))
+            self._record_change(conn, 'create', after=question)
+            diff['created'].append(question)
+
+        elif op == 'update':
+            fields = operation.get('set')
+            if not isinstance(fields, dict) or not fields:
+                raise ValueError("cần 'set' là object không rỗng")
+            for row_id, data in self._select_rows(conn, operation):
+                before = json.loads(data)
+                after = {**before, **fields}
+                if after != before:
+                    self._write_row(conn, row_id, after)
+                    self._record_change(conn, 'update', before, after)
+                    diff['updated'].append({'before': before, 'after': after})
+
+        elif op == 'delete':
+            rows = self._select_rows(conn, operation)
+            for row_id, data in rows:
+                diff['deleted'].append(json.loads(data))
+                self._record_change(conn, 'delete', before=json.loads(data))
+            conn.executemany("DELETE FROM questions WHERE id = ?", [(row[0],) for row in rows])
+
+        elif op == 'reindex':
+            start = operation.get('start', 1)
+            if not self._is_int(start):
+                raise ValueError("'start' phải là số nguyên")
+            rows = conn.execute("SELECT id, data FROM questions ORDER BY id").fetchall()
+            for offset, (row_id, data) in enumerate(rows):
+                question = json.loads(data)
+                new_index = start + offset
+                if question.get('index') != new_index:
+                    diff['reindexed'][str(row_id)] = {'before': question.get('index'), 'after': new_index}
+                    after = {**question, 'index': new_index}
+                    self._write_row(conn, row_id, after)
+                    self._record_change(conn, 'update', question, after)
+
+    # === EXPORT mapping.json ===
+    def _schedule_export(self):
+        """Gom các thay đổi liên tiếp thành một lần ghi mapping.json"""
+        with self._export_lock:
+            if self._export_timer is not None:
+                self._export_timer.cancel()
+            self._export_timer = threading.Timer(self.EXPORT_DELAY, self._export_quietly)
+            self._export_timer.daemon = True
+            self._export_timer.start()
+
+    def _export_quietly(self):
+        try:
+            self.export()
+        except Exception as e:
+            logger.error(f"Lỗi export {self.mapping_path}: {e}")
+
+    def export(self, force=False):
+        """
+        Ghi mapping.json từ store nếu có thay đổi chưa export (MappingWriter: temp file + rename, không bao giờ ghi dở)
+
+        Returns:
+            str: Đường dẫn mapping.json
+        """
+        with self._export_lock:
+            if self._export_timer is not None:
+                self._export_timer.cancel()
+                self._export_timer = None
+
+            conn = self._conn()
+            revision = int(self._get_meta(conn, 'revision', 0))
+            exported = int(self._get_meta(conn, 'exported_revision', 0))
+            if not force and exported >= revision and os.path.exists(self.mapping_path):
+                return self.mapping_path
+
+            # Ghi qua MappingWriter: khóa theo sách (không chen với run.py) + temp file + rename
+            with self.writer.locked():
+                current_signature = self._mapping_signature()
+                if current_signature is not None and current_signature != self._get_meta(conn, 'mapping_signature'):
+                    # run.py vừa ghi mapping.json / journal sau lần import gần nhất: replace() sẽ xóa
+                    # journal, nên import trước (như mọi đường đọc) rồi mới export, không ghi đè mất
+                    logger.info(f"{self.mapping_path} đổi từ bên ngoài trước khi export - import lại trước")
+                    self._sync_from_mapping(schedule_export=False)
+
+                # Snapshot nhất quán: đọc trong một transaction
+                conn.execute("BEGIN")
+                try:
+                    revision = int(self._get_meta(conn, 'revision', 0))
+                    rows = conn.execute("SELECT data FROM questions ORDER BY id").fetchall()
+                    exported_change = conn.execute("SELECT MAX(id) FROM pending_changes").fetchone()[0] or 0
+                finally:
+                    conn.execute("COMMIT")
+
+                questions = [json.loads(row[0]) for row in rows]
+                self.writer.replace(questions)
+                signature = self._mapping_signature()
+
+            with self._transaction() as conn:
+                self._set_meta(conn, 'mapping_signature', signature)
+                self._set_meta(conn, 'exported_revision', revision)
+                # Thay đổi đã nằm trong mapping.json, không cần áp lại nữa
+                conn.execute("DELETE FROM pending_changes WHERE id <= ?", (exported_change,))
+
+            logger.debug(f"Exported {len(questions)} câu hỏi (revision {revision}) → {self.mapping_path}")
+
+        # Cập nhật chỉ mục tìm kiếm theo mapping.json mới (lỗi index không ảnh hưởng việc lưu)
+        try:
+            get_search_index().index_book(self.book_dir, kinds=('question',))
+        except Exception as e:
+            logger.error(f"Lỗi cập nhật search index cho {self.book_dir}: {e}")
+
+        return self.mapping_path
+
+    # === EXPORT FILE TẢI XUỐNG ===
+    EXPORT_DIR = "exports"
+    EXPORT_FORMATS = ('json', 'ndjson')
+    EXPORT_COMPRESSIONS = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+    EXPORT_FETCH_ROWS = 1000
+
+    def _open_compressed(self, raw_file, compression):
+        """Bọc file ghi bằng gzip / zstd (zstd cần package zstandard)"""
+        if compression == 'gzip':
+            # mtime=0: cùng nội dung → cùng bytes, ETag/Range ổn định
+            return gzip.GzipFile(fileobj=raw_file, mode='wb', compresslevel=6, mtime=0)
+        if compression == 'zstd':
+            if zstandard is None:
+                raise ValueError("Nén zstd cần cài package zstandard (pip install zstandard)")
+            return zstandard.ZstdCompressor(level=3).stream_writer(raw_file, closefd=False)
+        return raw_file
+
+    def export_file(self, fmt='json', compression=None):
+        """
+        File export của revision hiện tại để tải xuống (hỗ trợ Range vì là file tĩnh trên disk).
+        Row được ghi thẳng từ cột data (không parse lại) theo từng lô EXPORT_FETCH_ROWS,
+        nên không bao giờ dựng toàn bộ sách thành một chuỗi trong bộ nhớ.
+
+        Args:
+            fmt (str): 'json' (mảng) hoặc 'ndjson' (mỗi dòng một câu hỏi)
+            compression (str): None, 'gzip' hoặc 'zstd'
+
+        Returns:
+            str: Đường dẫn file (mapping.json khi fmt='json' và không nén)
+        """
+        if fmt not in self.EXPORT_FORMATS:
+            raise ValueError(f"format phải là một trong {', '.join(self.EXPORT_FORMATS)}")
+        if compression not in self.EXPORT_COMPRESSIONS:
+            raise ValueError("compress phải là gzip hoặc zstd")
+
+        # Như mọi đường đọc: lấy trước các thay đổi run.py / sửa tay vừa ghi vào mapping.json
+        self._sync_from_mapping()
+        if fmt == 'json' and compression is None:
+            # mapping.json chính là bản export - phục vụ thẳng từ disk; thao tác run.py còn nằm
+            # trong journal thì ghi lại mapping.json để file tải xuống có đủ câu hỏi
+            return self.export(force=self.writer.has_pending())
+
+        export_dir = os.path.join(self.book_dir, self.EXPORT_DIR)
+        os.makedirs(export_dir, exist_ok=True)
+        suffix = f".{fmt}{self.EXPORT_COMPRESSIONS[compression]}"
+        revision = self.revision
+        path = os.path.join(export_dir, f"mapping.r{revision}{suffix}")
+        if os.path.exists(path):
+            return path
+
+        tmp_path = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            revision = int(self._get_meta(conn, 'revision', 0))
+            path = os.path.join(export_dir, f"mapping.r{revision}{suffix}")
+            cursor = conn.execute("SELECT data FROM questions ORDER BY id")
+            with open(tmp_path, 'wb') as raw_file:
+                out = self._open_compressed(raw_file, compression)
+                first = True
+                if fmt == 'json':
+                    out.write(b"[")
+                while True:
+                    rows = cursor.fetchmany(self.EXPORT_FETCH_ROWS)
+                    if not rows:
+                        break
+                    if fmt == 'json':
+                        chunk = "".join(("\n" if first and i == 0 else ",\n") + row[0] for i, row in enumerate(rows))
+                    else:
+                        chunk = "".join(row[0] + "\n" for row in rows)
+                    out.write(chunk.encode('utf-8'))
+                    first = False
+                if fmt == 'json':
+                    out.write(b"\n]\n")
+                if out is not raw_file:
+                    out.close()
+                raw_file.flush()
+                os.fsync(raw_file.fileno())
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            conn.execute("COMMIT")
+
+        os.replace(tmp_path, path)
+
+        # Bỏ các bản export cũ cùng định dạng
+        for name in os.listdir(export_dir):
+            if name.endswith(suffix) and name != os.path.basename(path):
+                try:
+                    os.remove(os.path.join(export_dir, name))
+                except OSError:
+                    pass
+        return path
+
+class _Transaction:
+    """Context manager BEGIN IMMEDIATE / COMMIT / ROLLBACK cho connection autocommit"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+# === REGISTRY ===
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_question_store(book_dir):
+    """
+    Lấy QuestionStore của một sách (mỗi sách một instance dùng chung trong process)
+
+    Args:
+        book_dir (str): Thư mục sách
+    """
+    key = os.path.abspath(book_dir)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = QuestionStore(book_dir)
+            _stores[key] = store
+        return store
+
+# === CACHE DANH SÁCH CÂU HỎI ===
+class CachedQuestions:
+    """Một phiên bản (revision) danh sách câu hỏi đã parse + các response body dựng sẵn"""
+
+    def __init__(self, revision, questions):
+        self.revision = revision
+        self.questions = questions  # Dùng chung giữa các request - không sửa trực tiếp
+        self.body = json.dumps(questions, ensure_ascii=False).encode('utf-8')
+        self.etag = hashlib.sha1(self.body).hexdigest()
+        self._raw = None
+        self._lock = threading.Lock()
+
+    def raw_body(self):
+        """
+        Body cho JSON editor ({'success', 'content'} - content giống hệt mapping.json),
+        chỉ dựng khi có request đầu tiên
+
+        Returns:
+            tuple: (bytes body, str etag)
+        """
+        with self._lock:
+            if self._raw is None:
+                content = json.dumps(self.questions, ensure_ascii=False, indent=2)
+                body = json.dumps({'success': True, 'content': content}, ensure_ascii=False).encode('utf-8')
+                self._raw = (body, hashlib.sha1(body).hexdigest())
+            return self._raw
+
+class QuestionListCache:
+    """
+    LRU cache danh sách câu hỏi đã parse theo sách, dùng chung cho mọi route câu hỏi / JSON editor.
+
+    Entry hợp lệ khi revision của store không đổi. Revision tăng sau mỗi lần ghi qua store
+    và khi mapping.json bị sửa từ bên ngoài (store so (mtime, size) rồi import lại),
+    nên mỗi lần lấy chỉ tốn một stat + một query meta thay vì đọc + parse toàn bộ sách.
+    """
+
+    MAX_BOOKS = 16
+
+    def __init__(self, max_books=MAX_BOOKS):
+        self.max_books = max_books
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, book_dir):
+        """
+        Lấy danh sách câu hỏi (cache) của sách
+
+        Args:
+            book_dir (str): Thư mục sách
+
+        Returns:
+            CachedQuestions
+        """
+        key = os.path.abspath(book_dir)
+        store = get_question_store(book_dir)
+        revision = store.revision
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.revision == revision:
+                self._entries.move_to_end(key)
+                return entry
+
+        revision, questions = store.snapshot()
+        entry = CachedQuestions(revision, questions)
+
+        with self._lock:
+            current = self._entries.get(key)
+            # Request song song có thể đã nạp bản mới hơn
+            if current is None or current.revision <= revision:
+                self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_books:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, book_dir=None):
+        """Xóa cache của một sách (hoặc toàn bộ)"""
+        with self._lock:
+            if book_dir is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(os.path.abspath(book_dir), None)
+
+question_cache = QuestionListCache()
+
+@atexit.register
+def _flush_stores():
+    """Ghi nốt mapping.json của các sách còn thay đổi chưa export khi tắt server"""
+    for store in list(_stores.values()):
+        try:
+            store.export()
+        except Exception as e:
+            logger.error(f"Lỗi export khi tắt: {e}")
@@ -0,0 +1,367 @@
+# modules/search_index.py
+import os
+import re
+import json
+import time
+import sqlite3
+import logging
+import threading
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+def fold_vietnamese(text):
+    """
+    Bỏ dấu tiếng Việt + chữ thường, giữ nguyên độ dài chuỗi (từng ký tự → một ký tự)
+    để vị trí khớp trên chuỗi đã bỏ dấu dùng được trên chuỗi gốc (NFC).
+
+    "Phép Cộng đúng" → "phep cong dung"
+    """
+    folded = []
+    for ch in text:
+        if ch in 'đĐ':
+            folded.append('d')
+            continue
+        base = ''.join(c for c in unicodedata.normalize('NFD', ch) if not unicodedata.combining(c))
+        base = base.lower() if base else ch
+        folded.append(base if len(base) == 1 else ch)
+    return ''.join(folded)
+
+class SearchIndex:
+    """
+    Chỉ mục full-text (SQLite FTS5) cho OCR text (text.txt của các folder image_XXXX)
+    và câu hỏi (mapping.json) của tất cả các sách.
+
+    - Mỗi file nguồn là một "source" với chữ ký (mtime_ns, size): chỉ file đổi mới được index lại.
+    - text.txt được tách theo từng crop ("FILE: crop_XXX_clsN.png"), mỗi crop / câu hỏi là một document.
+    - Text được bỏ dấu (fold_vietnamese) trước khi index, truy vấn cũng bỏ dấu → "phep cong" khớp "phép cộng".
+    """
+
+    DEFAULT_PATH = "search_index.db"
+    REFRESH_INTERVAL = 10.0  # giây - tối thiểu giữa hai lần quét thay đổi từ bên ngoài (run.py...)
+    OCR_FILENAME = "text.txt"
+    MAPPING_FILENAME = "mapping.json"
+    IMAGE_FOLDER_PREFIX = "image_"
+    SNIPPET_CHARS = 80
+    DEFAULT_LIMIT = 20
+    MAX_LIMIT = 100
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sources (
+            path TEXT PRIMARY KEY,
+            book TEXT NOT NULL,
+            signature TEXT
+        );
+        CREATE TABLE IF NOT EXISTS documents (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source TEXT NOT NULL,
+            book TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            folder TEXT,
+            ref TEXT,
+            text TEXT NOT NULL,
+            folded TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS ix_documents_source ON documents(source);
+        CREATE INDEX IF NOT EXISTS ix_sources_book ON sources(book);
+        CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+            folded,
+            content='documents', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        );
+        CREATE TRIGGER IF NOT EXISTS documents_fts_ai AFTER INSERT ON documents BEGIN
+            INSERT INTO documents_fts(rowid, folded) VALUES (new.id, new.folded);
+        END;
+        CREATE TRIGGER IF NOT EXISTS documents_fts_ad AFTER DELETE ON documents BEGIN
+            INSERT INTO documents_fts(documents_fts, rowid, folded) VALUES ('delete', old.id, old.folded);
+        END;
+    """
+
+    FILE_HEADER = re.compile(r"^={10,}\nFILE: (.+)\n={10,}\n", re.MULTILINE)
+
+    def __init__(self, db_path=DEFAULT_PATH):
+        """
+        Args:
+            db_path (str): File SQLite của chỉ mục
+        """
+        self.db_path = db_path
+        self._local = threading.local()
+        self._refresh_lock = threading.Lock()
+        self._last_refresh = 0.0
+        self._conn().executescript(self.SCHEMA)
+
+    def _conn(self):
+        """Mỗi thread một connection"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _book_key(book_dir):
+        return os.path.normpath(book_dir).replace('\\', '/')
+
+    @staticmethod
+    def _signature(path):
+        try:
+            stat = os.stat(path)
+            return f"{stat.st_mtime_ns}:{stat.st_size}"
+        except FileNotFoundError:
+            return None
+
+    # === TÁCH DOCUMENT TỪ FILE NGUỒN ===
+    def _parse_ocr_file(self, path):
+        """text.txt → [(ref=tên crop, text)] (bỏ qua các crop OCR lỗi)"""
+        with open(path, 'r', encoding='utf-8') as f:
+            content = f.read()
+
+        documents = []
+        headers = list(self.FILE_HEADER.finditer(content))
+        for i, header in enumerate(headers):
+            end = headers[i + 1].start() if i + 1 < len(headers) else len(content)
+            text = content[header.end():end].strip()
+            if text and not text.startswith("❌ ERROR:"):
+                documents.append((header.group(1).strip(), text))
+
+        # text.txt không theo format FILE: ... → cả file là một document
+        if not headers and content.strip():
+            documents.append((None, content.strip()))
+        return documents
+
+    @staticmethod
+    def _parse_mapping_file(path):
+        """mapping.json → [(ref=index câu hỏi, folder, text)]"""
+        with open(path, 'r', encoding='utf-8') as f:
+            questions = json.load(f)
+
+        documents = []
+        for question in questions if isinstance(questions, list) else []:
+            if not isinstance(question, dict):
+                continue
+            parts = [str(question.get(key) or '') for key in ('question', 'answer', 'subject', 'chapter', 'lesson')]
+            text = "\n".join(part for part in parts if part.strip())
+            if not text:
+                continue
+            folder = None
+            for key in ('image_question', 'image_answer'):
+                images = question.get(key) or []
+                if isinstance(images, list) and images and isinstance(images[0], str) and '/' in images[0]:
+                    folder = images[0].split('/')[0]
+                    break
+            index = question.get('index')
+            documents.append((None if index is None else str(index), folder, text))
+        return documents
+
+    # === CẬP NHẬT CHỈ MỤC ===
+    def _index_source(self, conn, path, book, kind, signature):
+        """Index lại một file nguồn (đã biết là đổi) trong transaction hiện tại"""
+        conn.execute("DELETE FROM documents WHERE source = ?", (path,))
+
+        rows = []
+        try:
+            if kind == 'ocr':
+                folder = os.path.basename(os.path.dirname(path))
+                rows = [(path, book, kind, folder, ref, text) for ref, text in self._parse_ocr_file(path)]
+            else:
+                rows = [(path, book, kind, folder, ref, text) for ref, folder, text in self._parse_mapping_file(path)]
+        except (OSError, ValueError) as e:
+            logger.warning(f"Không index được {path}: {e}")
+
+        # Lưu text dạng NFC để fold_vietnamese giữ đúng vị trí ký tự
+        rows = [row[:5] + (unicodedata.normalize('NFC', row[5]),) for row in rows]
+        conn.executemany(
+            "INSERT INTO documents(source, book, kind, folder, ref, text, folded) VALUES(?, ?, ?, ?, ?, ?, ?)",
+            [row + (fold_vietnamese(row[5]),) for row in rows]
+        )
+        conn.execute(
+            "INSERT INTO sources(path, book, signature) VALUES(?, ?, ?) "
+            "ON CONFLICT(path) DO UPDATE SET book = excluded.book, signature = excluded.signature",
+            (path, book, signature)
+        )
+        return len(rows)
+
+    def _book_sources(self, book_dir, kinds=('ocr', 'question')):
+        """[(path, kind)] các file nguồn hiện có của sách"""
+        sources = []
+        if 'question' in kinds:
+            sources.append((os.path.join(book_dir, self.MAPPING_FILENAME), 'question'))
+        if 'ocr' in kinds and os.path.isdir(book_dir):
+            for folder in sorted(os.listdir(book_dir)):
+                if folder.startswith(self.IMAGE_FOLDER_PREFIX):
+                    sources.append((os.path.join(book_dir, folder, self.OCR_FILENAME), 'ocr'))
+        return sources
+
+    def index_book(self, book_dir, kinds=('ocr', 'question')):
+        """
+        Cập nhật chỉ mục của một sách: chỉ các file có (mtime, size) đổi được đọc lại,
+        file đã bị xóa thì bỏ khỏi chỉ mục.
+
+        Args:
+            book_dir (str): Thư mục sách (ví dụ books_cropped/<book>)
+            kinds (tuple): 'ocr' (text.txt) và/hoặc 'question' (mapping.json)
+
+        Returns:
+            dict: {'sources_updated', 'documents'}
+        """
+        book = self._book_key(book_dir)
+        conn = self._conn()
+        known = {
+            path: signature for path, signature in conn.execute(
+                "SELECT path, signature FROM sources WHERE book = ?", (book,)
+            )
+        }
+
+        changed, present = [], set()
+        for path, kind in self._book_sources(book_dir, kinds):
+            path = path.replace('\\', '/')
+            signature = self._signature(path)
+            if signature is None:
+                continue
+            present.add(path)
+            if known.get(path) != signature:
+                changed.append((path, kind, signature))
+
+        removed = [
+            path for path in known
+            if path not in present and (
+                ('ocr' in kinds and path.endswith('/' + self.OCR_FILENAME)) or
+                ('question' in kinds and path.endswith('/' + self.MAPPING_FILENAME))
+            )
+        ]
+        if not changed and not removed:
+            return {'sources_updated': 0, 'documents': 0}
+
+        documents = 0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for path in removed:
+                conn.execute("DELETE FROM documents WHERE source = ?", (path,))
+                conn.execute("DELETE FROM sources WHERE path = ?", (path,))
+            for path, kind, signature in changed:
+                documents += self._index_source(conn, path, book, kind, signature)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        logger.info(f"Search index {book}: {len(changed)} file cập nhật, {len(removed)} file xóa, {documents} document")
+        return {'sources_updated': len(changed) + len(removed), 'documents': documents}
+
+    def refresh(self, book_dirs, force=False):
+        """
+        Quét thay đổi của nhiều sách (tối đa một lần mỗi REFRESH_INTERVAL giây trừ khi force),
+        bắt các file được ghi từ bên ngoài web app như run.py.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_refresh < self.REFRESH_INTERVAL:
+            return
+        if not self._refresh_lock.acquire(blocking=False):
+            return  # Thread khác đang quét
+        try:
+            for book_dir in book_dirs:
+                try:
+                    self.index_book(book_dir)
+                except Exception as e:
+                    logger.error(f"Lỗi index sách {book_dir}: {e}")
+
+            # Sách đã bị xóa khỏi danh sách
+            books = {self._book_key(book_dir) for book_dir in book_dirs}
+            conn = self._conn()
+            stale = [row[0] for row in conn.execute("SELECT DISTINCT book FROM sources") if row[0] not in books]
+            if stale:
+                conn.execute("BEGIN IMMEDIATE")
+                for book in stale:
+                    conn.execute("DELETE FROM documents WHERE book = ?", (book,))
+                    conn.execute("DELETE FROM sources WHERE book = ?", (book,))
+                conn.execute("COMMIT")
+            self._last_refresh = time.monotonic()
+        finally:
+            self._refresh_lock.release()
+
+    # === TÌM KIẾM ===
+    @staticmethod
+    def _query_terms(query):
+        folded = fold_vietnamese(unicodedata.normalize('NFC', query))
+        return [term for term in re.findall(r"\w+", folded) if term]
+
+    def _snippet(self, text, folded, terms):
+        """Đoạn trích quanh vị trí khớp đầu tiên + vị trí các từ khớp trong đoạn trích"""
+        positions = [folded.find(term) for term in terms]
+        positions = [p for p in positions if p >= 0]
+        center = min(positions) if positions else 0
+        start = max(center - self.SNIPPET_CHARS // 2, 0)
+        end = min(start + self.SNIPPET_CHARS, len(text))
+        snippet = text[start:end]
+
+        # Vị trí khớp tính trên chuỗi bỏ dấu, dùng được cho chuỗi gốc vì cùng độ dài
+        prefix = '…' if start > 0 else ''
+        matches = []
+        for term in terms:
+            for match in re.finditer(re.escape(term), folded[start:end]):
+                matches.append([len(prefix) + match.start(), len(prefix) + match.end()])
+        return {
+            'snippet': prefix + snippet + ('…' if end < len(text) else ''),
+            'matches': sorted(matches)
+        }
+
+    def search(self, query, book=None, kind=None, limit=None):
+        """
+        Tìm kiếm theo độ liên quan (BM25)
+
+        Args:
+            query (str): Từ khóa (có dấu hoặc không dấu), mỗi từ khớp tiền tố
+            book (str): Chỉ tìm trong một sách
+            kind (str): 'ocr' hoặc 'question'
+            limit (int): Số kết quả tối đa
+
+        Returns:
+            list: [{'book', 'kind', 'folder', 'ref', 'score', 'snippet', 'matches'}]
+        """
+        terms = self._query_terms(query or '')
+        if not terms:
+            return []
+
+        limit = min(max(int(limit or self.DEFAULT_LIMIT), 1), self.MAX_LIMIT)
+        match = " ".join(f'"{term}"*' for term in terms)
+        sql = (
+            "SELECT d.book, d.kind, d.folder, d.ref, d.text, d.folded, bm25(documents_fts) AS score "
+            "FROM documents_fts JOIN documents d ON d.id = documents_fts.rowid "
+            "WHERE documents_fts MATCH ?"
+        )
+        params = [match]
+        if book:
+            sql += " AND d.book = ?"
+            params.append(self._book_key(book))
+        if kind:
+            sql += " AND d.kind = ?"
+            params.append(kind)
+        sql += " ORDER BY score LIMIT ?"
+        params.append(limit)
+
+        hits = []
+        for book_key, doc_kind, folder, ref, text, folded, score in self._conn().execute(sql, params):
+            hit = {
+                'book': book_key,
+                'kind': doc_kind,
+                'folder': folder,
+                'ref': ref,
+                'score': round(-score, 4)
+            }
+            hit.update(self._snippet(text, folded, terms))
+            hits.append(hit)
+        return hits
+
+# === INSTANCE DÙNG CHUNG ===
+_index = None
+_index_lock = threading.Lock()
+
+def get_search_index(db_path=SearchIndex.DEFAULT_PATH):
+    """Chỉ mục tìm kiếm dùng chung trong process"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SearchIndex(db_path)
+        return _index
@@ -0,0 +1,231 @@
+# modules/status_store.py
+import os
+import json
+import atexit
+import time
+import copy
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class StatusStore:
+    """
+    Trạng thái xử lý của các job, dùng chung giữa request thread, worker và callback của processor.
+
+    - Mọi thao tác đi qua một lock; get()/snapshot() trả về bản sao nên caller không sửa nhầm dữ liệu
+      đang được thread khác cập nhật.
+    - Job đã kết thúc (completed/error/cancelled) bị xóa sau ttl giây; job không được cập nhật
+      trong stale_ttl giây cũng bị xóa. Số record tối đa là max_entries (xóa record cũ nhất).
+    - persist_path (tùy chọn): lưu ra file JSON (temp file + rename) khi job đổi trạng thái và tối đa
+      mỗi PERSIST_INTERVAL giây khi chỉ có tiến trình thay đổi, để trạng thái còn sau khi restart.
+      File không chứa BULKY_FIELDS (mỗi lần ghi không phải serialize kết quả chi tiết của mọi job);
+      tiến trình chưa lưu được ghi nốt khi tắt process (atexit).
+    - Mỗi record có số version tăng sau mỗi lần ghi; wait_for_change() chờ version mới
+      (dùng cho stream Server-Sent Events thay vì client poll).
+    """
+
+    FINISHED = ('completed', 'error', 'cancelled')
+    # Field lớn, không trả về trong danh sách rút gọn
+    BULKY_FIELDS = ('results',)
+    DEFAULT_TTL = 3600.0
+    DEFAULT_STALE_TTL = 24 * 3600.0
+    DEFAULT_MAX_ENTRIES = 500
+    EVICT_INTERVAL = 30.0
+    PERSIST_INTERVAL = 2.0
+
+    def __init__(self, ttl=DEFAULT_TTL, stale_ttl=DEFAULT_STALE_TTL, max_entries=DEFAULT_MAX_ENTRIES,
+                 persist_path=None):
+        """
+        Args:
+            ttl (float): Giây giữ lại trạng thái của job đã kết thúc
+            stale_ttl (float): Giây giữ lại trạng thái không còn được cập nhật
+            max_entries (int): Số record tối đa
+            persist_path (str): File JSON lưu trạng thái (None = chỉ giữ trong bộ nhớ)
+        """
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.persist_path = persist_path
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._records = {}
+        self._versions = {}
+        self._version_counter = 0
+        self._last_evict = 0.0
+        self._last_persist = 0.0
+        self._dirty = False
+
+        if persist_path:
+            self._load()
+            atexit.register(self.flush)
+
+    # === GHI ===
+    def set(self, status_id, record):
+        """Tạo mới / thay toàn bộ record của một job"""
+        with self._lock:
+            record = dict(record)
+            record['updated_at'] = time.time()
+            self._records[status_id] = record
+            self._bump_locked(status_id)
+            self._evict_locked(force=len(self._records) > self.max_entries)
+            self._changed_locked(transition=True)
+
+    def update(self, status_id, fields):
+        """
+        Cập nhật một phần record (bỏ qua nếu job không còn trong store)
+
+        Returns:
+            bool: True nếu job tồn tại
+        """
+        with self._lock:
+            record = self._records.get(status_id)
+            if record is None:
+                return False
+            transition = 'status' in fields and fields['status'] != record.get('status')
+            record.update(fields)
+            record['updated_at'] = time.time()
+            self._bump_locked(status_id)
+            self._changed_locked(transition)
+            return True
+
+    def delete(self, status_id):
+        with self._lock:
+            if self._records.pop(status_id, None) is not None:
+                self._bump_locked(status_id)
+                self._changed_locked(transition=True)
+
+    def _bump_locked(self, status_id):
+        """Tăng version của record và đánh thức các stream đang chờ"""
+        self._version_counter += 1
+        self._versions[status_id] = self._version_counter
+        self._changed.notify_all()
+
+    # === ĐỌC ===
+    def get(self, status_id):
+        """Bản sao record của job hoặc None"""
+        with self._lock:
+            self._evict_locked()
+            record = self._records.get(status_id)
+            return copy.deepcopy(record) if record is not None else None
+
+    def version(self, status_id):
+        """Version hiện tại của record (0 nếu chưa từng được ghi)"""
+        with self._lock:
+            return self._versions.get(status_id, 0)
+
+    def wait_for_change(self, status_id, since_version, timeout):
+        """
+        Chờ tới khi record được ghi sau since_version
+
+        Args:
+            status_id (str): ID job
+            since_version (int): Version caller đã có
+            timeout (float): Giây chờ tối đa
+
+        Returns:
+            tuple: (version, bản sao record hoặc None nếu đã bị xóa); version == since_version khi hết giờ
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self._versions.get(status_id, 0) != since_version, timeout)
+            record = self._records.get(status_id)
+            return self._versions.get(status_id, 0), copy.deepcopy(record) if record is not None else None
+
+    def __contains__(self, status_id):
+        with self._lock:
+            return status_id in self._records
+
+    def snapshot(self, compact=True):
+        """
+        Bản sao tất cả record
+
+        Args:
+            compact (bool): Bỏ các field lớn (kết quả chi tiết của từng bước)
+        """
+        with self._lock:
+            self._evict_locked()
+            if compact:
+                return {
+                    status_id: {key: value for key, value in record.items() if key not in self.BULKY_FIELDS}
+                    for status_id, record in self._records.items()
+                }
+            return copy.deepcopy(self._records)
+
+    # === DỌN DẸP ===
+    def _evict_locked(self, force=False):
+        now = time.time()
+        if not force and now - self._last_evict < self.EVICT_INTERVAL:
+            return
+        self._last_evict = now
+
+        expired = [
+            status_id for status_id, record in self._records.items()
+            if (record.get('status') in self.FINISHED and now - record['updated_at'] > self.ttl)
+            or now - record['updated_at'] > self.stale_ttl
+        ]
+        for status_id in expired:
+            del self._records[status_id]
+            self._versions.pop(status_id, None)
+
+        overflow = len(self._records) - self.max_entries
+        if overflow > 0:
+            # Xóa job đã kết thúc trước, rồi tới record lâu không cập nhật nhất
+            oldest = sorted(
+                self._records,
+                key=lambda status_id: (self._records[status_id].get('status') not in self.FINISHED,
+                                       self._records[status_id]['updated_at'])
+            )
+            for status_id in oldest[:overflow]:
+                del self._records[status_id]
+                self._versions.pop(status_id, None)
+            expired.extend(oldest[:overflow])
+
+        if expired:
+            logger.debug(f"Status store: xóa {len(expired)} trạng thái hết hạn")
+            self._changed_locked(transition=True)
+
+    # === LƯU FILE ===
+    def _changed_locked(self, transition):
+        if not self.persist_path:
+            return
+        self._dirty = True
+        if transition or time.time() - self._last_persist >= self.PERSIST_INTERVAL:
+            self._persist_locked()
+
+    def _persist_locked(self):
+        tmp_path = f"{self.persist_path}.tmp{os.getpid()}"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    status_id: {key: value for key, value in record.items() if key not in self.BULKY_FIELDS}
+                    for status_id, record in self._records.items()
+                }, f, ensure_ascii=False, default=str)
+            os.replace(tmp_path, self.persist_path)
+            self._dirty = False
+            self._last_persist = time.time()
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Không lưu được {self.persist_path}: {e}")
+
+    def flush(self):
+        """Ghi các thay đổi tiến trình còn chưa lưu"""
+        with self._lock:
+            if self.persist_path and self._dirty:
+                self._persist_locked()
+
+    def _load(self):
+        try:
+            with open(self.persist_path, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Không đọc được {self.persist_path}: {e}")
+            return
+
+        for status_id, record in records.items():
+            if record.get('status') == 'processing':
+                # Process trước đã dừng giữa chừng - JobScheduler sẽ đặt lại nếu job được chạy tiếp
+                record.update({'status': 'error', 'message': 'Bị gián đoạn do server dừng'})
+            record.setdefault('updated_at', time.time())
+            self._records[status_id] = record
+        self._evict_locked(force=True)
@@ -0,0 +1,176 @@
+# modules/thumbnail_service.py
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from PIL import Image, features
+
+logger = logging.getLogger(__name__)
+
+class ThumbnailService:
+    """
+    Thumbnail cho grid Gallery, tạo khi được yêu cầu lần đầu rồi lưu trong cache trên disk.
+
+    - Kích thước được làm tròn lên một trong SIZES (cạnh dài nhất) để số biến thể có hạn.
+    - WebP khi trình duyệt hỗ trợ (và Pillow có codec WebP), ngược lại JPEG.
+    - Tên file cache là hash của (đường dẫn ảnh gốc, mtime, size, kích thước, định dạng):
+      ảnh gốc đổi thì key đổi, thumbnail cũ không bao giờ bị trả nhầm.
+    - Tổng dung lượng cache giữ dưới max_bytes: mỗi lần dùng thumbnail được "touch" (mtime),
+      khi vượt ngân sách thì xóa file lâu không dùng nhất (LRU, giữ được qua restart).
+    """
+
+    SIZES = (160, 320, 640)
+    DEFAULT_SIZE = 320
+    DEFAULT_CACHE_DIR = "thumbnails_cache"
+    DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+    QUALITY = {'webp': 80, 'jpeg': 82}
+    MIMETYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Args:
+            cache_dir (str): Thư mục cache thumbnail
+            max_bytes (int): Ngân sách dung lượng của cache
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.webp_supported = features.check('webp')
+        self._lock = threading.Lock()
+        self._entries = None  # OrderedDict path -> size, cũ nhất ở đầu
+        self._total_bytes = 0
+
+    # === KÍCH THƯỚC / ĐỊNH DẠNG ===
+    @classmethod
+    def size_bucket(cls, size):
+        """Kích thước yêu cầu → bucket nhỏ nhất không nhỏ hơn nó"""
+        for bucket in cls.SIZES:
+            if size <= bucket:
+                return bucket
+        return cls.SIZES[-1]
+
+    def choose_format(self, accept_header):
+        """'webp' nếu header Accept của trình duyệt có image/webp, ngược lại 'jpeg'"""
+        if self.webp_supported and 'image/webp' in (accept_header or ''):
+            return 'webp'
+        return 'jpeg'
+
+    # === CACHE INDEX ===
+    def _load_entries(self):
+        """Quét cache dir một lần khi dùng lần đầu, sắp theo mtime (lần dùng gần nhất)"""
+        entries = []
+        if os.path.isdir(self.cache_dir):
+            for root, _, files in os.walk(self.cache_dir):
+                for name in files:
+                    path = os.path.join(root, name)
+                    if '.tmp' in name:
+                        # File tạm của lần ghi bị ngắt giữa chừng
+                        try:
+                            os.remove(path)
+                        except OSError:
+                            pass
+                        continue
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, path, stat.st_size))
+        entries.sort()
+        self._entries = OrderedDict((path, size) for _, path, size in entries)
+        self._total_bytes = sum(self._entries.values())
+
+    def _touch(self, path):
+        with self._lock:
+            if self._entries is None:
+                self._load_entries()
+            if path in self._entries:
+                self._entries.move_to_end(path)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _register(self, path, size):
+        """Thêm thumbnail mới vào index và xóa bớt file cũ nhất nếu vượt ngân sách"""
+        evicted = []
+        with self._lock:
+            if self._entries is None:
+                self._load_entries()
+            self._total_bytes -= self._entries.pop(path, 0)
+            self._entries[path] = size
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_path, old_size = self._entries.popitem(last=False)
+                self._total_bytes -= old_size
+                evicted.append(old_path)
+
+        for old_path in evicted:
+            try:
+                os.remove(old_path)
+            except FileNotFoundError:
+                pass
+        if evicted:
+            logger.debug(f"Thumbnail cache: xóa {len(evicted)} file cũ ({self._total_bytes} bytes còn lại)")
+
+    def stats(self):
+        """{'files', 'bytes', 'max_bytes'} của cache"""
+        with self._lock:
+            if self._entries is None:
+                self._load_entries()
+            return {'files': len(self._entries), 'bytes': self._total_bytes, 'max_bytes': self.max_bytes}
+
+    # === TẠO THUMBNAIL ===
+    def cache_key(self, source_path, size, fmt):
+        """Key của thumbnail - đổi khi ảnh gốc đổi (mtime/size)"""
+        stat = os.stat(source_path)
+        raw = f"{os.path.abspath(source_path)}|{stat.st_mtime_ns}|{stat.st_size}|{size}|{fmt}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, source_path, size=DEFAULT_SIZE, fmt='jpeg'):
+        """
+        Lấy (tạo nếu chưa có) thumbnail của một ảnh
+
+        Args:
+            source_path (str): Đường dẫn ảnh gốc
+            size (int): Cạnh dài nhất mong muốn (được làm tròn theo SIZES)
+            fmt (str): 'webp' hoặc 'jpeg'
+
+        Returns:
+            tuple: (đường dẫn thumbnail, cache key)
+
+        Raises:
+            FileNotFoundError: Ảnh gốc không tồn tại
+        """
+        size = self.size_bucket(size)
+        key = self.cache_key(source_path, size, fmt)
+        path = os.path.join(self.cache_dir, key[:2], f"{key}.{'webp' if fmt == 'webp' else 'jpg'}")
+
+        if os.path.exists(path):
+            self._touch(path)
+            return path, key
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+        with Image.open(source_path) as image:
+            image.draft('RGB', (size, size))  # JPEG: giải mã thẳng ở độ phân giải thấp
+            image = image.convert('RGB')
+            image.thumbnail((size, size), Image.LANCZOS)
+            image.save(tmp_path, format=fmt.upper(), quality=self.QUALITY[fmt], optimize=fmt == 'jpeg')
+        # Hai request cùng tạo một thumbnail: rename là atomic, ai xong sau thì ghi đè bản giống hệt
+        os.replace(tmp_path, path)
+
+        self._register(path, os.path.getsize(path))
+        return path, key
+
+# === INSTANCE DÙNG CHUNG ===
+_service = None
+_service_lock = threading.Lock()
+
+def get_thumbnail_service(cache_dir=ThumbnailService.DEFAULT_CACHE_DIR, max_bytes=ThumbnailService.DEFAULT_MAX_BYTES):
+    """Thumbnail service dùng chung trong process"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = ThumbnailService(cache_dir, max_bytes)
+        return _service
@@ -1,21 +1,34 @@
 # modules/yolo_processor.py
 import os
 import cv2
+import fitz  # PyMuPDF
 import numpy as np
 import logging
 import traceback
 import time
 from pathlib import Path
-from doclayout_yolo import YOLOv10
-from huggingface_hub import hf_hub_download
 import multiprocessing as mp
 from functools import partial
+from config import Config
+from modules_auto_mapping.engine import ProcessingEngine, CropStage
+from modules_auto_mapping.utils import GeometryUtils
+from .pdf_processor import render_clip, load_render_info
 
 class YOLOProcessor:
-    def __init__(self, debug_mode=False):
+    """
+    Bước YOLO của web pipeline: detect theo batch, lưu ảnh detection, crop bằng multiprocessing.
+    
+    Detect (ngưỡng, lọc class, gộp box trùng) và crop (tên crop_NNN_clsN.png, crops.json) dùng chung
+    ProcessingEngine với run.py nên hai đường xử lý cho cùng kết quả.
+    """
+    
+    def __init__(self, debug_mode=False, config=None, engine=None):
         self.model = None
         self.model_loaded = False
         self.debug_mode = debug_mode
+        self.config = config or Config()
+        self.engine = engine or ProcessingEngine(self.config)
+        self.backend = self.engine.detector.backend
         
         # Thiết lập logging cho YOLO
         self.logger = logging.getLogger('YOLOProcessor')
@@ -60,17 +73,9 @@ class YOLOProcessor:
                 })
             
             model_start_time = time.time()
-            self._debug_log("Downloading model từ HuggingFace...")
-            
-            filepath = hf_hub_download(
-                repo_id="juliozhao/DocLayout-YOLO-DocStructBench",
-                filename="doclayout_yolo_docstructbench_imgsz1024.pt"
-            )
-            
-            self._debug_log(f"Model downloaded to: {filepath}")
-            self._debug_log("Khởi tạo YOLOv10 model...")
+            self._debug_log(f"Tải model với backend: {self.backend.backend} (device={self.backend.device})")
             
-            self.model = YOLOv10(filepath)
+            self.model = self.engine.detector.load()
             self.model_loaded = True
             
             load_time = time.time() - model_start_time
@@ -88,9 +93,25 @@ class YOLOProcessor:
             error_msg = self._debug_exception(e, "load_model")
             return False, f"Lỗi khi tải model: {str(e)}"
     
-    def process_images(self, input_dir, output_base_dir, book_name, status_callback=None):
+    @staticmethod
+    def list_images(input_dir):
+        """Ảnh trang theo thứ tự số trang; folder của ảnh lấy theo số trang (CropStage.page_folder), không theo vị trí"""
+        return CropStage.sort_pages(Path(input_dir).glob("*.png"))
+    
+    def detection_signature(self):
+        """Model + thiết lập detect ảnh hưởng tới kết quả box (dùng làm một phần hash đầu vào)"""
+        return self.engine.detector.signature()
+    
+    def process_images(self, input_dir, output_base_dir, book_name, status_callback=None,
+                       image_indexes=None, known_boxes=None, page_callback=None):
         """
         Xử lý tất cả ảnh trong thư mục với YOLO (batch processing + multiprocessing crop) với debug support
+        
+        Args:
+            image_indexes (iterable): Chỉ xử lý các ảnh này (vị trí trong list_images), None = tất cả
+            known_boxes (dict): {index: boxes} đã detect ở lần chạy trước - chỉ crop lại, không predict
+            page_callback (function): page_callback(stage, index, data) sau khi từng ảnh xong
+                bước 'detect' (data: boxes, detection_image) và 'crop' (data: kết quả crop)
         """
         process_start_time = time.time()
         
@@ -123,12 +144,17 @@ class YOLOProcessor:
             self._debug_log(f"Detection dir: {detection_dir}")
             
             # Lấy danh sách ảnh
-            image_files = list(Path(input_dir).glob("*.png"))
+            all_images = self.list_images(input_dir)
+            known_boxes = known_boxes or {}
+            if image_indexes is None:
+                image_indexes = range(len(all_images))
+            image_indexes = sorted(index for index in set(image_indexes) if index < len(all_images))
+            image_files = [all_images[index] for index in image_indexes]
             total_images = len(image_files)
             
             self._debug_log(f"Tìm thấy {total_images} file .png")
             
-            if total_images == 0:
+            if not all_images:
                 self._debug_log("❌ Không tìm thấy file ảnh nào", level='error')
                 return False, "Không tìm thấy file ảnh nào trong thư mục", None
             
@@ -139,6 +165,15 @@ class YOLOProcessor:
                     'message': f'Tìm thấy {total_images} ảnh để xử lý'
                 })
             
+            # Chế độ two_pass: trang được render ở DPI thấp, vùng crop render lại từ PDF ở crop DPI
+            render_info = load_render_info(input_dir)
+            two_pass = bool(
+                render_info and render_info.get('render_mode') == 'two_pass'
+                and os.path.exists(render_info.get('pdf_path', ''))
+            )
+            if render_info and render_info.get('render_mode') == 'two_pass' and not two_pass:
+                self._debug_log("⚠️ Không tìm thấy PDF gốc, crop từ ảnh trang DPI thấp", level='warning')
+            
             # ===== BƯỚC 1: BATCH DETECTION =====
             batch_start_time = time.time()
             self._debug_log("=== BATCH DETECTION START ===")
@@ -149,20 +184,20 @@ class YOLOProcessor:
                     'message': f'Đang thực hiện batch detection cho {total_images} ảnh...'
                 })
             
-            # Predict tất cả ảnh một lần
-            self._debug_log(f"Chạy model.predict với source={input_dir}")
-            batch_results = self.model.predict(
-                source=str(input_dir), 
-                imgsz=1024, 
-                conf=0.3, 
-                device="cuda",
-                save=False,
-                verbose=False
-            )
+            # Predict theo batch trên bản decode ở độ phân giải detection (không resize lại trong predict);
+            # ảnh đã có box từ lần chạy trước thì bỏ qua
+            predict_positions = [pos for pos, index in enumerate(image_indexes) if index not in known_boxes]
+            batch_results, box_scales, decode_stats = [None] * total_images, [(1.0, 1.0)] * total_images, None
+            if predict_positions:
+                predicted, scales, decode_stats = self.engine.detector.predict([image_files[pos] for pos in predict_positions])
+                for pos, result, scale in zip(predict_positions, predicted, scales):
+                    batch_results[pos], box_scales[pos] = result, scale
             
             batch_time = time.time() - batch_start_time
             self._debug_log(f"✓ Batch detection hoàn thành trong {batch_time:.2f}s")
-            self._debug_log(f"Số kết quả nhận được: {len(batch_results)}")
+            self._debug_log(f"Số ảnh predict: {len(predict_positions)}/{total_images}")
+            if decode_stats:
+                self._debug_log(f"Detection decode: {decode_stats}")
             
             if status_callback:
                 status_callback({
@@ -174,39 +209,43 @@ class YOLOProcessor:
             self._debug_log("=== CREATING DETECTION IMAGES ===")
             
             detection_data = []
-            for i, (image_path, result) in enumerate(zip(sorted(image_files), batch_results)):
-                image_name = f"image_{i:04d}"
+            for i, image_path, result, scale in zip(image_indexes, image_files, batch_results, box_scales):
+                image_name = CropStage.page_folder(image_path, i)
                 
-                self._debug_log(f"Processing detection image {i+1}/{total_images}: {image_path.name}")
+                self._debug_log(f"Processing detection image {i+1}/{len(all_images)}: {image_path.name}")
                 
-                # Tạo ảnh annotated
-                detection_path = None
-                if result.boxes is not None and len(result.boxes) > 0:
-                    try:
-                        annotated_img = result.plot(pil=True, line_width=5, font_size=20)
-                        detection_path = detection_dir / f"{image_name}_detections.jpg"
-                        
-                        # Chuyển PIL sang OpenCV và lưu
-                        annotated_cv = cv2.cvtColor(np.array(annotated_img), cv2.COLOR_RGB2BGR)
-                        cv2.imwrite(str(detection_path), annotated_cv)
-                        
-                        self._debug_log(f"  Saved detection image: {detection_path.name}")
-                        self._debug_log(f"  Found {len(result.boxes)} boxes")
-                    except Exception as e:
-                        self._debug_log(f"  ❌ Lỗi tạo detection image: {e}", level='error')
-                        detection_path = None
+                if result is None:
+                    # Box từ lần chạy trước, ảnh detection đã được lưu khi đó
+                    boxes = known_boxes[i]['boxes']
+                    detection_path = known_boxes[i].get('detection_image')
+                    detection_path = Path(detection_path) if detection_path and os.path.exists(detection_path) else None
                 else:
-                    self._debug_log(f"  No boxes detected for {image_path.name}")
+                    boxes = self.engine.detector.boxes_from_result(result, scale)
+                    detection_path = self._save_detection_image(result, detection_dir / f"{image_name}_detections.jpg",
+                                                                 image_path, scale)
+                    if page_callback:
+                        page_callback('detect', i, {
+                            'boxes': boxes,
+                            'detection_image': str(detection_path) if detection_path else None
+                        })
                 
-                # Chuẩn bị data cho multiprocessing crop
-                detection_data.append({
+                # Chuẩn bị data cho multiprocessing crop (chỉ dữ liệu thuần để pickle nhẹ)
+                detection_item = {
                     'image_path': str(image_path),
                     'image_name': image_name,
                     'image_index': i,
-                    'result': result,
+                    'page_index': self._page_index(image_path, i),
+                    'boxes': boxes,
                     'cropped_dir': str(cropped_dir),
                     'detection_path': str(detection_path) if detection_path else None
-                })
+                }
+                if two_pass:
+                    detection_item.update({
+                        'pdf_path': render_info['pdf_path'],
+                        'source_dpi': render_info['dpi'],
+                        'crop_dpi': render_info['crop_dpi']
+                    })
+                detection_data.append(detection_item)
             
             detection_time = time.time() - detection_start_time
             self._debug_log(f"✓ Detection images tạo xong trong {detection_time:.2f}s")
@@ -221,8 +260,8 @@ class YOLOProcessor:
                     'message': 'Bắt đầu crop ảnh với multiprocessing...'
                 })
             
-            # Xác định số processes
-            num_processes = min(mp.cpu_count(), len(detection_data), 8)
+            # Xác định số processes theo CPU budget (chia core với YOLO và PDF render)
+            num_processes = max(1, min(self.backend.cpu_budget.crop_workers, len(detection_data)))
             self._debug_log(f"Sử dụng {num_processes} processes cho {len(detection_data)} ảnh")
             
             if status_callback:
@@ -241,12 +280,17 @@ class YOLOProcessor:
                     
                 self._debug_log(f"Crop progress: {completed_count}/{total_images}")
             
+            def crop_done(position, result):
+                if page_callback:
+                    page_callback('crop', detection_data[position]['image_index'], result)
+            
             # Thực hiện multiprocessing crop
             processed_results = self._multiprocess_crop_images(
                 detection_data, 
                 num_processes,
-                update_progress
-            )
+                update_progress,
+                crop_done
+            ) if detection_data else []
             
             crop_time = time.time() - crop_start_time
             self._debug_log(f"✓ Multiprocessing crop hoàn thành trong {crop_time:.2f}s")
@@ -276,6 +320,7 @@ class YOLOProcessor:
             
             return True, f"Đã xử lý {total_images} ảnh thành công", {
                 'total_images': total_images,
+                'skipped_images': len(all_images) - total_images,
                 'cropped_dir': str(cropped_dir),
                 'detection_dir': str(detection_dir),
                 'results': processed_results,
@@ -285,6 +330,8 @@ class YOLOProcessor:
                     'detection_images_time': detection_time,
                     'crop_time': crop_time
                 } if self.debug_mode else None,
+                'decode_stats': decode_stats,
+                'render_stats': self._render_stats(render_info, processed_results, two_pass),
                 'stats': {
                     'success_count': success_count,
                     'error_count': error_count,
@@ -296,100 +343,160 @@ class YOLOProcessor:
             error_msg = self._debug_exception(e, "process_images")
             return False, f"Lỗi khi xử lý YOLO: {str(e)}", None
     
-    def _multiprocess_crop_images(self, detection_data, num_processes, progress_callback=None):
-        """Xử lý crop ảnh với multiprocessing và debug support"""
+    # Màu box theo class (BGR) khi tự vẽ lên ảnh trang gốc
+    DETECTION_COLORS = [(56, 56, 255), (31, 112, 255), (29, 178, 255), (49, 210, 207),
+                        (10, 249, 72), (23, 204, 146), (134, 219, 61), (187, 212, 0)]
+    
+    def _save_detection_image(self, result, detection_path, image_path=None, scale=(1.0, 1.0)):
+        """
+        Lưu ảnh annotated của trang (xóa ảnh cũ nếu lần này không có box). Trả về path hoặc None
+        
+        Với DETECTION_DOWNSCALE, result.plot() chỉ vẽ được lên bản decode nhỏ (~YOLO_IMAGE_SIZE):
+        box được scale về tọa độ trang rồi vẽ lên ảnh trang gốc để ảnh Gallery giữ đúng độ phân giải.
+        """
+        if result.boxes is None or len(result.boxes) == 0:
+            self._debug_log(f"  No boxes detected for {detection_path.name}")
+            detection_path.unlink(missing_ok=True)
+            return None
+        
+        try:
+            page_image = cv2.imread(str(image_path)) if image_path and tuple(scale) != (1.0, 1.0) else None
+            if page_image is not None:
+                annotated_cv = self._draw_detections(page_image, result, scale)
+            else:
+                annotated_img = result.plot(pil=True, line_width=5, font_size=20)
+                # Chuyển PIL sang OpenCV
+                annotated_cv = cv2.cvtColor(np.array(annotated_img), cv2.COLOR_RGB2BGR)
+            cv2.imwrite(str(detection_path), annotated_cv)
+            
+            self._debug_log(f"  Saved detection image: {detection_path.name}")
+            self._debug_log(f"  Found {len(result.boxes)} boxes")
+            return detection_path
+        except Exception as e:
+            self._debug_log(f"  ❌ Lỗi tạo detection image: {e}", level='error')
+            return None
+    
+    def _draw_detections(self, image, result, scale):
+        """Vẽ mọi box của result (tọa độ bản decode detection) lên ảnh trang độ phân giải gốc"""
+        boxes = result.boxes
+        for i in range(len(boxes.cls)):
+            class_id = int(boxes.cls[i])
+            x1, y1, x2, y2 = (
+                int(round(v)) for v in GeometryUtils.scale_bbox([float(v) for v in boxes.xyxy[i]], *scale)
+            )
+            color = self.DETECTION_COLORS[class_id % len(self.DETECTION_COLORS)]
+            label = f"{result.names[class_id]} {float(boxes.conf[i]):.2f}"
+            cv2.rectangle(image, (x1, y1), (x2, y2), color, 5)
+            (text_w, text_h), baseline = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.8, 2)
+            label_y = max(y1, text_h + baseline + 4)
+            cv2.rectangle(image, (x1, label_y - text_h - baseline - 4), (x1 + text_w + 4, label_y), color, -1)
+            cv2.putText(image, label, (x1 + 2, label_y - baseline - 2), cv2.FONT_HERSHEY_SIMPLEX, 0.8,
+                        (255, 255, 255), 2, cv2.LINE_AA)
+        return image
+    
+    @staticmethod
+    def _page_index(image_path, fallback_index):
+        """Lấy số trang (0-based) từ tên file {pdf_name}_page_NNN.png"""
+        return CropStage.page_position(image_path, fallback_index)
+    
+    @staticmethod
+    def _render_stats(render_info, processed_results, two_pass):
+        """So sánh tổng pixel render (trang + vùng crop) với render cả trang ở crop DPI"""
+        if not render_info:
+            return None
+        
+        crop_pixels = sum(r.get('crop_pixels', 0) for r in processed_results if r)
+        page_pixels = render_info.get('pixels_rendered', 0)
+        total_pixels = page_pixels + (crop_pixels if two_pass else 0)
+        full_render_pixels = render_info.get('full_render_pixels', 0)
+        
+        return {
+            'render_mode': render_info.get('render_mode') if two_pass else 'full',
+            'page_dpi': render_info.get('dpi'),
+            'crop_dpi': render_info.get('crop_dpi'),
+            'page_pixels': page_pixels,
+            'crop_pixels': crop_pixels if two_pass else 0,
+            'total_pixels_rendered': total_pixels,
+            'full_render_pixels': full_render_pixels,
+            'pixel_savings': round(1 - total_pixels / full_render_pixels, 4) if full_render_pixels else 0.0,
+            'page_image_bytes': render_info.get('output_bytes', 0)
+        }
+    
+    @staticmethod
+    def _init_crop_worker():
+        """Mỗi worker crop chỉ dùng 1 thread OpenCV để không tranh core với YOLO/PDF"""
+        cv2.setNumThreads(1)
+    
+    def _multiprocess_crop_images(self, detection_data, num_processes, progress_callback=None, result_callback=None):
+        """Xử lý crop ảnh với multiprocessing và debug support (result_callback(vị trí, kết quả) cho từng ảnh)"""
         try:
             self._debug_log(f"Bắt đầu multiprocessing crop với {num_processes} processes")
             
-            # Tạo shared counter cho progress tracking
-            with mp.Manager() as manager:
-                completed_counter = manager.Value('i', 0)
-                
-                # Tạo partial function với shared counter
-                crop_func = partial(
-                    self._crop_single_image_worker,
-                    completed_counter=completed_counter,
-                    total_images=len(detection_data),
-                    progress_callback=progress_callback,
-                    debug_mode=self.debug_mode
-                )
-                
-                # Chạy multiprocessing
-                mp_start_time = time.time()
-                with mp.Pool(processes=num_processes) as pool:
-                    results = pool.map(crop_func, detection_data)
-                
-                mp_time = time.time() - mp_start_time
-                self._debug_log(f"✓ Multiprocessing pool hoàn thành trong {mp_time:.2f}s")
-                
-                return results
+            crop_func = partial(self._crop_single_image_worker, debug_mode=self.debug_mode)
+            results = [None] * len(detection_data)
+            
+            # Chạy multiprocessing, cập nhật progress ở process cha
+            mp_start_time = time.time()
+            with mp.Pool(processes=num_processes, initializer=self._init_crop_worker) as pool:
+                indexed_items = list(enumerate(detection_data))
+                for completed_count, (index, result) in enumerate(
+                        pool.imap_unordered(partial(self._indexed_crop, crop_func=crop_func), indexed_items), 1):
+                    results[index] = result
+                    if result_callback:
+                        result_callback(index, result)
+                    if progress_callback:
+                        progress_callback(completed_count)
+            
+            mp_time = time.time() - mp_start_time
+            self._debug_log(f"✓ Multiprocessing pool hoàn thành trong {mp_time:.2f}s")
+            
+            return results
                 
         except Exception as e:
             error_msg = self._debug_exception(e, "_multiprocess_crop_images")
             self._debug_log("❌ Multiprocessing failed, fallback to sequential processing", level='warning')
             # Fallback: xử lý tuần tự
-            return [self._crop_single_image_worker(data, debug_mode=self.debug_mode) for data in detection_data]
+            results = []
+            for completed_count, data in enumerate(detection_data, 1):
+                results.append(self._crop_single_image_worker(data, debug_mode=self.debug_mode))
+                if result_callback:
+                    result_callback(completed_count - 1, results[-1])
+                if progress_callback:
+                    progress_callback(completed_count)
+            return results
+    
+    @staticmethod
+    def _indexed_crop(indexed_item, crop_func):
+        """Giữ index của ảnh để sắp xếp lại kết quả từ imap_unordered"""
+        index, detection_item = indexed_item
+        return index, crop_func(detection_item)
     
     @staticmethod
-    def _crop_single_image_worker(detection_item, completed_counter=None, total_images=None, progress_callback=None, debug_mode=False):
+    def _crop_single_image_worker(detection_item, debug_mode=False):
         """Worker function cho multiprocessing crop với debug support - STATIC METHOD"""
         worker_start_time = time.time()
         
         try:
             image_path = detection_item['image_path']
+            pdf_path = detection_item.get('pdf_path')
             image_name = detection_item['image_name']
             image_index = detection_item['image_index']
-            result = detection_item['result']
+            boxes = detection_item['boxes']
             cropped_dir = Path(detection_item['cropped_dir'])
             detection_path = detection_item['detection_path']
             
             if debug_mode:
                 print(f"[Worker] Processing {image_name} (index {image_index})")
             
-            # Tạo thư mục con cho ảnh này
+            # Tạo thư mục con cho ảnh này; crop/OCR của lần xử lý trước (box cũ) bị xóa trong save_crops
             crop_subdir = cropped_dir / image_name
-            crop_subdir.mkdir(exist_ok=True)
-            
-            # Load ảnh bằng OpenCV
-            img_load_start = time.time()
-            original_img = cv2.imread(image_path)
-            if original_img is None:
-                if debug_mode:
-                    print(f"[Worker] ❌ Không thể load ảnh: {image_path}")
-                
-                # Cập nhật progress counter
-                if completed_counter is not None:
-                    with completed_counter.get_lock():
-                        completed_counter.value += 1
-                        if progress_callback:
-                            progress_callback(completed_counter.value)
-                
-                return {
-                    'image_name': image_name,
-                    'status': 'error',
-                    'error': 'Không thể load ảnh'
-                }
-            
-            img_load_time = time.time() - img_load_start
-            
-            # Chuyển từ BGR sang RGB
-            original_img_rgb = cv2.cvtColor(original_img, cv2.COLOR_BGR2RGB)
-            img_h, img_w = original_img_rgb.shape[:2]
-            
-            if debug_mode:
-                print(f"[Worker] {image_name}: Loaded image {img_w}x{img_h} trong {img_load_time:.3f}s")
             
             # Kiểm tra có bbox không
-            if result.boxes is None or len(result.boxes) == 0:
+            if not boxes:
                 if debug_mode:
                     print(f"[Worker] {image_name}: No boxes detected")
                 
-                # Cập nhật progress counter
-                if completed_counter is not None:
-                    with completed_counter.get_lock():
-                        completed_counter.value += 1
-                        if progress_callback:
-                            progress_callback(completed_counter.value)
+                CropStage.save_crops(crop_subdir, [], None)
                 
                 return {
                     'image_name': image_name,
@@ -397,58 +504,72 @@ class YOLOProcessor:
                     'bbox_count': 0,
                     'cropped_folder': str(crop_subdir),
                     'detection_image': detection_path,
+                    'crop_pixels': 0,
                     'processing_time': time.time() - worker_start_time if debug_mode else None
                 }
             
-            # Xử lý tất cả bbox
-            bbox_count = 0
-            bbox_results = []
+            # Nguồn crop: render vùng từ PDF (two_pass) hoặc cắt từ ảnh trang đã render
+            img_load_start = time.time()
+            pdf_doc = None
+            if pdf_path:
+                pdf_doc = fitz.open(pdf_path)
+                pdf_page = pdf_doc[detection_item['page_index']]
+                points_per_pixel = 72 / detection_item['source_dpi']
+                crop_scale = detection_item['crop_dpi'] / detection_item['source_dpi']
+                img_w = pdf_page.rect.width / points_per_pixel
+                img_h = pdf_page.rect.height / points_per_pixel
+                
+                def cut(box):
+                    # Giữ tọa độ thực: 1px ở detection DPI tương ứng nhiều px ở crop DPI
+                    x1, y1, x2, y2 = box['bbox']
+                    x1, y1 = max(0.0, x1), max(0.0, y1)
+                    x2, y2 = min(img_w, x2), min(img_h, y2)
+                    if not (x2 > x1 and y2 > y1):
+                        return None
+                    cropped = render_clip(
+                        pdf_page,
+                        [x1 * points_per_pixel, y1 * points_per_pixel, x2 * points_per_pixel, y2 * points_per_pixel],
+                        detection_item['crop_dpi']
+                    )
+                    # bbox theo pixel ở crop DPI (tương đương ảnh trang render full)
+                    return cropped, [int(x1 * crop_scale), int(y1 * crop_scale), int(x2 * crop_scale), int(y2 * crop_scale)]
+                
+                page_size = [int(img_w * crop_scale), int(img_h * crop_scale)]
+            else:
+                original_img = cv2.imread(image_path)
+                if original_img is None:
+                    if debug_mode:
+                        print(f"[Worker] ❌ Không thể load ảnh: {image_path}")
+                    
+                    return {
+                        'image_name': image_name,
+                        'status': 'error',
+                        'error': 'Không thể load ảnh'
+                    }
+                
+                # Chuyển từ BGR sang RGB
+                original_img_rgb = cv2.cvtColor(original_img, cv2.COLOR_BGR2RGB)
+                img_h, img_w = original_img_rgb.shape[:2]
+                cut = CropStage.image_cutter(original_img_rgb)
+                page_size = [img_w, img_h]
+            
+            img_load_time = time.time() - img_load_start
             
-            crop_start_time = time.time()
+            if debug_mode:
+                source = f"PDF page {detection_item['page_index'] + 1}" if pdf_path else "image"
+                print(f"[Worker] {image_name}: Loaded {source} {img_w:.0f}x{img_h:.0f} trong {img_load_time:.3f}s")
             
-            for i, box in enumerate(result.boxes):
-                try:
-                    x1, y1, x2, y2 = box.xyxy[0].tolist()
-                    
-                    # Đảm bảo tọa độ trong phạm vi ảnh
-                    x1 = max(0, int(x1))
-                    y1 = max(0, int(y1))
-                    x2 = min(img_w, int(x2))
-                    y2 = min(img_h, int(y2))
-                    
-                    # Kiểm tra bbox hợp lệ
-                    if x2 > x1 and y2 > y1:
-                        # Crop ảnh
-                        cropped = original_img_rgb[y1:y2, x1:x2]
-                        
-                        # Làm nét ảnh bằng kernel sharpen
-                        sharpen_kernel = np.array([[0, -1, 0],
-                                                   [-1, 5, -1],
-                                                   [0, -1, 0]])
-                        sharpened = cv2.filter2D(cropped, -1, sharpen_kernel)
-                        
-                        # Tạo tên file crop
-                        crop_filename = f"crop_{bbox_count:03d}_cls{int(box.cls[0])}.png"
-                        crop_path = crop_subdir / crop_filename
-                        
-                        # Chuyển về BGR trước khi lưu
-                        cv2.imwrite(str(crop_path), cv2.cvtColor(sharpened, cv2.COLOR_RGB2BGR))
-                        
-                        bbox_results.append({
-                            'bbox_index': i,
-                            'class_id': int(box.cls[0]),
-                            'confidence': float(box.conf[0]),
-                            'bbox': [x1, y1, x2, y2],
-                            'crop_path': str(crop_path),
-                            'crop_filename': crop_filename
-                        })
-                        
-                        bbox_count += 1
-                        
-                except Exception as e:
-                    if debug_mode:
-                        print(f"[Worker] ❌ Lỗi xử lý bbox {i} của {image_name}: {e}")
-                    continue
+            # Crop + làm nét tất cả bbox, ghi crops.json (cùng cách đặt tên với run.py)
+            crop_start_time = time.time()
+            try:
+                # Trang + khung pixel của bbox: OCR tìm lại box trong text layer của PDF
+                bbox_results, crop_pixels = CropStage.save_crops(
+                    crop_subdir, boxes, cut, {'page_index': detection_item['page_index'], 'page_size': page_size}
+                )
+            finally:
+                if pdf_doc is not None:
+                    pdf_doc.close()
+            bbox_count = len(bbox_results)
             
             crop_time = time.time() - crop_start_time
             worker_total_time = time.time() - worker_start_time
@@ -456,13 +577,6 @@ class YOLOProcessor:
             if debug_mode:
                 print(f"[Worker] ✓ {image_name}: {bbox_count} crops trong {crop_time:.3f}s (total: {worker_total_time:.3f}s)")
             
-            # Cập nhật progress counter
-            if completed_counter is not None:
-                with completed_counter.get_lock():
-                    completed_counter.value += 1
-                    if progress_callback:
-                        progress_callback(completed_counter.value)
-            
             return {
                 'image_name': image_name,
                 'status': 'success',
@@ -470,17 +584,11 @@ class YOLOProcessor:
                 'cropped_folder': str(crop_subdir),
                 'detection_image': detection_path,
                 'bbox_results': bbox_results,
+                'crop_pixels': crop_pixels,
                 'processing_time': worker_total_time if debug_mode else None
             }
             
         except Exception as e:
-            # Cập nhật progress counter ngay cả khi lỗi
-            if completed_counter is not None:
-                with completed_counter.get_lock():
-                    completed_counter.value += 1
-                    if progress_callback:
-                        progress_callback(completed_counter.value)
-            
             if debug_mode:
                 print(f"[Worker] ❌ Exception trong {detection_item.get('image_name', 'unknown')}: {e}")
             
@@ -488,4 +596,4 @@ class YOLOProcessor:
                 'image_name': detection_item.get('image_name', 'unknown'),
                 'status': 'error',
                 'error': str(e)
-            }
\ No newline at end of file
+            }
@@ -1,19 +1,30 @@
 # modules_auto_mapping/__init__.py - UPDATED WITH PDF PROCESSOR
+from .engine import ProcessingEngine, DetectionStage, CropStage, OCRStage
 from .detector import DocumentDetector
+from .inference_backend import InferenceBackend
 from .ocr_service import OCRService
 from .question_classifier import QuestionClassifier
 from .bbox_processor import BBoxProcessor
 from .mapping_generator import MappingGenerator
+from .mapping_writer import MappingWriter
 from .pdf_processor import PDFProcessor
+from .text_layer import TextLayerExtractor
 from .utils import ImageUtils, GeometryUtils
 
 __all__ = [
+    'ProcessingEngine',
+    'DetectionStage',
+    'CropStage',
+    'OCRStage',
     'DocumentDetector',
+    'InferenceBackend',
     'OCRService', 
     'QuestionClassifier',
     'BBoxProcessor',
     'MappingGenerator',
+    'MappingWriter',
     'PDFProcessor',
+    'TextLayerExtractor',
     'ImageUtils',
     'GeometryUtils'
 ]
\ No newline at end of file
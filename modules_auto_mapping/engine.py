@@ -0,0 +1,669 @@
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+import requests
+
+from .inference_backend import InferenceBackend
+from .text_layer import TextLayerExtractor
+from .utils import GeometryUtils, ImageUtils
+
+logger = logging.getLogger(__name__)
+
+class DetectionStage:
+    """YOLO layout detection: batched predict, target class filter and IoU de-duplication"""
+
+    name = "detect"
+
+    def __init__(self, config, backend: InferenceBackend = None):
+        """
+        Args:
+            config: Configuration object with YOLO / detection settings
+            backend: Inference backend (created from config when omitted)
+        """
+        self.config = config
+        self.backend = backend or InferenceBackend(config)
+        self.model = None
+        self.last_decode_stats = None
+        self._load_lock = threading.Lock()
+        self._predict_lock = threading.Lock()  # One model call at a time when books/jobs share the stage
+
+    def load(self):
+        """Load the YOLO model once"""
+        with self._load_lock:
+            if self.model is None:
+                logger.info(f"Loading YOLO model ({self.backend.backend} backend)...")
+                self.model = self.backend.load_model()
+        return self.model
+
+    def signature(self) -> Dict:
+        """Settings that change the detected boxes (part of checkpoint input hashes)"""
+        return {
+            "model": f"{self.config.YOLO_REPO_ID}/{self.config.YOLO_FILENAME}",
+            "backend": self.backend.backend,
+            "int8": getattr(self.config, "YOLO_INT8", False),
+            "imgsz": self.config.YOLO_IMAGE_SIZE,
+            "downscale": getattr(self.config, "DETECTION_DOWNSCALE", False),
+            "conf": self.config.CONFIDENCE_THRESHOLD,
+            "iou": self.config.IOU_THRESHOLD,
+            "target_classes": self.config.TARGET_CLASSES
+        }
+
+    def predict(self, image_paths: List) -> Tuple[List, List[Tuple[float, float]], Optional[Dict]]:
+        """
+        Run YOLO on pages in batches. With DETECTION_DOWNSCALE each page is decoded straight at
+        YOLO_IMAGE_SIZE and boxes are scaled back to full-resolution page coordinates.
+
+        Returns:
+            (YOLO Results per page, (scale_x, scale_y) per page, decode stats or None)
+        """
+        model = self.load()
+        predict_kwargs = {
+            "imgsz": self.config.YOLO_IMAGE_SIZE,
+            "conf": self.config.CONFIDENCE_THRESHOLD,
+            "device": self.backend.device,
+            "save": False,
+            "verbose": False
+        }
+
+        if not getattr(self.config, "DETECTION_DOWNSCALE", False):
+            with self._predict_lock:
+                results = model.predict(source=[str(p) for p in image_paths], **predict_kwargs)
+            return results, [(1.0, 1.0)] * len(image_paths), None
+
+        batch_size = max(1, getattr(self.config, "DETECTION_BATCH_SIZE", 16))
+        results, scales = [], []
+        decode_ms, full_pixels, detection_pixels = 0.0, 0, 0
+
+        for batch_start in range(0, len(image_paths), batch_size):
+            batch_images = []
+            for image_path in image_paths[batch_start:batch_start + batch_size]:
+                image, scale, stats = ImageUtils.load_for_detection(str(image_path), self.config.YOLO_IMAGE_SIZE)
+                batch_images.append(image)
+                scales.append(scale)
+                decode_ms += stats["total_ms"]
+                full_pixels += stats["full_size"][0] * stats["full_size"][1]
+                detection_pixels += stats["detection_size"][0] * stats["detection_size"][1]
+
+            with self._predict_lock:
+                results.extend(model.predict(source=batch_images, **predict_kwargs))
+
+        decode_stats = {
+            "pages": len(image_paths),
+            "avg_decode_ms": round(decode_ms / len(image_paths), 2) if image_paths else 0.0,
+            "full_pixels": full_pixels,
+            "detection_pixels": detection_pixels,
+            "pixel_reduction": round(1 - detection_pixels / full_pixels, 4) if full_pixels else 0.0
+        }
+        self.last_decode_stats = decode_stats
+        return results, scales, decode_stats
+
+    def extract_boxes(self, result, scale: Tuple[float, float] = (1.0, 1.0)) -> List[Dict]:
+        """Boxes of one YOLO result in full-resolution page coordinates, filtered by TARGET_CLASSES"""
+        if result.boxes is None or len(result.boxes) == 0:
+            return []
+
+        boxes = result.boxes
+        box_data = []
+        for i in range(len(boxes.cls)):
+            class_id = int(boxes.cls[i])
+            if self.config.TARGET_CLASSES is not None and class_id not in self.config.TARGET_CLASSES:
+                continue
+
+            box_data.append({
+                "id": len(box_data),
+                "label": result.names[class_id],
+                "cls": class_id,
+                "bbox": GeometryUtils.scale_bbox([float(v) for v in boxes.xyxy[i]], *scale),
+                "confidence": float(boxes.conf[i])
+            })
+        return box_data
+
+    def group_duplicates(self, boxes: List[Dict]) -> List[List[int]]:
+        """Group boxes whose IoU is at least IOU_THRESHOLD (lists of box indices)"""
+        visited = [False] * len(boxes)
+        groups = []
+
+        for i in range(len(boxes)):
+            if visited[i]:
+                continue
+            group = [i]
+            visited[i] = True
+            for j in range(i + 1, len(boxes)):
+                if not visited[j] and GeometryUtils.compute_iou(boxes[i]["bbox"], boxes[j]["bbox"]) >= self.config.IOU_THRESHOLD:
+                    group.append(j)
+                    visited[j] = True
+            groups.append(group)
+
+        return groups
+
+    def deduplicate(self, boxes: List[Dict]) -> List[Dict]:
+        """Keep the highest-confidence box of each duplicate group, ids renumbered in order"""
+        deduplicated = []
+        for group in self.group_duplicates(boxes):
+            best_box = max((boxes[i] for i in group), key=lambda b: b["confidence"])
+            best_box["id"] = len(deduplicated)
+            deduplicated.append(best_box)
+
+        if len(deduplicated) != len(boxes):
+            logger.debug(f"Deduplication: {len(boxes)} -> {len(deduplicated)} boxes")
+        return deduplicated
+
+    def boxes_from_result(self, result, scale: Tuple[float, float] = (1.0, 1.0)) -> List[Dict]:
+        """Final boxes of one YOLO result (filtered + de-duplicated)"""
+        return self.deduplicate(self.extract_boxes(result, scale))
+
+    def metadata(self, image_path: str, raw_count: int, final_count: int) -> Dict:
+        return {
+            "image_path": image_path,
+            "total_raw_boxes": raw_count,
+            "total_final_boxes": final_count,
+            "detection_params": {
+                "iou_threshold": self.config.IOU_THRESHOLD,
+                "conf_threshold": self.config.CONFIDENCE_THRESHOLD,
+                "target_classes": self.config.TARGET_CLASSES if self.config.TARGET_CLASSES else "all_classes"
+            }
+        }
+
+    def detect(self, image_path: str) -> Tuple[List[Dict], Dict]:
+        """
+        Detect one page
+
+        Returns:
+            Tuple of (de-duplicated boxes, detection metadata)
+        """
+        results, scales, _ = self.predict([image_path])
+        raw_boxes = self.extract_boxes(results[0], scales[0])
+        boxes = self.deduplicate([dict(box) for box in raw_boxes])
+        return boxes, self.metadata(image_path, len(raw_boxes), len(boxes))
+
+class CropStage:
+    """Cut one sharpened PNG per box into the page folder (image_XXXX) and index them in crops.json"""
+
+    name = "crop"
+    FOLDER_TEMPLATE = "image_{index:04d}"
+    FILENAME_TEMPLATE = "crop_{index:03d}_cls{cls}.png"
+    INDEX_FILENAME = "crops.json"
+    SHARPEN_KERNEL = np.array([[0, -1, 0],
+                               [-1, 5, -1],
+                               [0, -1, 0]])
+
+    def __init__(self, config=None):
+        self.config = config
+
+    def signature(self) -> Dict:
+        return {"naming": self.FILENAME_TEMPLATE, "sharpen": self.SHARPEN_KERNEL.tolist()}
+
+    @classmethod
+    def folder_name(cls, page_index: int) -> str:
+        """Folder of the 0-based page page_index (image_0000, ...)"""
+        return cls.FOLDER_TEMPLATE.format(index=page_index)
+
+    @staticmethod
+    def page_position(image_path, fallback_index: int) -> int:
+        """
+        0-based page of a rendered page image ({name}_page_NNN.png), fallback_index when the name
+        has no page number. Folders follow the page number, not the position in a listing, so a page
+        that failed to render does not shift the folders of the pages after it.
+        """
+        page_index = TextLayerExtractor.page_index_from_name(str(image_path))
+        return fallback_index if page_index is None else page_index
+
+    @classmethod
+    def page_folder(cls, image_path, fallback_index: int) -> str:
+        """Folder of a page image (folder_name of its page number)"""
+        return cls.folder_name(cls.page_position(image_path, fallback_index))
+
+    @classmethod
+    def sort_pages(cls, image_paths) -> List:
+        """Page images in page order (_page_1000 after _page_999 although names are padded to 3 digits)"""
+        return sorted(image_paths, key=lambda path: (cls.page_position(path, -1), str(path)))
+
+    @classmethod
+    def crop_filename(cls, index: int, class_id: int) -> str:
+        return cls.FILENAME_TEMPLATE.format(index=index, cls=class_id)
+
+    @classmethod
+    def clear_folder(cls, folder: Path, text_filename: str = "text.txt"):
+        """Remove crops / OCR text of a previous run (they belong to the old boxes)"""
+        for stale_path in list(folder.glob("crop_*.png")) + [folder / text_filename]:
+            stale_path.unlink(missing_ok=True)
+
+    @classmethod
+    def write_index(cls, folder: Path, crops: List[Dict]):
+        """Write crops.json of a folder (temp file + rename)"""
+        index = [
+            {key: crop[key] for key in ("crop_filename", "class_id", "confidence", "bbox", "page_index", "page_size")
+             if key in crop}
+            for crop in crops
+        ]
+        index_path = folder / cls.INDEX_FILENAME
+        tmp_path = index_path.with_name(f"{index_path.name}.tmp{os.getpid()}")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(tmp_path, index_path)
+
+    @classmethod
+    def save_crops(cls, folder, boxes: List[Dict], cut: Callable, page: Dict = None) -> Tuple[List[Dict], int]:
+        """
+        Save one crop per box, then write the folder's crops.json
+
+        Args:
+            folder: Page output folder (stale crops / text.txt are removed first)
+            boxes: Detected boxes
+            cut: cut(box) -> (RGB region, bbox in crop pixels) or None when the box is empty
+            page: {'page_index': 0-based PDF page, 'page_size': [w, h] of the pixel frame of the bboxes},
+                  stored with each crop so OCR can find the box in the PDF text layer
+
+        Returns:
+            (crop records, total crop pixels)
+        """
+        folder = Path(folder)
+        folder.mkdir(parents=True, exist_ok=True)
+        cls.clear_folder(folder)
+
+        crops, crop_pixels = [], 0
+        for i, box in enumerate(boxes):
+            try:
+                region = cut(box)
+                if region is None:
+                    continue
+                image, bbox = region
+
+                crop_filename = cls.crop_filename(len(crops), box["cls"])
+                crop_path = folder / crop_filename
+                sharpened = cv2.filter2D(image, -1, cls.SHARPEN_KERNEL)
+                cv2.imwrite(str(crop_path), cv2.cvtColor(sharpened, cv2.COLOR_RGB2BGR))
+
+                crop_pixels += image.shape[0] * image.shape[1]
+                crops.append({
+                    "bbox_index": i,
+                    "class_id": box["cls"],
+                    "confidence": box["confidence"],
+                    "bbox": bbox,
+                    "crop_path": str(crop_path),
+                    "crop_filename": crop_filename,
+                    **(page or {})
+                })
+            except Exception as e:
+                logger.warning(f"Failed to crop box {i} into {folder}: {e}")
+
+        cls.write_index(folder, crops)
+        return crops, crop_pixels
+
+    @staticmethod
+    def image_cutter(image_rgb: np.ndarray) -> Callable:
+        """cut() for save_crops that slices a decoded page image"""
+        img_h, img_w = image_rgb.shape[:2]
+
+        def cut(box):
+            x1, y1, x2, y2 = box["bbox"]
+            x1, y1 = max(0, int(x1)), max(0, int(y1))
+            x2, y2 = min(img_w, int(x2)), min(img_h, int(y2))
+            if not (x2 > x1 and y2 > y1):
+                return None
+            return image_rgb[y1:y2, x1:x2], [x1, y1, x2, y2]
+
+        return cut
+
+    def crop_page(self, image_path: str, boxes: List[Dict], folder) -> List[Dict]:
+        """
+        Crop every box of a page image into folder, setting crop_filename / crop_file on the boxes
+
+        Returns:
+            Crop records (same as save_crops)
+        """
+        image = cv2.imread(str(image_path))
+        if image is None:
+            raise ValueError(f"Cannot read image: {image_path}")
+
+        page = {
+            "page_index": TextLayerExtractor.page_index_from_name(str(image_path)),
+            "page_size": [image.shape[1], image.shape[0]]
+        }
+        crops, _ = self.save_crops(folder, boxes, self.image_cutter(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)), page)
+        for crop in crops:
+            boxes[crop["bbox_index"]].update({
+                "crop_filename": crop["crop_filename"],
+                "crop_file": crop["crop_path"]
+            })
+        return crops
+
+class OCRStage:
+    """
+    Vision API OCR of crops with one shared in-flight limit.
+
+    Requests go through a thread pool of max_in_flight workers (one keep-alive session per thread),
+    so every caller sharing this stage stays within the same API budget. When a source PDF is
+    given, boxes are read from its text layer first and only fall back to the API when needed.
+    """
+
+    name = "ocr"
+    TEXT_FILENAME = "text.txt"
+
+    def __init__(self, config, api_key: str = None, max_in_flight: int = None):
+        """
+        Args:
+            config: Configuration object with DeepSeek API / retry / text layer settings
+            api_key: API key (default: config.DEEPSEAK_API_KEY)
+            max_in_flight: API requests running at once (default: config.OCR_MAX_IN_FLIGHT)
+        """
+        self.config = config
+        self.model = config.DEEPSEAK_MODEL
+        self.api_key = api_key or config.DEEPSEAK_API_KEY
+        self.max_in_flight = max(1, max_in_flight or getattr(config, "OCR_MAX_IN_FLIGHT", 8))
+        self.text_layer = TextLayerExtractor(config) if getattr(config, "USE_PDF_TEXT_LAYER", False) else None
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._local = threading.local()
+
+    def signature(self):
+        """OCR model name, plus the text layer thresholds when enabled (part of checkpoint input hashes)"""
+        if not self.text_layer:
+            return self.model
+        return {
+            "model": self.model,
+            "text_layer": [self.text_layer.min_chars, self.text_layer.max_garbage_ratio,
+                           self.text_layer.max_image_coverage]
+        }
+
+    # === API ===
+    def executor(self) -> ThreadPoolExecutor:
+        """Shared thread pool - bounds the number of API requests in flight"""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="ocr")
+            return self._executor
+
+    def _session(self) -> requests.Session:
+        """One session per thread (keep-alive connection to the API)"""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            self._local.session = session
+        return session
+
+    def _make_api_call(self, image_base64_url: str) -> Optional[str]:
+        """Single DeepSeek Vision request, None on failure"""
+        payload = {
+            "model": self.model,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "image_url", "image_url": {"url": image_base64_url}},
+                        {"type": "text", "text": self.config.OCR_PROMPT}
+                    ]
+                }
+            ]
+        }
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+
+        try:
+            response = self._session().post(
+                self.config.DEEPSEAK_API_ENDPOINT,
+                headers=headers,
+                data=json.dumps(payload),
+                timeout=30
+            )
+            response.raise_for_status()
+
+            for choice in response.json().get("choices") or []:
+                content = (choice.get("message") or {}).get("content")
+                if content:
+                    return content.strip()
+            return None
+
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"API request failed: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Unexpected error in API call: {e}")
+            return None
+
+    def call_api(self, image_path: str) -> Optional[str]:
+        """OCR one image with MAX_RETRIES attempts, None if all failed"""
+        image_base64 = ImageUtils.image_to_base64(image_path)
+
+        for attempt in range(self.config.MAX_RETRIES):
+            result = self._make_api_call(image_base64)
+            if result:
+                return result
+            if attempt < self.config.MAX_RETRIES - 1:
+                logger.debug(f"OCR retry {attempt + 2}/{self.config.MAX_RETRIES} for {image_path} "
+                             f"in {self.config.RETRY_DELAY}s")
+                time.sleep(self.config.RETRY_DELAY)
+
+        logger.error(f"OCR failed after {self.config.MAX_RETRIES} attempts: {image_path}")
+        return None
+
+    def ocr_file(self, image_path: str) -> Dict:
+        """
+        OCR one crop file
+
+        Returns:
+            {'filename', 'success', 'text', 'error', 'latency_ms'}
+        """
+        result = {"filename": os.path.basename(image_path), "success": False, "text": "", "error": None}
+        start_time = time.time()
+
+        try:
+            text = self.call_api(image_path)
+            if text:
+                result.update({"success": True, "text": text})
+            else:
+                result["error"] = f"No response from the vision API after {self.config.MAX_RETRIES} attempts"
+        except Exception as e:
+            result["error"] = str(e)
+
+        result["latency_ms"] = int((time.time() - start_time) * 1000)
+        return result
+
+    def submit(self, image_path: str):
+        """Queue one crop on the shared pool (Future of ocr_file)"""
+        return self.executor().submit(self.ocr_file, image_path)
+
+    # === BOXES OF A PAGE ===
+    @staticmethod
+    def new_stats() -> Dict:
+        return {"text_layer_boxes": 0, "ocr_boxes": 0, "fallback_reasons": {}}
+
+    @staticmethod
+    def _count_fallback(stats: Dict, reason: str):
+        reasons = stats["fallback_reasons"]
+        reasons[reason] = reasons.get(reason, 0) + 1
+
+    def _text_from_pdf(self, pdf_path: Optional[str], image_path: str, box: Dict, stats: Dict) -> Optional[str]:
+        """Text of one box from the PDF text layer, records why it fell back to OCR otherwise"""
+        if not self.text_layer or not pdf_path:
+            return None
+
+        try:
+            text, reason = self.text_layer.extract_for_image(pdf_path, image_path, box["bbox"])
+        except Exception as e:
+            logger.warning(f"Text layer extraction failed for box {box['id']}: {e}")
+            text, reason = None, "error"
+
+        if text is None:
+            self._count_fallback(stats, reason)
+        return text
+
+    def crop_text(self, pdf_path: Optional[str], crop_info: Optional[Dict], stats: Dict) -> Optional[str]:
+        """
+        Text of one saved crop from the PDF text layer, using its crops.json entry
+        (page_index / page_size / bbox); None when the vision API is needed
+        """
+        if not self.text_layer or not pdf_path:
+            return None
+
+        crop_info = crop_info or {}
+        try:
+            text, reason = self.text_layer.extract_for_page(
+                pdf_path, crop_info.get("page_index"), crop_info.get("bbox"), crop_info.get("page_size")
+            )
+        except Exception as e:
+            logger.warning(f"Text layer extraction failed for {crop_info.get('crop_filename')}: {e}")
+            text, reason = None, "error"
+
+        if text is None:
+            self._count_fallback(stats, reason)
+        else:
+            stats["text_layer_boxes"] += 1
+        return text
+
+    def ocr_boxes(self, image_path: str, boxes: List[Dict], pdf_path: str = None,
+                  stats: Dict = None) -> List[Dict]:
+        """
+        Fill ocr_text / text_source of the OCR_CLASSES boxes of a page
+
+        Boxes already cropped by CropStage are sent as their crop_file, other boxes are cut into a
+        temp file. All API calls of the page run in parallel on the shared pool.
+
+        Args:
+            image_path: Page image
+            boxes: Detected boxes
+            pdf_path: Optional source PDF - its text layer is used before the vision API
+            stats: Counters updated in place (see new_stats)
+
+        Returns:
+            Copies of the boxes with ocr_text (None for non-OCR classes / failures)
+        """
+        stats = stats if stats is not None else self.new_stats()
+        updated_boxes = [dict(box, ocr_text=None) for box in boxes]
+        pending, temp_files = [], []
+
+        for box in updated_boxes:
+            if box["cls"] not in self.config.OCR_CLASSES:
+                continue
+
+            # Born-digital page: take the text straight from the PDF
+            pdf_text = self._text_from_pdf(pdf_path, image_path, box, stats)
+            if pdf_text:
+                box.update({"ocr_text": pdf_text, "text_source": "pdf_text_layer"})
+                stats["text_layer_boxes"] += 1
+                continue
+
+            try:
+                crop_file = box.get("crop_file")
+                if not crop_file or not os.path.exists(crop_file):
+                    fd, crop_file = tempfile.mkstemp(prefix="ocr_crop_", suffix=".png")
+                    os.close(fd)
+                    temp_files.append(crop_file)
+                    ImageUtils.crop_bbox(image_path, box["bbox"], crop_file)
+                pending.append((box, self.submit(crop_file)))
+            except Exception as e:
+                logger.error(f"Error preparing OCR box {box['id']}: {e}")
+
+        try:
+            for box, future in pending:
+                result = future.result()
+                box.update({
+                    "ocr_text": result["text"] if result["success"] else None,
+                    "text_source": "ocr",
+                    "ocr_latency_ms": result["latency_ms"]
+                })
+                stats["ocr_boxes"] += 1
+                logger.info(f"   Box {box['id']} (cls{box['cls']}): OCR {'success' if result['success'] else 'failed'}")
+        finally:
+            for _, future in pending:
+                future.cancel()
+            ImageUtils.cleanup_temp_files(temp_files)
+
+        return updated_boxes
+
+    # === text.txt ===
+    @staticmethod
+    def write_result(file_handle, result: Dict):
+        """One crop section of text.txt"""
+        file_handle.write("=" * 30 + "\n")
+        file_handle.write(f"FILE: {result['filename']}\n")
+        file_handle.write("=" * 30 + "\n\n")
+
+        if result["success"]:
+            file_handle.write(result["text"])
+        else:
+            file_handle.write("❌ ERROR:\n")
+            file_handle.write("-" * 30 + "\n")
+            file_handle.write(f"Lỗi: {result['error']}")
+        file_handle.write("\n\n")
+
+    def write_text(self, folder, results: List[Dict]) -> str:
+        """Write text.txt of a folder in one go (temp file + rename, never half-written)"""
+        output_file = os.path.join(folder, self.TEXT_FILENAME)
+        tmp_path = f"{output_file}.tmp{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for result in results:
+                self.write_result(f, result)
+        os.replace(tmp_path, output_file)
+        return output_file
+
+    def write_box_text(self, folder, boxes: List[Dict]) -> str:
+        """text.txt of a page from OCR'd boxes, ordered by class then crop filename"""
+        ocr_boxes = sorted(
+            (box for box in boxes if box["cls"] in self.config.OCR_CLASSES and box.get("crop_filename")),
+            key=lambda box: (box["cls"], box["crop_filename"])
+        )
+        return self.write_text(folder, [
+            {
+                "filename": box["crop_filename"],
+                "success": bool(box.get("ocr_text")),
+                "text": box.get("ocr_text") or "",
+                "error": None if box.get("ocr_text") else "OCR failed"
+            }
+            for box in ocr_boxes
+        ])
+
+class ProcessingEngine:
+    """
+    Detect → crop → OCR engine shared by the web pipeline (modules/) and run.py.
+
+    Each stage is an object with a ``name``, a ``signature()`` of the settings that change its
+    output and its work methods; pass a replacement stage to plug in another detector or OCR.
+    Both entry points use the same thresholds, crop naming (crop_000_cls0.png + crops.json)
+    and text.txt format, so a book looks the same whichever path produced it.
+    """
+
+    def __init__(self, config, detector: DetectionStage = None, cropper: CropStage = None,
+                 ocr: OCRStage = None):
+        self.config = config
+        self.detector = detector or DetectionStage(config)
+        self.cropper = cropper or CropStage(config)
+        self.ocr = ocr or OCRStage(config)
+
+    @property
+    def stages(self) -> Tuple:
+        return (self.detector, self.cropper, self.ocr)
+
+    def signature(self) -> Dict:
+        return {stage.name: stage.signature() for stage in self.stages}
+
+    def process_page(self, image_path: str, folder, pdf_path: str = None,
+                     ocr_stats: Dict = None) -> Tuple[List[Dict], Dict]:
+        """
+        Detect, crop and OCR one page into folder (crops, crops.json, text.txt)
+
+        Args:
+            image_path: Page image
+            folder: Page output folder (image_XXXX)
+            pdf_path: Optional source PDF (text layer reuse)
+            ocr_stats: Counters updated in place (see OCRStage.new_stats)
+
+        Returns:
+            Tuple of (boxes with crop_filename / crop_file / ocr_text, detection metadata)
+        """
+        boxes, metadata = self.detector.detect(image_path)
+        self.cropper.crop_page(image_path, boxes, folder)
+        boxes = self.ocr.ocr_boxes(image_path, boxes, pdf_path, ocr_stats)
+        self.ocr.write_box_text(folder, boxes)
+        return boxes, metadata
@@ -0,0 +1,248 @@
+import os
+import shutil
+import time
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional
+from doclayout_yolo import YOLOv10
+from huggingface_hub import hf_hub_download
+from .utils import GeometryUtils, DeviceUtils, CPUBudget
+
+logger = logging.getLogger(__name__)
+
+class InferenceBackend:
+    """Load DocLayout-YOLO for PyTorch, ONNX Runtime or OpenVINO inference"""
+
+    SUPPORTED_BACKENDS = ("pytorch", "onnx", "openvino")
+
+    def __init__(self, config):
+        """
+        Initialize backend from configuration
+
+        Args:
+            config: Configuration object with YOLO_BACKEND / YOLO_EXPORT_DIR / YOLO_INT8 settings
+        """
+        self.config = config
+        self.backend = str(getattr(config, "YOLO_BACKEND", "pytorch")).lower()
+        self.int8 = bool(getattr(config, "YOLO_INT8", False))
+        self.export_dir = getattr(config, "YOLO_EXPORT_DIR", "models")
+
+        if self.backend not in self.SUPPORTED_BACKENDS:
+            raise ValueError(
+                f"Unsupported YOLO_BACKEND '{self.backend}', expected one of {self.SUPPORTED_BACKENDS}"
+            )
+
+        # Exported backends always run on CPU; PyTorch falls back to CPU when CUDA is missing
+        if self.backend == "pytorch":
+            self.device = DeviceUtils.resolve_device(getattr(config, "YOLO_DEVICE", "auto"))
+        else:
+            self.device = "cpu"
+        self.cpu_budget = CPUBudget.from_config(config, self.device)
+        logger.info(f"Inference device: {self.device}, CPU budget: {self.cpu_budget.as_dict()}")
+
+    def download_weights(self) -> str:
+        """Download PyTorch weights from HuggingFace (cached by huggingface_hub)"""
+        return hf_hub_download(
+            repo_id=self.config.YOLO_REPO_ID,
+            filename=self.config.YOLO_FILENAME
+        )
+
+    def _exported_path(self, weights_path: str) -> Path:
+        """Target path of the exported model inside YOLO_EXPORT_DIR"""
+        stem = Path(weights_path).stem
+        suffix = "_int8" if self.int8 else ""
+        if self.backend == "onnx":
+            return Path(self.export_dir) / f"{stem}{suffix}.onnx"
+        return Path(self.export_dir) / f"{stem}{suffix}_openvino_model"
+
+    def export(self, weights_path: Optional[str] = None, force: bool = False) -> str:
+        """
+        Export PyTorch weights to the configured backend
+
+        Args:
+            weights_path: Optional path to .pt weights (downloaded if None)
+            force: Re-export even if an exported model already exists
+
+        Returns:
+            Path to exported model (.onnx file or OpenVINO model directory)
+        """
+        if self.backend == "pytorch":
+            raise ValueError("PyTorch backend does not need export")
+
+        if weights_path is None:
+            weights_path = self.download_weights()
+
+        target = self._exported_path(weights_path)
+        if target.exists() and not force:
+            logger.info(f"Using cached {self.backend} model: {target}")
+            return str(target)
+
+        os.makedirs(self.export_dir, exist_ok=True)
+        logger.info(f"Exporting {weights_path} to {self.backend} (int8={self.int8})...")
+        start_time = time.time()
+
+        model = YOLOv10(weights_path)
+
+        if self.backend == "onnx":
+            exported = model.export(format="onnx", imgsz=self.config.YOLO_IMAGE_SIZE, simplify=True)
+            if self.int8:
+                self._quantize_onnx(exported, str(target))
+                os.remove(exported)
+            else:
+                shutil.move(exported, target)
+        else:
+            calibration_data = getattr(self.config, "YOLO_INT8_CALIBRATION_DATA", None)
+            int8 = self.int8
+            if int8 and not calibration_data:
+                logger.warning("OpenVINO INT8 needs YOLO_INT8_CALIBRATION_DATA, exporting FP32 instead")
+                int8 = False
+
+            export_kwargs = {"format": "openvino", "imgsz": self.config.YOLO_IMAGE_SIZE}
+            if int8:
+                export_kwargs.update({"int8": True, "data": calibration_data})
+
+            exported = model.export(**export_kwargs)
+            if target.exists():
+                shutil.rmtree(target)
+            shutil.move(exported, target)
+
+        logger.info(f"Export completed in {time.time() - start_time:.2f}s: {target}")
+        return str(target)
+
+    @staticmethod
+    def _quantize_onnx(source_path: str, target_path: str):
+        """Dynamic INT8 quantization of an ONNX model (no calibration data needed)"""
+        try:
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+        except ImportError as e:
+            raise ImportError("INT8 export requires onnxruntime: pip install onnx onnxruntime") from e
+
+        quantize_dynamic(source_path, target_path, weight_type=QuantType.QUInt8)
+        logger.info(f"Quantized ONNX model saved to: {target_path}")
+
+    def load_model(self) -> YOLOv10:
+        """
+        Load model for the configured backend, exporting it on first use
+
+        Returns:
+            YOLOv10 model whose predict() returns the usual Results objects
+        """
+        weights_path = self.download_weights()
+
+        if self.device == "cpu":
+            self.cpu_budget.apply_torch_threads()
+
+        if self.backend == "pytorch":
+            return YOLOv10(weights_path)
+
+        model_path = self.export(weights_path)
+        return YOLOv10(model_path, task="detect")
+
+    @staticmethod
+    def match_boxes(reference: List[Dict], candidate: List[Dict], iou_threshold: float = 0.5) -> Dict:
+        """
+        Greedy one-to-one matching of two detect_boxes() outputs (same class, IoU >= threshold)
+
+        Args:
+            reference: Boxes from the reference backend
+            candidate: Boxes from the backend under test
+            iou_threshold: Minimum IoU for a match
+
+        Returns:
+            Dict with matched count, precision, recall and mean IoU of matches
+        """
+        pairs = []
+        for i, ref in enumerate(reference):
+            for j, cand in enumerate(candidate):
+                if ref["cls"] != cand["cls"]:
+                    continue
+                iou = GeometryUtils.compute_iou(ref["bbox"], cand["bbox"])
+                if iou >= iou_threshold:
+                    pairs.append((iou, i, j))
+
+        used_ref, used_cand, ious = set(), set(), []
+        for iou, i, j in sorted(pairs, reverse=True):
+            if i in used_ref or j in used_cand:
+                continue
+            used_ref.add(i)
+            used_cand.add(j)
+            ious.append(iou)
+
+        matched = len(ious)
+        return {
+            "matched": matched,
+            "reference_boxes": len(reference),
+            "candidate_boxes": len(candidate),
+            "precision": matched / len(candidate) if candidate else 1.0,
+            "recall": matched / len(reference) if reference else 1.0,
+            "mean_iou": sum(ious) / matched if matched else 0.0
+        }
+
+def compare_backends(config, image_paths: List[str], backends: List[str] = None) -> Dict:
+    """
+    Compare accuracy/latency of exported backends against the PyTorch CPU path
+
+    Args:
+        config: Base configuration (copied per backend)
+        image_paths: Page images to run detection on
+        backends: Backends to compare (default: onnx, openvino)
+
+    Returns:
+        Dict keyed by backend with latency stats and accuracy vs PyTorch CPU
+    """
+    from .detector import DocumentDetector
+
+    backends = backends or ["onnx", "openvino"]
+    runs = {}
+
+    for backend in ["pytorch"] + [b for b in backends if b != "pytorch"]:
+        backend_config = type(config)()
+        for key in dir(config):
+            if key.isupper():
+                setattr(backend_config, key, getattr(config, key))
+        backend_config.YOLO_BACKEND = backend
+        backend_config.YOLO_DEVICE = "cpu"
+
+        detector = DocumentDetector(backend_config)
+
+        # Warm-up run so one-time graph compilation is not counted
+        detector.detect_boxes(image_paths[0])
+
+        latencies, outputs = [], []
+        for image_path in image_paths:
+            start_time = time.perf_counter()
+            outputs.append(detector.detect_boxes(image_path))
+            latencies.append(time.perf_counter() - start_time)
+
+        runs[backend] = {"latencies": latencies, "outputs": outputs}
+
+    reference = runs["pytorch"]["outputs"]
+    report = {}
+
+    for backend, run in runs.items():
+        latencies = sorted(run["latencies"])
+        entry = {
+            "images": len(latencies),
+            "mean_latency_ms": round(1000 * sum(latencies) / len(latencies), 1),
+            "p95_latency_ms": round(1000 * latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))], 1),
+            "speedup_vs_pytorch_cpu": round(
+                sum(runs["pytorch"]["latencies"]) / sum(run["latencies"]), 2
+            ) if sum(run["latencies"]) > 0 else None
+        }
+
+        if backend != "pytorch":
+            matches = [InferenceBackend.match_boxes(ref, cand) for ref, cand in zip(reference, run["outputs"])]
+            total_ref = sum(m["reference_boxes"] for m in matches)
+            total_cand = sum(m["candidate_boxes"] for m in matches)
+            total_matched = sum(m["matched"] for m in matches)
+            entry["accuracy_vs_pytorch_cpu"] = {
+                "precision": round(total_matched / total_cand, 4) if total_cand else 1.0,
+                "recall": round(total_matched / total_ref, 4) if total_ref else 1.0,
+                "mean_iou": round(
+                    sum(m["mean_iou"] * m["matched"] for m in matches) / total_matched, 4
+                ) if total_matched else 0.0
+            }
+
+        report[backend] = entry
+
+    return report
@@ -1,7 +1,7 @@
 import os
-import json
 import logging
 from typing import List, Dict
+from .mapping_writer import MappingWriter
 
 logger = logging.getLogger(__name__)
 
@@ -214,9 +214,7 @@ class MappingGenerator:
                     logger.warning(f"Skipping failed result {i+1}")
             
             # Save mapping file
-            mapping_file_path = os.path.join(output_path, "mapping.json")
-            with open(mapping_file_path, 'w', encoding='utf-8') as f:
-                json.dump(all_questions, f, ensure_ascii=False, indent=2)
+            mapping_file_path = MappingWriter(output_path).replace(all_questions)
             
             logger.info(f"Generated mapping with {len(all_questions)} total questions")
             logger.info(f"Mapping saved to: {mapping_file_path}")
@@ -256,9 +254,7 @@ class MappingGenerator:
             questions = self.process_single_image_questions(result, book_name, 1)
             
             # Save mapping file
-            mapping_file_path = os.path.join(output_path, "mapping.json")
-            with open(mapping_file_path, 'w', encoding='utf-8') as f:
-                json.dump(questions, f, ensure_ascii=False, indent=2)
+            mapping_file_path = MappingWriter(output_path).replace(questions)
             
             logger.info(f"Generated mapping with {len(questions)} questions")
             logger.info(f"Mapping saved to: {mapping_file_path}")
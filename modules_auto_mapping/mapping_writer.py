@@ -0,0 +1,294 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+class MappingWriter:
+    """
+    Crash-safe writer for a book's mapping.json
+
+    - Appends go to an append-only journal (mapping.journal.jsonl), one fsynced JSON line per
+      operation, so a write costs O(change) instead of re-dumping the whole book.
+    - The journal is compacted into mapping.json (temp file + fsync + rename) every
+      COMPACT_EVERY operations and on flush(); mapping.json is never left half-written.
+    - A torn last journal line (crash mid-append) is ignored on replay.
+    - Before compaction a checkpoint line with the sha1 of the new mapping.json is journaled;
+      if a crash leaves both the new file and the old journal, replay skips what the file
+      already contains instead of appending it twice.
+    - Writers of the same book are serialized by a thread lock and an OS file lock
+      (mapping.json.lock), so run.py and the web app cannot interleave writes.
+    """
+
+    MAPPING_FILENAME = "mapping.json"
+    JOURNAL_FILENAME = "mapping.journal.jsonl"
+    LOCK_FILENAME = "mapping.json.lock"
+    COMPACT_EVERY = 50
+
+    def __init__(self, book_dir: str):
+        """
+        Initialize writer
+
+        Args:
+            book_dir: Book output directory (holds mapping.json)
+        """
+        self.book_dir = book_dir
+        self.mapping_path = os.path.join(book_dir, self.MAPPING_FILENAME)
+        self.journal_path = os.path.join(book_dir, self.JOURNAL_FILENAME)
+        self.lock_path = os.path.join(book_dir, self.LOCK_FILENAME)
+        self._lock_key = os.path.abspath(book_dir)
+        self._thread_lock = _book_lock(book_dir)
+        os.makedirs(book_dir, exist_ok=True)
+
+    @contextmanager
+    def locked(self):
+        """Hold the per-book thread + file lock (re-entrant within a thread)"""
+        with self._thread_lock:
+            held = _held_locks()
+            if self._lock_key in held:
+                yield
+                return
+
+            with open(self.lock_path, 'a+b') as lock_file:
+                _lock_file(lock_file)
+                held.add(self._lock_key)
+                try:
+                    yield
+                finally:
+                    held.discard(self._lock_key)
+                    _unlock_file(lock_file)
+
+    # === READ ===
+    def _read_base(self):
+        """(questions, sha1 of the file bytes) of mapping.json"""
+        try:
+            with open(self.mapping_path, 'rb') as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return [], None
+        questions = json.loads(raw.decode('utf-8'))
+        if not isinstance(questions, list):
+            raise ValueError(f"{self.mapping_path} is not a list of questions")
+        return questions, hashlib.sha1(raw).hexdigest()
+
+    def _read_journal(self) -> List[Dict]:
+        """Journal operations in order (a torn trailing line is dropped)"""
+        operations = []
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                lines = f.read().split('\n')
+        except FileNotFoundError:
+            return operations
+
+        for number, line in enumerate(lines):
+            if not line.strip():
+                continue
+            try:
+                operations.append(json.loads(line))
+            except ValueError:
+                if any(rest.strip() for rest in lines[number + 1:]):
+                    raise ValueError(f"Corrupt journal line {number + 1} in {self.journal_path}")
+                logger.warning(f"Ignoring torn last line of {self.journal_path}")
+        return operations
+
+    @staticmethod
+    def _apply(questions: List[Dict], operation: Dict) -> List[Dict]:
+        op = operation.get('op')
+        if op == 'append':
+            questions.extend(operation.get('questions', []))
+        elif op == 'replace':
+            questions = list(operation.get('questions', []))
+        elif op == 'checkpoint':
+            pass
+        else:
+            raise ValueError(f"Unknown journal operation: {op}")
+        return questions
+
+    def _read_unlocked(self) -> List[Dict]:
+        questions, base_hash = self._read_base()
+        operations = self._read_journal()
+
+        # mapping.json already holds everything up to a checkpoint with its hash
+        for position in range(len(operations) - 1, -1, -1):
+            operation = operations[position]
+            if operation.get('op') == 'checkpoint' and operation.get('sha1') == base_hash:
+                operations = operations[position + 1:]
+                break
+
+        for operation in operations:
+            questions = self._apply(questions, operation)
+        return questions
+
+    def read(self) -> List[Dict]:
+        """
+        Current questions: mapping.json with pending journal operations replayed
+
+        Returns:
+            List of question dicts
+        """
+        with self.locked():
+            return self._read_unlocked()
+
+    def has_pending(self) -> bool:
+        """True if the journal holds operations not yet compacted into mapping.json"""
+        try:
+            return os.path.getsize(self.journal_path) > 0
+        except FileNotFoundError:
+            return False
+
+    def signature(self) -> Optional[str]:
+        """(mtime, size) of mapping.json and the journal - changes whenever either is written"""
+        parts = []
+        for path in (self.mapping_path, self.journal_path):
+            try:
+                stat = os.stat(path)
+                parts.append(f"{stat.st_mtime_ns}:{stat.st_size}")
+            except FileNotFoundError:
+                parts.append("-")
+        return None if parts == ["-", "-"] else "|".join(parts)
+
+    # === WRITE ===
+    def _append_operation(self, operation: Dict):
+        self._drop_torn_tail()
+        line = json.dumps(operation, ensure_ascii=False) + '\n'
+        with open(self.journal_path, 'a', encoding='utf-8') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _drop_torn_tail(self):
+        """Cut a partial last line left by a crash so the next append starts on a clean line"""
+        try:
+            with open(self.journal_path, 'r+b') as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() == 0:
+                    return
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) == b'\n':
+                    return
+                f.seek(0)
+                data = f.read()
+                f.truncate(data.rfind(b'\n') + 1)
+        except FileNotFoundError:
+            pass
+
+    def _journal_length(self) -> int:
+        try:
+            with open(self.journal_path, 'rb') as f:
+                return sum(1 for line in f if line.strip())
+        except FileNotFoundError:
+            return 0
+
+    def append(self, questions: List[Dict]):
+        """
+        Append questions to the end of the book (O(len(questions)) disk write)
+
+        Args:
+            questions: Question dicts to append
+        """
+        if not questions:
+            return
+        with self.locked():
+            self._append_operation({'op': 'append', 'questions': questions})
+            if self._journal_length() >= self.COMPACT_EVERY:
+                self._compact_unlocked()
+
+    def reset(self):
+        """Start the book over (journaled, mapping.json is replaced on the next compaction)"""
+        with self.locked():
+            self._append_operation({'op': 'replace', 'questions': []})
+
+    def replace(self, questions: List[Dict]) -> str:
+        """
+        Replace the whole book and compact immediately
+
+        Args:
+            questions: Full question list
+
+        Returns:
+            Path to mapping.json
+        """
+        with self.locked():
+            self._write_mapping(questions)
+        return self.mapping_path
+
+    def flush(self) -> str:
+        """
+        Compact pending journal operations into mapping.json
+
+        Returns:
+            Path to mapping.json
+        """
+        with self.locked():
+            if self.has_pending() or not os.path.exists(self.mapping_path):
+                self._compact_unlocked()
+        return self.mapping_path
+
+    def _compact_unlocked(self):
+        questions = self._read_unlocked()
+        self._write_mapping(questions)
+        logger.debug(f"Compacted {self.journal_path} into {self.mapping_path} ({len(questions)} questions)")
+
+    def _write_mapping(self, questions: List[Dict]):
+        """
+        Write mapping.json atomically (temp file + fsync + rename) and clear the journal.
+        A checkpoint with the new file's hash is journaled first, so a crash between the
+        rename and the truncate does not replay operations the file already contains.
+        """
+        raw = json.dumps(questions, ensure_ascii=False, indent=2).encode('utf-8')
+        if self.has_pending():
+            self._append_operation({'op': 'checkpoint', 'sha1': hashlib.sha1(raw).hexdigest()})
+
+        tmp_path = f"{self.mapping_path}.tmp{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_path, 'wb') as f:
+            f.write(raw)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.mapping_path)
+
+        if self.has_pending():
+            with open(self.journal_path, 'w', encoding='utf-8') as f:
+                f.flush()
+                os.fsync(f.fileno())
+
+def _lock_file(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+    else:
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+
+def _unlock_file(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    else:
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+_book_locks: Dict[str, threading.RLock] = {}
+_book_locks_guard = threading.Lock()
+_thread_state = threading.local()
+
+def _held_locks() -> set:
+    """Books whose file lock the current thread already holds"""
+    if not hasattr(_thread_state, 'held'):
+        _thread_state.held = set()
+    return _thread_state.held
+
+def _book_lock(book_dir: str) -> threading.RLock:
+    """One re-entrant lock per book directory, shared by every writer in the process"""
+    key = os.path.abspath(book_dir)
+    with _book_locks_guard:
+        if key not in _book_locks:
+            _book_locks[key] = threading.RLock()
+        return _book_locks[key]
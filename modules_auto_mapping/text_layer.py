@@ -0,0 +1,185 @@
+import os
+import re
+import logging
+import threading
+import unicodedata
+from typing import List, Optional, Tuple
+import fitz  # PyMuPDF
+from .utils import ImageUtils
+
+logger = logging.getLogger(__name__)
+
+# Characters that show up when legacy Vietnamese fonts (TCVN3/VNI) have no Unicode mapping,
+# e.g. "Bµi" / "C©u" instead of "Bài" / "Câu"
+LEGACY_VIETNAMESE_CHARS = set("µ¸¶·¹©ª«¬®¤¦§¨")
+
+class TextLayerExtractor:
+    """Read box text from the PDF text layer so born-digital pages skip the vision API"""
+
+    def __init__(self, config):
+        """
+        Initialize extractor
+
+        Args:
+            config: Configuration object with TEXT_LAYER_* settings
+        """
+        self.config = config
+        self.min_chars = getattr(config, "TEXT_LAYER_MIN_CHARS", 2)
+        self.max_garbage_ratio = getattr(config, "TEXT_LAYER_MAX_GARBAGE_RATIO", 0.1)
+        self.max_image_coverage = getattr(config, "TEXT_LAYER_MAX_IMAGE_COVERAGE", 0.5)
+        self._local = threading.local()  # Open PDF per thread - books can be processed in parallel
+
+    @staticmethod
+    def page_index_from_name(image_path: str) -> Optional[int]:
+        """
+        Get 0-based page index from a rendered page name ({pdf_name}_page_NNN.png)
+
+        Args:
+            image_path: Path to rendered page image
+
+        Returns:
+            Page index or None if the name has no page number
+        """
+        match = re.search(r"_page_(\d+)$", os.path.splitext(os.path.basename(image_path))[0])
+        return int(match.group(1)) - 1 if match else None
+
+    def _open(self, pdf_path: str) -> fitz.Document:
+        """Open PDF once and reuse it for every box of the book (cached per calling thread)"""
+        if getattr(self._local, "doc_path", None) != pdf_path:
+            self.close()
+            self._local.doc = fitz.open(pdf_path)
+            self._local.doc_path = pdf_path
+        return self._local.doc
+
+    def close(self):
+        """Close the PDF document cached by the calling thread"""
+        doc = getattr(self._local, "doc", None)
+        if doc is not None:
+            doc.close()
+        self._local.doc = None
+        self._local.doc_path = None
+
+    def _garbage_ratio(self, text: str) -> float:
+        """Share of characters that indicate a broken font mapping"""
+        chars = [c for c in text if not c.isspace()]
+        if not chars:
+            return 1.0
+
+        garbage = 0
+        for c in chars:
+            category = unicodedata.category(c)
+            if c == "\ufffd" or category in ("Co", "Cc", "Cn") or c in LEGACY_VIETNAMESE_CHARS:
+                garbage += 1
+
+        # Text made mostly of symbols is usually a formula drawn with glyph fonts
+        alnum = sum(1 for c in chars if c.isalnum())
+        if alnum / len(chars) < 0.5:
+            return max(garbage / len(chars), 1 - alnum / len(chars))
+
+        return garbage / len(chars)
+
+    def _image_coverage(self, page: fitz.Page, rect: fitz.Rect) -> float:
+        """Largest share of the box covered by one embedded image (scanned page / picture text)"""
+        coverage = 0.0
+        for info in page.get_image_info():
+            overlap = fitz.Rect(info["bbox"]) & rect
+            if not overlap.is_empty:
+                coverage = max(coverage, overlap.get_area() / rect.get_area())
+        return coverage
+
+    @staticmethod
+    def _join_lines(lines: List[Tuple[fitz.Rect, str]]) -> str:
+        """Join text lines in reading order, merging fragments that sit on the same baseline"""
+        rows = []
+        for bbox, text in lines:
+            if rows and abs((bbox.y0 + bbox.y1) / 2 - rows[-1][0]) < bbox.height / 2:
+                rows[-1][1].append(text)
+            else:
+                rows.append([(bbox.y0 + bbox.y1) / 2, [text]])
+        return "\n".join(" ".join(part.strip() for part in row[1] if part.strip()) for row in rows).strip()
+
+    def extract_box_text(self, pdf_path: str, page_index: int, bbox: List[float],
+                         image_size: Tuple[int, int]) -> Tuple[Optional[str], str]:
+        """
+        Extract the text layer inside a detected box
+
+        Args:
+            pdf_path: Source PDF of the page
+            page_index: 0-based page index
+            bbox: [x1, y1, x2, y2] in page image pixels
+            image_size: (width, height) of the page image the bbox refers to
+
+        Returns:
+            (text, "ok") when the text layer is usable, otherwise (None, reason)
+            with reason in "no_text", "image_only", "garbled"
+        """
+        page = self._open(pdf_path)[page_index]
+
+        # Pixel bbox -> PDF points (page image was rendered from page.rect)
+        scale_x = page.rect.width / image_size[0]
+        scale_y = page.rect.height / image_size[1]
+        rect = fitz.Rect(
+            page.rect.x0 + bbox[0] * scale_x, page.rect.y0 + bbox[1] * scale_y,
+            page.rect.x0 + bbox[2] * scale_x, page.rect.y0 + bbox[3] * scale_y
+        ) & page.rect
+        if rect.is_empty:
+            return None, "no_text"
+
+        if self._image_coverage(page, rect) > self.max_image_coverage:
+            return None, "image_only"
+
+        lines = []
+        page_dict = page.get_text("dict", clip=rect, sort=True)
+        for block in page_dict["blocks"]:
+            if block.get("type") != 0:
+                continue
+            for line in block["lines"]:
+                # Keep spans whose center lies inside the box (clip alone keeps partially overlapping spans)
+                spans = [
+                    span["text"] for span in line["spans"]
+                    if fitz.Point((span["bbox"][0] + span["bbox"][2]) / 2,
+                                  (span["bbox"][1] + span["bbox"][3]) / 2) in rect
+                ]
+                if "".join(spans).strip():
+                    lines.append((fitz.Rect(line["bbox"]), "".join(spans)))
+
+        text = unicodedata.normalize("NFC", self._join_lines(lines))
+        if len(text.replace(" ", "").replace("\n", "")) < self.min_chars:
+            return None, "no_text"
+
+        if self._garbage_ratio(text) > self.max_garbage_ratio:
+            return None, "garbled"
+
+        return text, "ok"
+
+    def extract_for_image(self, pdf_path: str, image_path: str, bbox: List[float]) -> Tuple[Optional[str], str]:
+        """
+        Extract box text for a rendered page image (page index taken from the file name)
+
+        Args:
+            pdf_path: Source PDF
+            image_path: Rendered page image ({pdf_name}_page_NNN.png)
+            bbox: [x1, y1, x2, y2] in image pixels
+
+        Returns:
+            (text, "ok") or (None, reason) - reason "unknown_page" if the page cannot be resolved
+        """
+        page_index = self.page_index_from_name(image_path)
+        if page_index is None:
+            return None, "unknown_page"
+
+        return self.extract_for_page(pdf_path, page_index, bbox, ImageUtils.get_image_size(image_path))
+
+    def extract_for_page(self, pdf_path: str, page_index: Optional[int], bbox: List[float],
+                         image_size: Tuple[int, int]) -> Tuple[Optional[str], str]:
+        """
+        Extract box text when the page index and the pixel frame of the bbox are already known
+        (saved crops: page_index / page_size from crops.json)
+
+        Returns:
+            (text, "ok") or (None, reason) - reason "unknown_page" if the page is not in the PDF
+        """
+        if page_index is None or not bbox or not image_size or page_index >= len(self._open(pdf_path)):
+            return None, "unknown_page"
+
+        return self.extract_box_text(pdf_path, page_index, bbox, image_size)
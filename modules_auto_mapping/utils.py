@@ -2,7 +2,8 @@ import cv2
 import numpy as np
 import base64
 import os
-from typing import List, Tuple
+import time
+from typing import List, Tuple, Dict
 import logging
 
 # Setup logging
@@ -59,6 +60,78 @@ class ImageUtils:
             logger.error(f"Error cropping bbox {bbox}: {e}")
             raise
     
+    # cv2 reduced-decode flags - only JPEG is scaled inside the decoder (DCT scaling),
+    # for PNG OpenCV decodes full size and resizes anyway, so a plain decode is used
+    REDUCED_DECODE_EXTENSIONS = ('.jpg', '.jpeg')
+    REDUCED_DECODE_FLAGS = [
+        (8, cv2.IMREAD_REDUCED_COLOR_8),
+        (4, cv2.IMREAD_REDUCED_COLOR_4),
+        (2, cv2.IMREAD_REDUCED_COLOR_2)
+    ]
+    
+    @staticmethod
+    def get_image_size(image_path: str) -> Tuple[int, int]:
+        """
+        Read image (width, height) from file header without decoding pixels
+        
+        Args:
+            image_path: Path to image file
+            
+        Returns:
+            (width, height)
+        """
+        from PIL import Image
+        with Image.open(image_path) as img:
+            return img.size
+    
+    @staticmethod
+    def load_for_detection(image_path: str, target_size: int) -> Tuple[np.ndarray, Tuple[float, float], Dict]:
+        """
+        Decode a detection-resolution copy of an image (long side == target_size)
+        
+        JPEG pages use the largest cv2 IMREAD_REDUCED mode that still keeps the long side >= target_size,
+        then the image is resized the rest of the way so YOLO's letterbox does not resize again.
+        
+        Args:
+            image_path: Path to full-resolution image
+            target_size: Detection long side (YOLO imgsz)
+            
+        Returns:
+            (BGR image, (scale_x, scale_y) to map detection coords back to full resolution, decode stats)
+        """
+        start_time = time.perf_counter()
+        full_w, full_h = ImageUtils.get_image_size(image_path)
+        long_side = max(full_w, full_h)
+        
+        flag, factor = cv2.IMREAD_COLOR, 1
+        if image_path.lower().endswith(ImageUtils.REDUCED_DECODE_EXTENSIONS):
+            for reduce_factor, reduce_flag in ImageUtils.REDUCED_DECODE_FLAGS:
+                if long_side / reduce_factor >= target_size:
+                    flag, factor = reduce_flag, reduce_factor
+                    break
+        
+        image = cv2.imread(image_path, flag)
+        if image is None:
+            raise ValueError(f"Cannot read image: {image_path}")
+        decode_time = time.perf_counter() - start_time
+        
+        h, w = image.shape[:2]
+        if max(w, h) > target_size:
+            ratio = target_size / max(w, h)
+            # Same bilinear resize YOLO's letterbox applies, so detections match the path-based predict
+            image = cv2.resize(image, (max(1, round(w * ratio)), max(1, round(h * ratio))),
+                               interpolation=cv2.INTER_LINEAR)
+            h, w = image.shape[:2]
+        
+        stats = {
+            "full_size": [full_w, full_h],
+            "detection_size": [w, h],
+            "reduce_factor": factor,
+            "decode_ms": round(1000 * decode_time, 2),
+            "total_ms": round(1000 * (time.perf_counter() - start_time), 2)
+        }
+        return image, (full_w / w, full_h / h), stats
+    
     @staticmethod
     def image_to_base64(image_path: str) -> str:
         """
@@ -145,6 +218,21 @@ class GeometryUtils:
             logger.error(f"Error computing IoU: {e}")
             return 0
     
+    @staticmethod
+    def scale_bbox(bbox: List[float], scale_x: float, scale_y: float) -> List[float]:
+        """
+        Map bbox between resolutions (e.g. detection copy -> full-resolution page)
+        
+        Args:
+            bbox: [x1, y1, x2, y2]
+            scale_x: Horizontal scale factor
+            scale_y: Vertical scale factor
+            
+        Returns:
+            Scaled [x1, y1, x2, y2]
+        """
+        return [bbox[0] * scale_x, bbox[1] * scale_y, bbox[2] * scale_x, bbox[3] * scale_y]
+    
     @staticmethod
     def get_bbox_center(bbox: List[float]) -> Tuple[float, float]:
         """
@@ -185,4 +273,126 @@ class GeometryUtils:
                 
         except Exception as e:
             logger.error(f"Error sorting boxes: {e}")
-            return boxes
\ No newline at end of file
+            return boxes
+
+class DeviceUtils:
+    """Utility class for inference device selection"""
+    
+    @staticmethod
+    def available_cpus() -> int:
+        """
+        Number of CPU cores this process may run on (respects affinity / cgroup pinning)
+        
+        Returns:
+            Core count (at least 1)
+        """
+        try:
+            return max(1, len(os.sched_getaffinity(0)))
+        except AttributeError:
+            return max(1, os.cpu_count() or 1)
+    
+    @staticmethod
+    def resolve_device(requested: str = "auto") -> str:
+        """
+        Resolve configured device to one that actually exists on this machine
+        
+        Args:
+            requested: "auto", "cpu", "mps", "cuda" or "cuda:N"
+            
+        Returns:
+            Device string for model.predict (falls back to "cpu" when CUDA/MPS is missing)
+        """
+        requested = str(requested or "auto").lower()
+        
+        try:
+            import torch
+        except ImportError:
+            logger.warning("PyTorch not available, using CPU")
+            return "cpu"
+        
+        cuda_available = torch.cuda.is_available()
+        mps_available = bool(getattr(torch.backends, "mps", None)) and torch.backends.mps.is_available()
+        
+        if requested == "auto":
+            if cuda_available:
+                return "cuda:0"
+            if mps_available:
+                return "mps"
+            return "cpu"
+        
+        if requested.startswith("cuda"):
+            if not cuda_available:
+                logger.warning(f"Device '{requested}' requested but CUDA is not available, falling back to CPU")
+                return "cpu"
+            index = requested.split(":", 1)[1] if ":" in requested else "0"
+            if not index.isdigit() or int(index) >= torch.cuda.device_count():
+                logger.warning(f"CUDA device '{requested}' not found, using cuda:0")
+                return "cuda:0"
+            return f"cuda:{index}"
+        
+        if requested == "mps" and not mps_available:
+            logger.warning("Device 'mps' requested but not available, falling back to CPU")
+            return "cpu"
+        
+        return requested
+
+class CPUBudget:
+    """Divide CPU cores between YOLO inference, crop worker pool and PDF render processes"""
+    
+    DEFAULT_SHARES = {"yolo": 0.5, "crop": 0.25, "pdf": 0.25}
+    GPU_HOST_THREADS = 2  # Threads YOLO needs for pre/post-processing when running on GPU
+    
+    def __init__(self, device: str = "cpu", total_cpus: int = None, shares: dict = None):
+        """
+        Compute per-stage thread budget
+        
+        Args:
+            device: Resolved inference device
+            total_cpus: Cores available to the pipeline (None = all available)
+            shares: Fractions for 'yolo', 'crop', 'pdf' when YOLO runs on CPU
+        """
+        self.device = device
+        self.total_cpus = max(1, total_cpus or DeviceUtils.available_cpus())
+        shares = dict(self.DEFAULT_SHARES, **(shares or {}))
+        
+        if device == "cpu":
+            total_share = sum(shares.values()) or 1.0
+            self.yolo_threads = max(1, int(self.total_cpus * shares["yolo"] / total_share))
+        else:
+            # On GPU, inference needs few host threads; give the rest to crop/PDF workers
+            self.yolo_threads = min(self.GPU_HOST_THREADS, self.total_cpus)
+        
+        remaining = max(1, self.total_cpus - self.yolo_threads)
+        worker_share = (shares["crop"] + shares["pdf"]) or 1.0
+        self.crop_workers = max(1, int(remaining * shares["crop"] / worker_share))
+        self.pdf_workers = max(1, remaining - self.crop_workers) if remaining > 1 else 1
+    
+    @classmethod
+    def from_config(cls, config, device: str = None) -> "CPUBudget":
+        """Build budget from Config (CPU_THREADS / CPU_BUDGET_SHARES)"""
+        if device is None:
+            device = DeviceUtils.resolve_device(getattr(config, "YOLO_DEVICE", "auto"))
+        return cls(
+            device=device,
+            total_cpus=getattr(config, "CPU_THREADS", None),
+            shares=getattr(config, "CPU_BUDGET_SHARES", None)
+        )
+    
+    def apply_torch_threads(self):
+        """Limit PyTorch intra-op threads to the YOLO share (process-wide setting)"""
+        try:
+            import torch
+            torch.set_num_threads(self.yolo_threads)
+            logger.info(f"torch intra-op threads set to {self.yolo_threads}")
+        except ImportError:
+            pass
+    
+    def as_dict(self) -> dict:
+        """Budget summary for logs / status"""
+        return {
+            "device": self.device,
+            "total_cpus": self.total_cpus,
+            "yolo_threads": self.yolo_threads,
+            "crop_workers": self.crop_workers,
+            "pdf_workers": self.pdf_workers
+        }
@@ -5,6 +5,7 @@ from datetime import datetime
 from typing import Dict, List, Optional
 from config import Config
 from modules_auto_mapping import (
+    ProcessingEngine,
     DocumentDetector,
     OCRService,
     BBoxProcessor,
@@ -37,21 +38,23 @@ class DocumentProcessingPipeline:
             for key, value in config_override.items():
                 setattr(self.config, key, value)
         
-        # Initialize components
-        self.detector = DocumentDetector(self.config)
-        self.ocr_service = OCRService(self.config)
+        # Initialize components - detection / crop / OCR stages come from the engine shared with the web app
+        self.engine = ProcessingEngine(self.config)
+        self.detector = DocumentDetector(self.config, stage=self.engine.detector)
+        self.ocr_service = OCRService(self.config, stage=self.engine.ocr)
         self.question_classifier = QuestionClassifier(self.config)
         self.bbox_processor = BBoxProcessor(self.config)
         
         logger.info("Pipeline initialized successfully")
     
-    def process_image(self, image_path: str, output_path: str = None) -> Dict:
+    def process_image(self, image_path: str, output_path: str = None, pdf_path: str = None) -> Dict:
         """
         Process single image through complete pipeline
         
         Args:
             image_path: Path to input image
             output_path: Optional path to save results JSON
+            pdf_path: Optional source PDF of the page (text layer is used before OCR)
             
         Returns:
             Complete processing results
@@ -70,7 +73,7 @@ class DocumentProcessingPipeline:
             
             # Step 2: OCR Processing (only for OCR classes)
             logger.info("Step 2: Running OCR on detected boxes...")
-            boxes_with_ocr = self.ocr_service.process_boxes_batch(image_path, boxes)
+            boxes_with_ocr = self.ocr_service.process_boxes_batch(image_path, boxes, pdf_path)
             
             # Step 3: Question Classification (only for OCR classes with text)
             logger.info("Step 3: Classifying questions...")
@@ -2,15 +2,12 @@ import cv2
 import json
 import numpy as np
 from PIL import Image, ImageDraw
-from doclayout_yolo import YOLOv10
-from huggingface_hub import hf_hub_download
+from config import Config
+from modules_auto_mapping.inference_backend import InferenceBackend
 
-# --- Load model ---
-filepath = hf_hub_download(
-    repo_id="juliozhao/DocLayout-YOLO-DocStructBench",
-    filename="doclayout_yolo_docstructbench_imgsz1024.pt"
-)
-model = YOLOv10(filepath)
+# --- Load model (backend/device lấy từ Config) ---
+backend = InferenceBackend(Config())
+model = backend.load_model()
 
 # --- Input image path ---
 image_path = "/home/batien/Desktop/build_data/books_to_images/test/test_page_001.png"
@@ -18,9 +15,9 @@ image_path = "/home/batien/Desktop/build_data/books_to_images/test/test_page_001
 # --- Predict ---
 det_res = model.predict(
     image_path,
-    imgsz=1024,
+    imgsz=Config.YOLO_IMAGE_SIZE,
     conf=0.2,
-    device="cuda"
+    device=backend.device
 )
 
 # --- Collect raw bounding boxes ---
@@ -6,6 +6,8 @@ import json
 import glob
 import time
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from typing import List, Dict
 from pathlib import Path
@@ -17,34 +19,30 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def save_crop_for_box(image_path: str, box: Dict, image_output_dir: str, image_index: int) -> str:
-    """Save crop for box with fixed directory structure - image_0001 format"""
-    try:
-        from modules_auto_mapping.utils import ImageUtils
-        
-        # Generate crop filename
-        crop_filename = f"bbox_{box['id']:03d}_{box['label']}_cls{box['cls']}.png"
-        crop_path = os.path.join(image_output_dir, crop_filename)
-        
-        # Crop and save
-        ImageUtils.crop_bbox(image_path, box['bbox'], crop_path)
-        
-        # Return relative path: image_0001/crop_filename (fixed format)
-        relative_path = f"image_{image_index:04d}/{crop_filename}"
-        
-        logger.info(f"   Saved crop: {relative_path}")
-        return relative_path
-        
-    except Exception as e:
-        logger.error(f"   Failed to crop box {box['id']}: {e}")
-        return None
+def create_pipeline():
+    """Pipeline (YOLO model + shared engine stages) reused for every page of a run"""
+    from pipeline import DocumentProcessingPipeline
+    config_override = {
+        'TARGET_CLASSES': None,  # Detect all classes
+        'OCR_CLASSES': [0, 1, 2]  # Only OCR these classes
+    }
+    return DocumentProcessingPipeline(config_override)
 
-def process_single_image(image_path: str, output_dir: str, image_index: int = 1) -> Dict:
-    """Process single image with fixed directory structure"""
+def process_single_image(image_path: str, output_dir: str, image_index: int = 0, pdf_path: str = None,
+                         pipeline=None) -> Dict:
+    """
+    Process single image with fixed directory structure (image_index: 0-based page number,
+    pdf_path: source PDF for text layer reuse)
+    
+    Folder name (CropStage.folder_name), detection, crops (crop_000_cls0.png + crops.json) and
+    text.txt come from the same engine stages as the web pipeline, so image_XXXX folders are
+    identical whichever path wrote them.
+    """
     try:
         image_name = os.path.splitext(os.path.basename(image_path))[0]
-        # Fixed directory structure: image_0001, image_0002, etc.
-        image_dir_name = f"image_{image_index:04d}"
+        # Fixed directory structure shared with the web pipeline: image_0000, image_0001, etc.
+        from modules_auto_mapping.engine import CropStage
+        image_dir_name = CropStage.folder_name(image_index)
         
         print(f"\n{'='*60}")
         print(f"Processing: {image_name} → {image_dir_name}")
@@ -54,13 +52,9 @@ def process_single_image(image_path: str, output_dir: str, image_index: int = 1)
         image_output_dir = os.path.join(output_dir, image_dir_name)
         os.makedirs(image_output_dir, exist_ok=True)
         
-        # Initialize pipeline
-        from pipeline import DocumentProcessingPipeline
-        config_override = {
-            'TARGET_CLASSES': None,  # Detect all classes
-            'OCR_CLASSES': [0, 1, 2]  # Only OCR these classes
-        }
-        pipeline = DocumentProcessingPipeline(config_override)
+        # Initialize pipeline (once per run when called from process_folder)
+        pipeline = pipeline or create_pipeline()
+        engine = pipeline.engine
         
         start_time = time.time()
         
@@ -68,7 +62,11 @@ def process_single_image(image_path: str, output_dir: str, image_index: int = 1)
         print("🔍 Step 1: Document detection...")
         boxes, detection_metadata = pipeline.detector.detect_and_deduplicate(image_path)
         
+        # Crop every box (stale crops / text.txt of a previous run are removed)
+        engine.cropper.crop_page(image_path, boxes, image_output_dir)
+        
         if not boxes:
+            engine.ocr.write_box_text(image_output_dir, [])
             print("❌ No boxes detected")
             return create_empty_result(image_path, "No boxes detected")
         
@@ -92,31 +90,37 @@ def process_single_image(image_path: str, output_dir: str, image_index: int = 1)
         print(f"   OCR classes (0,1,2): {len(ocr_classes)} boxes")
         print(f"   Crop classes (others): {len(crop_classes)} boxes")
         
-        # Step 2: Process non-OCR classes with fixed directory structure
+        # Step 2: Non-OCR classes go to the mapping as images (relative path: image_0000/crop_filename)
         processed_boxes = []
         
         if crop_classes:
-            print("✂️ Step 2: Cropping non-OCR classes...")
+            print("✂️ Step 2: Collecting non-OCR crops...")
             for box in crop_classes:
                 box_copy = box.copy()
-                relative_crop_path = save_crop_for_box(image_path, box_copy, image_output_dir, image_index)
-                box_copy['crop_path'] = relative_crop_path
+                box_copy['crop_path'] = (f"{image_dir_name}/{box['crop_filename']}"
+                                         if box.get('crop_filename') else None)
                 box_copy['ocr_text'] = None
                 box_copy['is_question'] = False
                 processed_boxes.append(box_copy)
         else:
             print("⏭️ Step 2: No non-OCR classes to crop")
         
-        # Step 3-4: OCR and classification
+        # Step 3-4: OCR and classification (per-image counters, the pipeline is shared by all images)
+        ocr_stats = engine.ocr.new_stats()
         if ocr_classes:
             print("🔤 Step 3: OCR processing...")
-            ocr_processed = pipeline.ocr_service.process_boxes_batch(image_path, ocr_classes)
+            ocr_processed = engine.ocr.ocr_boxes(image_path, ocr_classes, pdf_path, ocr_stats)
+            engine.ocr.write_box_text(image_output_dir, ocr_processed)
+            if pdf_path:
+                print(f"   Text layer: {ocr_stats['text_layer_boxes']} boxes, "
+                      f"vision API: {ocr_stats['ocr_boxes']} boxes")
             
             print("❓ Step 4: Question classification...")
             classified_boxes = pipeline.question_classifier.process_boxes(ocr_processed)
             
             processed_boxes.extend(classified_boxes)
         else:
+            engine.ocr.write_box_text(image_output_dir, [])
             print("⏭️ Step 3-4: No OCR classes to process")
         
         # Step 5: Document structure processing
@@ -160,8 +164,11 @@ def process_single_image(image_path: str, output_dir: str, image_index: int = 1)
                 "ocr_boxes": len(ocr_classes),
                 "crop_boxes": len(crop_classes),
                 "questions_found": processed_data["questions_found"],
-                "crops_saved": len([b for b in crop_classes if b.get('crop_path')]),
-                "mapping_questions": len(mapping_data)
+                "crops_saved": len([b for b in processed_boxes if b.get('crop_path')]),
+                "mapping_questions": len(mapping_data),
+                "text_layer_boxes": ocr_stats["text_layer_boxes"],
+                "ocr_api_boxes": ocr_stats["ocr_boxes"],
+                "text_layer_fallbacks": ocr_stats["fallback_reasons"]
             },
             "mapping_data": mapping_data
         }
@@ -188,9 +195,38 @@ def process_single_image(image_path: str, output_dir: str, image_index: int = 1)
         print(f"❌ {error_msg}")
         return create_error_result(image_path, str(e))
 
-def process_folder(folder_path: str, output_dir: str) -> List[Dict]:
-    """Process all images in folder with fixed directory structure"""
+def summarize_text_layer(results: List[Dict], pdf_path: str = None) -> Dict:
+    """Per-book report of boxes read from the PDF text layer vs sent to the vision API"""
+    text_layer_boxes = 0
+    ocr_api_boxes = 0
+    fallbacks = {}
+    
+    for result in results:
+        statistics = result.get('statistics', {})
+        text_layer_boxes += statistics.get('text_layer_boxes', 0)
+        ocr_api_boxes += statistics.get('ocr_api_boxes', 0)
+        for reason, count in statistics.get('text_layer_fallbacks', {}).items():
+            fallbacks[reason] = fallbacks.get(reason, 0) + count
+    
+    total_boxes = text_layer_boxes + ocr_api_boxes
+    return {
+        "pdf_path": pdf_path,
+        "ocr_boxes": total_boxes,
+        "text_layer_boxes": text_layer_boxes,
+        "vision_api_boxes": ocr_api_boxes,
+        "api_calls_avoided": text_layer_boxes,
+        "api_calls_avoided_rate": round(text_layer_boxes / total_boxes * 100, 2) if total_boxes else 0,
+        "fallback_reasons": fallbacks
+    }
+
+def process_folder(folder_path: str, output_dir: str, pdf_path: str = None, pipeline=None) -> List[Dict]:
+    """
+    Process all images in folder with fixed directory structure (pdf_path: source PDF of the pages,
+    pipeline: shared by the books of a PDF folder, created here when omitted)
+    """
     try:
+        from modules_auto_mapping.engine import CropStage
+        
         # Find all image files
         image_extensions = ['*.png', '*.jpg', '*.jpeg', '*.bmp', '*.tiff', '*.tif']
         image_files = []
@@ -201,7 +237,8 @@ def process_folder(folder_path: str, output_dir: str) -> List[Dict]:
             pattern = os.path.join(folder_path, ext.upper())
             image_files.extend(glob.glob(pattern))
         
-        image_files = sorted(list(set(image_files)))
+        # Page order, folders named by page number (same as the web pipeline)
+        image_files = CropStage.sort_pages(set(image_files))
         
         if not image_files:
             print(f"❌ No image files found in: {folder_path}")
@@ -215,6 +252,15 @@ def process_folder(folder_path: str, output_dir: str) -> List[Dict]:
         
         os.makedirs(output_dir, exist_ok=True)
         
+        # Journaled mapping writer: each image's questions are appended as they finish,
+        # so a crash keeps the questions done so far and never truncates mapping.json
+        from modules_auto_mapping.mapping_writer import MappingWriter
+        mapping_writer = MappingWriter(output_dir)
+        mapping_writer.reset()
+        
+        # One pipeline (model load, OCR pool) for all images of the folder
+        pipeline = pipeline or create_pipeline()
+        
         # Process images with fixed indexing
         results = []
         successful = 0
@@ -224,11 +270,11 @@ def process_folder(folder_path: str, output_dir: str) -> List[Dict]:
         start_time = time.time()
         
         for i, image_path in enumerate(image_files):
-            image_index = i + 1  # 1-based indexing for directories
-            print(f"\n[{i+1}/{len(image_files)}] Processing: {os.path.basename(image_path)} → image_{image_index:04d}")
+            image_index = CropStage.page_position(image_path, i)  # 0-based page number, same as the web pipeline
+            print(f"\n[{i+1}/{len(image_files)}] Processing: {os.path.basename(image_path)} → {CropStage.folder_name(image_index)}")
             
             try:
-                result = process_single_image(image_path, output_dir, image_index)
+                result = process_single_image(image_path, output_dir, image_index, pdf_path, pipeline)
                 results.append(result)
                 
                 if result['status'] == 'success':
@@ -240,6 +286,7 @@ def process_folder(folder_path: str, output_dir: str) -> List[Dict]:
                         mapping_item['index'] = current_mapping_index
                         all_mapping_data.append(mapping_item)
                         current_mapping_index += 1
+                    mapping_writer.append(mapping_data)
                 else:
                     failed += 1
                     
@@ -248,19 +295,15 @@ def process_folder(folder_path: str, output_dir: str) -> List[Dict]:
                 error_result = create_error_result(image_path, str(e))
                 results.append(error_result)
                 print(f"❌ Failed: {e}")
-            
-            if i < len(image_files) - 1:
-                time.sleep(0.5)
         
         # Save combined mapping
         print(f"\n📋 Generating combined mapping.json...")
-        mapping_path = os.path.join(output_dir, "mapping.json")
-        with open(mapping_path, 'w', encoding='utf-8') as f:
-            json.dump(all_mapping_data, f, ensure_ascii=False, indent=2)
+        mapping_path = mapping_writer.flush()
         print(f"📄 Combined mapping saved: {mapping_path}")
         
         # Create summary
         total_time = time.time() - start_time
+        text_layer_report = summarize_text_layer(results, pdf_path)
         summary = {
             "folder_processing_summary": {
                 "folder_path": folder_path,
@@ -275,10 +318,11 @@ def process_folder(folder_path: str, output_dir: str) -> List[Dict]:
                     "total_mapping_questions": len(all_mapping_data),
                     "avg_time_per_image": round(total_time / len(image_files), 2) if image_files else 0
                 },
+                "text_layer": text_layer_report,
                 "processed_images": [
                     {
                         "original_name": os.path.basename(img),
-                        "directory": f"image_{i+1:04d}"
+                        "directory": CropStage.page_folder(img, i)
                     }
                     for i, img in enumerate(image_files)
                 ]
@@ -301,13 +345,18 @@ def process_folder(folder_path: str, output_dir: str) -> List[Dict]:
         print(f"   Total mapping questions: {len(all_mapping_data)}")
         print(f"   Total time: {total_time:.2f}s")
         print(f"   Average per image: {summary['folder_processing_summary']['statistics']['avg_time_per_image']:.2f}s")
+        if pdf_path:
+            print(f"   Text layer boxes: {text_layer_report['text_layer_boxes']}/{text_layer_report['ocr_boxes']} "
+                  f"({text_layer_report['api_calls_avoided_rate']:.1f}% vision API calls avoided)")
+            if text_layer_report['fallback_reasons']:
+                print(f"   OCR fallback reasons: {text_layer_report['fallback_reasons']}")
         print(f"📄 Summary saved: {summary_path}")
         print(f"📋 Combined mapping: {mapping_path}")
         
         # Print directory mapping
         print(f"\n📁 Directory Structure:")
         for i, img in enumerate(image_files[:5]):  # Show first 5
-            print(f"   {os.path.basename(img)} → image_{i+1:04d}/")
+            print(f"   {os.path.basename(img)} → {CropStage.page_folder(img, i)}/")
         if len(image_files) > 5:
             print(f"   ... and {len(image_files)-5} more")
         
@@ -342,7 +391,7 @@ def process_pdf(pdf_path: str, images_dir: str = "books_to_images", cropped_dir:
         # Step 2: Process images with fixed directory structure
         print(f"\n🚀 Step 2: Processing converted images...")
         cropped_output_dir = os.path.join(cropped_dir, pdf_name)
-        process_folder(images_output_dir, cropped_output_dir)
+        process_folder(images_output_dir, cropped_output_dir, pdf_path)
         
         print(f"✅ Processing completed for {pdf_name}")
         print(f"📁 Images: {images_output_dir}")
@@ -354,10 +403,70 @@ def process_pdf(pdf_path: str, images_dir: str = "books_to_images", cropped_dir:
         print(f"❌ PDF processing failed: {e}")
         return False
 
-def process_pdf_folder(folder_path: str, images_dir: str = "books_to_images", cropped_dir: str = "books_cropped") -> bool:
-    """Convert all PDFs in folder to images then process with fixed directory structure"""
+def process_pdf_book(pdf_path: str, images_dir: str, cropped_dir: str, pipeline,
+                     render_slots: threading.Semaphore, render_workers: int = 4) -> Dict:
+    """
+    Render and process one book of a PDF folder (runs on a book thread)
+    
+    Rendering waits for a render slot, detection and OCR go through the shared pipeline
+    (one model call at a time, OCR_MAX_IN_FLIGHT API requests for all books).
+    """
+    from modules_auto_mapping import PDFProcessor
+    
+    pdf_name = Path(pdf_path).stem
+    book_start = time.time()
+    report = {"pdf_name": pdf_name, "status": "error", "pages": 0, "successful_pages": 0}
+    
     try:
-        from modules_auto_mapping import PDFProcessor
+        # Step 1: Convert PDF to images
+        images_output_dir = os.path.join(images_dir, pdf_name)
+        with render_slots:
+            print(f"📄 [{pdf_name}] Converting to images...")
+            render_start = time.time()
+            result = PDFProcessor(dpi=300, max_workers=render_workers).convert_to_images(pdf_path, images_output_dir)
+            report["render_time"] = round(time.time() - render_start, 2)
+        
+        if result['status'] != 'success':
+            report["error"] = result.get('error', 'Unknown error')
+            print(f"❌ [{pdf_name}] PDF conversion failed: {report['error']}")
+            return report
+        
+        print(f"✅ [{pdf_name}] PDF converted: {result['successful_pages']}/{result['total_pages']} pages")
+        
+        # Step 2: Process images with fixed directory structure
+        print(f"🚀 [{pdf_name}] Processing images...")
+        cropped_output_dir = os.path.join(cropped_dir, pdf_name)
+        results = process_folder(images_output_dir, cropped_output_dir, pdf_path, pipeline)
+        
+        report.update({
+            "status": "success" if results else "error",
+            "pages": len(results),
+            "successful_pages": len([r for r in results if r.get('status') != 'error']),
+            "output_directory": cropped_output_dir
+        })
+        print(f"✅ [{pdf_name}] Completed: {report['successful_pages']}/{report['pages']} pages")
+        
+    except Exception as e:
+        report["error"] = str(e)
+        print(f"❌ [{pdf_name}] Failed: {e}")
+    finally:
+        # Text layer keeps the book's PDF open on this thread
+        if pipeline.engine.ocr.text_layer:
+            pipeline.engine.ocr.text_layer.close()
+        report["processing_time"] = round(time.time() - book_start, 2)
+    
+    return report
+
+def process_pdf_folder(folder_path: str, images_dir: str = "books_to_images", cropped_dir: str = "books_cropped",
+                       parallel_books: int = None) -> bool:
+    """
+    Convert all PDFs in folder to images then process with fixed directory structure
+    
+    Several books run at once so rendering, detection and OCR of different books overlap;
+    each stage keeps its own budget (render slots, one model call, OCR_MAX_IN_FLIGHT).
+    """
+    try:
+        from config import Config
         
         print(f"📚 Processing PDF folder: {folder_path}")
         
@@ -373,46 +482,59 @@ def process_pdf_folder(folder_path: str, images_dir: str = "books_to_images", cr
             print("❌ No PDF files found")
             return False
         
-        print(f"📊 Found {len(pdf_files)} PDF files")
+        parallel_books = max(1, min(parallel_books or Config.CLI_PARALLEL_BOOKS, len(pdf_files)))
+        print(f"📊 Found {len(pdf_files)} PDF files ({parallel_books} books at a time)")
         
-        # Process each PDF separately
-        processor = PDFProcessor(dpi=300, max_workers=4)
-        successful_pdfs = 0
+        # One pipeline for all books: the model is loaded once and the OCR pool is shared
+        pipeline = create_pipeline()
+        render_slots = threading.BoundedSemaphore(max(1, Config.CLI_RENDER_SLOTS))
+        render_workers = pipeline.engine.detector.backend.cpu_budget.pdf_workers
         
-        for i, pdf_path in enumerate(pdf_files):
-            pdf_name = Path(pdf_path).stem
-            print(f"\n[{i+1}/{len(pdf_files)}] Processing: {pdf_name}")
-            
-            try:
-                # Step 1: Convert PDF to images
-                print(f"📄 Step 1: Converting {pdf_name} to images...")
-                images_output_dir = os.path.join(images_dir, pdf_name)
-                
-                result = processor.convert_to_images(pdf_path, images_output_dir)
-                
-                if result['status'] != 'success':
-                    print(f"❌ PDF conversion failed: {result.get('error', 'Unknown error')}")
-                    continue
-                
-                print(f"✅ PDF converted: {result['successful_pages']}/{result['total_pages']} pages")
-                print(f"📁 Images: {images_output_dir}")
-                
-                # Step 2: Process images with fixed directory structure
-                print(f"🚀 Step 2: Processing images for {pdf_name}...")
-                cropped_output_dir = os.path.join(cropped_dir, pdf_name)
-                process_folder(images_output_dir, cropped_output_dir)
-                
-                print(f"✅ Completed {pdf_name}")
-                print(f"📁 Results: {cropped_output_dir}")
-                successful_pdfs += 1
-                
-                # Small delay between PDFs
-                if i < len(pdf_files) - 1:
-                    time.sleep(0.5)
-                
-            except Exception as e:
-                print(f"❌ Failed to process {pdf_name}: {e}")
-                continue
+        start_time = time.time()
+        reports = []
+        
+        with ThreadPoolExecutor(max_workers=parallel_books, thread_name_prefix="book") as executor:
+            futures = {
+                executor.submit(process_pdf_book, pdf_path, images_dir, cropped_dir, pipeline,
+                                render_slots, render_workers): pdf_path
+                for pdf_path in pdf_files
+            }
+            for future in as_completed(futures):
+                report = future.result()
+                reports.append(report)
+                print(f"\n[{len(reports)}/{len(pdf_files)}] {report['pdf_name']}: {report['status']} "
+                      f"({report['pages']} pages, {report['processing_time']:.1f}s)")
+        
+        reports.sort(key=lambda r: r['pdf_name'])
+        successful_pdfs = len([r for r in reports if r['status'] == 'success'])
+        total_pages = sum(r['successful_pages'] for r in reports)
+        total_time = time.time() - start_time
+        pages_per_minute = round(total_pages / total_time * 60, 2) if total_time > 0 else 0
+        
+        summary = {
+            "pdf_folder_processing_summary": {
+                "folder_path": folder_path,
+                "timestamp": datetime.now().isoformat(),
+                "processing_time": round(total_time, 2),
+                "parallel_books": parallel_books,
+                "render_slots": Config.CLI_RENDER_SLOTS,
+                "render_workers": render_workers,
+                "ocr_max_in_flight": pipeline.engine.ocr.max_in_flight,
+                "statistics": {
+                    "total_pdfs": len(pdf_files),
+                    "successful_pdfs": successful_pdfs,
+                    "failed_pdfs": len(pdf_files) - successful_pdfs,
+                    "total_pages": total_pages,
+                    "pages_per_minute": pages_per_minute
+                },
+                "books": reports
+            }
+        }
+        
+        os.makedirs(cropped_dir, exist_ok=True)
+        summary_path = os.path.join(cropped_dir, "pdf_folder_processing_summary.json")
+        with open(summary_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
         
         # Final summary
         print(f"\n{'='*60}")
@@ -423,6 +545,8 @@ def process_pdf_folder(folder_path: str, images_dir: str = "books_to_images", cr
         print(f"   Successful: {successful_pdfs}")
         print(f"   Failed: {len(pdf_files) - successful_pdfs}")
         print(f"   Success rate: {(successful_pdfs/len(pdf_files)*100):.1f}%")
+        print(f"   Pages: {total_pages} in {total_time:.1f}s ({pages_per_minute:.1f} pages/min)")
+        print(f"📄 Summary saved: {summary_path}")
         print(f"📁 Images directory: {os.path.abspath(images_dir)}")
         print(f"📁 Results directory: {os.path.abspath(cropped_dir)}")
         
@@ -511,13 +635,14 @@ def detect_input_type(input_path: str) -> str:
 
 def main():
     """Main function with fixed directory structure"""
-    parser = argparse.ArgumentParser(description='Document Processing Pipeline - FIXED DIRECTORY STRUCTURE (image_0001)')
+    parser = argparse.ArgumentParser(description='Document Processing Pipeline - FIXED DIRECTORY STRUCTURE (image_0000)')
     
     parser.add_argument('input_path', help='Path to file or folder (PDF, image, or folder containing PDFs/images)')
     parser.add_argument('-o', '--output', default='books_cropped', help='Output directory for processed results (default: books_cropped)')
     parser.add_argument('--images-dir', default='books_to_images', help='Directory for PDF converted images (default: books_to_images)')
     parser.add_argument('--dpi', type=int, default=300, help='PDF conversion DPI (default: 300)')
     parser.add_argument('--workers', type=int, default=4, help='Max worker threads for PDF conversion (default: 4)')
+    parser.add_argument('--parallel-books', type=int, default=None, help='PDFs processed at the same time in folder mode (default: Config.CLI_PARALLEL_BOOKS)')
     parser.add_argument('--verbose', action='store_true', help='Enable verbose logging')
     
     args = parser.parse_args()
@@ -534,7 +659,7 @@ def main():
     # Detect input type
     input_type = detect_input_type(args.input_path)
     print(f"🔍 Detected input type: {input_type}")
-    print(f"📁 Directory structure: image_0001, image_0002, ...")
+    print(f"📁 Directory structure: image_0000, image_0001, ...")
     
     try:
         if input_type == "pdf":
@@ -552,7 +677,7 @@ def main():
             print("📚 PDF FOLDER PROCESSING")
             print(f"📁 Images will be saved to: {args.images_dir}")
             print(f"📁 Results will be saved to: {args.output}")
-            success = process_pdf_folder(args.input_path, args.images_dir, args.output)
+            success = process_pdf_folder(args.input_path, args.images_dir, args.output, args.parallel_books)
             if not success:
                 print("❌ PDF folder processing failed")
                 sys.exit(1)
@@ -560,7 +685,8 @@ def main():
         elif input_type == "image":
             # Single image processing
             print("🖼️ SINGLE IMAGE PROCESSING")
-            result = process_single_image(args.input_path, args.output, 1)
+            from modules_auto_mapping.engine import CropStage
+            result = process_single_image(args.input_path, args.output, CropStage.page_position(args.input_path, 0))
             
             if result['status'] == 'success':
                 print(f"\n🎉 Processing completed successfully!")
@@ -568,9 +694,8 @@ def main():
                 # Save mapping for single image
                 mapping_data = result.get('mapping_data', [])
                 if mapping_data:
-                    mapping_path = os.path.join(args.output, "mapping.json")
-                    with open(mapping_path, 'w', encoding='utf-8') as f:
-                        json.dump(mapping_data, f, ensure_ascii=False, indent=2)
+                    from modules_auto_mapping.mapping_writer import MappingWriter
+                    mapping_path = MappingWriter(args.output).replace(mapping_data)
                     print(f"📋 Mapping saved: {mapping_path}")
                 
                 # Print question details
@@ -594,7 +719,7 @@ def main():
             print("📁 MIXED FOLDER DETECTED")
             print("⚠️ Folder contains both PDFs and images.")
             print("📄 Processing PDFs first...")
-            success = process_pdf_folder(args.input_path, args.images_dir, args.output)
+            success = process_pdf_folder(args.input_path, args.images_dir, args.output, args.parallel_books)
             if success:
                 print("✅ PDF processing completed.")
                 print("🖼️ Now processing existing images...")
@@ -1,12 +1,25 @@
 // Global variables
+const GALLERY_PAGE_SIZE = 60;
 let currentBook = '';
 let currentViewMode = 'detection';
-let allDetectionImages = [];
-let allCroppedImages = [];
 let currentFolder = 'all';
+let currentClass = '';
 let currentSort = 'name';
 let filteredImages = [];
 let currentImageIndex = 0;
+let searchTimer = null;
+let pageObserver = null;
+let pageRequestSeq = 0;
+
+// Trạng thái phân trang của từng grid - ảnh chỉ được tải theo trang khi cuộn tới
+const galleryState = {
+    detection: createGridState(),
+    cropped: createGridState()
+};
+
+function createGridState() {
+    return { images: [], total: 0, nextOffset: 0, loading: false, request: 0 };
+}
 
 // Initialize
 document.addEventListener('DOMContentLoaded', function() {
@@ -33,6 +46,8 @@ function setupEventListeners() {
     if (lightboxNext) lightboxNext.addEventListener('click', () => navigateImage(1));
     if (downloadBtn) downloadBtn.addEventListener('click', downloadCurrentImage);
 
+    setupInfiniteScroll();
+
     // Close modals when clicking outside
     window.addEventListener('click', function(event) {
         const imageModal = document.getElementById('imageModal');
@@ -78,6 +93,32 @@ function setupEventListeners() {
     });
 }
 
+function setupInfiniteScroll() {
+    // Sentinel cuối mỗi grid: khi cuộn gần tới thì tải trang kế tiếp
+    pageObserver = new IntersectionObserver(entries => {
+        entries.forEach(entry => {
+            if (entry.isIntersecting) {
+                loadGalleryPage(entry.target.dataset.type);
+            }
+        });
+    }, { rootMargin: '600px 0px' });
+
+    ['detection', 'cropped'].forEach(type => {
+        const grid = document.getElementById(gridId(type));
+        if (!grid) return;
+        const sentinel = document.createElement('div');
+        sentinel.className = 'grid-sentinel';
+        sentinel.id = `${type}Sentinel`;
+        sentinel.dataset.type = type;
+        grid.after(sentinel);
+        pageObserver.observe(sentinel);
+    });
+}
+
+function gridId(type) {
+    return type === 'detection' ? 'detectionGrid' : 'croppedGrid';
+}
+
 function loadBooks() {
     console.log('Loading books...');
     showLoading(true);
@@ -137,7 +178,17 @@ function onViewModeChange() {
 function onSortChange() {
     const sortBy = document.getElementById('sortBy').value;
     currentSort = sortBy;
-    sortAndDisplayImages();
+    reloadGalleryPages();
+}
+
+function onClassChange() {
+    const classFilter = document.getElementById('classFilter');
+    currentClass = classFilter ? classFilter.value : '';
+    reloadGalleryPages('cropped');
+}
+
+function onDateChange() {
+    reloadGalleryPages();
 }
 
 function updateViewMode() {
@@ -163,6 +214,10 @@ function updateViewMode() {
             croppedSection.classList.remove('hidden');
             break;
     }
+    
+    // Grid vừa hiện ra có thể cần thêm trang để lấp đầy màn hình
+    fillViewport('detection');
+    fillViewport('cropped');
 }
 
 function loadGallery() {
@@ -173,10 +228,12 @@ function loadGallery() {
     
     console.log('Loading gallery for book:', currentBook);
     showLoading(true);
+    currentFolder = 'all';
+    currentClass = '';
     
     Promise.all([
-        loadDetectionImages(),
-        loadCroppedImages()
+        loadGalleryPage('detection', true),
+        loadGalleryPage('cropped', true)
     ]).then(() => {
         updateViewMode();
         updateImageStats();
@@ -188,106 +245,126 @@ function loadGallery() {
     });
 }
 
-function loadDetectionImages() {
-    console.log('Loading detection images for:', currentBook);
-    return fetch(`/api/gallery/detection?book=${currentBook}`)
-        .then(response => response.json())
-        .then(data => {
-            console.log('Detection images response:', data);
-            if (data.success) {
-                allDetectionImages = data.images || [];
-                displayDetectionImages();
-            } else {
-                console.warn('Detection images failed:', data.error);
-                allDetectionImages = [];
-                displayDetectionImages();
-            }
-        });
+function reloadGalleryPages(type) {
+    if (!currentBook) return;
+    const types = type ? [type] : ['detection', 'cropped'];
+    Promise.all(types.map(t => loadGalleryPage(t, true)))
+        .then(updateImageStats)
+        .catch(error => showAlert('Lỗi khi tải gallery: ' + error.message, 'error'));
 }
 
-function loadCroppedImages() {
-    console.log('Loading cropped images for:', currentBook);
-    return fetch(`/api/gallery/cropped?book=${currentBook}`)
-        .then(response => response.json())
-        .then(data => {
-            console.log('Cropped images response:', data);
-            if (data.success) {
-                allCroppedImages = data.images || [];
-                displayCroppedImages();
-                createFolderTabs();
-            } else {
-                console.warn('Cropped images failed:', data.error);
-                allCroppedImages = [];
-                displayCroppedImages();
-                createFolderTabs();
-            }
-        });
+function buildGalleryQuery(type, offset) {
+    const sortParams = { name: 'name', date: '-date', size: '-size' };
+    const params = new URLSearchParams({
+        book: currentBook,
+        offset: offset,
+        limit: GALLERY_PAGE_SIZE,
+        sort: sortParams[currentSort] || 'name'
+    });
+    
+    const searchInput = document.getElementById('searchInput');
+    const dateFrom = document.getElementById('dateFrom');
+    const dateTo = document.getElementById('dateTo');
+    if (searchInput && searchInput.value.trim()) params.set('q', searchInput.value.trim());
+    if (dateFrom && dateFrom.value) params.set('date_from', dateFrom.value);
+    if (dateTo && dateTo.value) params.set('date_to', dateTo.value);
+    
+    if (type === 'cropped') {
+        if (currentFolder !== 'all') params.set('folder', currentFolder);
+        if (currentClass !== '') params.set('class', currentClass);
+    }
+    return params;
 }
 
-function displayDetectionImages() {
-    const container = document.getElementById('detectionGrid');
-    const countElement = document.getElementById('detectionCount');
+function loadGalleryPage(type, reset = false) {
+    let state = galleryState[type];
     
-    if (!container || !countElement) {
-        console.error('Detection display elements not found');
-        return;
+    if (reset) {
+        // Bỏ qua response của các request cũ còn đang chạy
+        state = galleryState[type] = createGridState();
+        state.request = ++pageRequestSeq;
+        const container = document.getElementById(gridId(type));
+        if (container) container.innerHTML = '';
     }
     
-    if (allDetectionImages.length === 0) {
-        container.innerHTML = '<div class="no-images">Không có ảnh detection nào</div>';
-        countElement.textContent = '0';
-        return;
+    if (!currentBook || state.loading || state.nextOffset === null) {
+        return Promise.resolve();
     }
     
-    countElement.textContent = allDetectionImages.length;
-    
-    const sortedImages = sortImages(allDetectionImages);
-    container.innerHTML = '';
-    
-    sortedImages.forEach((image, index) => {
-        const imageCard = createImageCard(image, 'detection', index);
-        container.appendChild(imageCard);
-    });
+    const request = state.request;
+    const offset = state.nextOffset;
+    state.loading = true;
     
-    console.log('Displayed', allDetectionImages.length, 'detection images');
+    return fetch(`/api/gallery/${type}?${buildGalleryQuery(type, offset)}`)
+        .then(response => response.json())
+        .then(data => {
+            if (galleryState[type].request !== request) return;
+            state.loading = false;
+            
+            if (!data.success) {
+                console.warn(`${type} images failed:`, data.error);
+                state.nextOffset = null;
+                renderGalleryPage(type, []);
+                return;
+            }
+            
+            state.total = data.total;
+            state.nextOffset = data.next_offset;
+            if (type === 'cropped' && data.facets) {
+                createFolderTabs(data.facets);
+                updateClassFilter(data.facets);
+            }
+            renderGalleryPage(type, data.images || []);
+            fillViewport(type);
+        })
+        .catch(error => {
+            if (galleryState[type].request === request) state.loading = false;
+            throw error;
+        });
 }
 
-function displayCroppedImages() {
-    const container = document.getElementById('croppedGrid');
-    const countElement = document.getElementById('croppedCount');
+function renderGalleryPage(type, images) {
+    const state = galleryState[type];
+    const container = document.getElementById(gridId(type));
+    const countElement = document.getElementById(type === 'detection' ? 'detectionCount' : 'croppedCount');
     
     if (!container || !countElement) {
-        console.error('Cropped display elements not found');
+        console.error(`${type} display elements not found`);
         return;
     }
     
-    let imagesToShow = allCroppedImages;
-    
-    // Filter by folder if selected
-    if (currentFolder !== 'all') {
-        imagesToShow = allCroppedImages.filter(img => img.folder === currentFolder);
-    }
+    countElement.textContent = state.total;
     
-    if (imagesToShow.length === 0) {
-        container.innerHTML = '<div class="no-images">Không có ảnh crop nào</div>';
-        countElement.textContent = '0';
+    if (state.images.length === 0 && images.length === 0) {
+        container.innerHTML = type === 'detection'
+            ? '<div class="no-images">Không có ảnh detection nào</div>'
+            : '<div class="no-images">Không có ảnh crop nào</div>';
         return;
     }
     
-    countElement.textContent = imagesToShow.length;
-    
-    const sortedImages = sortImages(imagesToShow);
-    container.innerHTML = '';
-    
-    sortedImages.forEach((image, index) => {
-        const imageCard = createImageCard(image, 'cropped', index);
-        container.appendChild(imageCard);
+    const fragment = document.createDocumentFragment();
+    images.forEach(image => {
+        fragment.appendChild(createImageCard(image, type, state.images.length));
+        state.images.push(image);
     });
+    container.appendChild(fragment);
+    
+    console.log('Displayed', state.images.length, '/', state.total, type, 'images');
+}
+
+function fillViewport(type) {
+    // Sentinel vẫn trong vùng nhìn sau khi thêm trang → observer không báo lại, tự tải tiếp
+    const sentinel = document.getElementById(`${type}Sentinel`);
+    if (!sentinel || galleryState[type].nextOffset === null) return;
     
-    console.log('Displayed', imagesToShow.length, 'cropped images');
+    const rect = sentinel.getBoundingClientRect();
+    if (rect.height === 0 && rect.width === 0) return;  // grid đang ẩn
+    if (rect.top < window.innerHeight + 600) {
+        loadGalleryPage(type);
+    }
 }
 
-function createFolderTabs() {
+function createFolderTabs(facets) {
     const container = document.getElementById('folderTabs');
     
     if (!container) {
@@ -295,56 +372,54 @@ function createFolderTabs() {
         return;
     }
     
-    if (allCroppedImages.length === 0) {
+    if (!facets.total) {
         container.innerHTML = '';
         return;
     }
     
-    // Get unique folders
-    const folders = [...new Set(allCroppedImages.map(img => img.folder))];
-    const folderCounts = {};
-    
-    folders.forEach(folder => {
-        folderCounts[folder] = allCroppedImages.filter(img => img.folder === folder).length;
-    });
-    
     container.innerHTML = '';
     
     // All tab
     const allTab = document.createElement('div');
     allTab.className = `folder-tab ${currentFolder === 'all' ? 'active' : ''}`;
-    allTab.innerHTML = `📁 Tất cả <span class="tab-count">${allCroppedImages.length}</span>`;
+    allTab.dataset.folder = 'all';
+    allTab.innerHTML = `📁 Tất cả <span class="tab-count">${facets.total}</span>`;
     allTab.onclick = () => selectFolder('all');
     container.appendChild(allTab);
     
     // Individual folder tabs
-    folders.sort().forEach(folder => {
+    facets.folders.forEach(folder => {
         const tab = document.createElement('div');
-        tab.className = `folder-tab ${currentFolder === folder ? 'active' : ''}`;
-        tab.innerHTML = `📂 ${folder} <span class="tab-count">${folderCounts[folder]}</span>`;
-        tab.onclick = () => selectFolder(folder);
+        tab.className = `folder-tab ${currentFolder === folder.name ? 'active' : ''}`;
+        tab.dataset.folder = folder.name;
+        tab.innerHTML = `📂 ${folder.name} <span class="tab-count">${folder.count}</span>`;
+        tab.onclick = () => selectFolder(folder.name);
         container.appendChild(tab);
     });
 }
 
+function updateClassFilter(facets) {
+    const classFilter = document.getElementById('classFilter');
+    if (!classFilter) return;
+    
+    classFilter.innerHTML = '<option value="">Tất cả class</option>';
+    facets.classes.forEach(item => {
+        const option = document.createElement('option');
+        option.value = item.class;
+        option.textContent = `cls${item.class} (${item.count})`;
+        classFilter.appendChild(option);
+    });
+    classFilter.value = currentClass;
+}
+
 function selectFolder(folder) {
     currentFolder = folder;
-    displayCroppedImages();
+    reloadGalleryPages('cropped');
     
     // Update tab active state
     document.querySelectorAll('.folder-tab').forEach(tab => {
-        tab.classList.remove('active');
+        tab.classList.toggle('active', tab.dataset.folder === folder);
     });
-    
-    const activeTab = [...document.querySelectorAll('.folder-tab')].find(tab => {
-        const tabText = tab.textContent;
-        return (folder === 'all' && tabText.includes('Tất cả')) || 
-               (folder !== 'all' && tabText.includes(folder));
-    });
-    
-    if (activeTab) {
-        activeTab.classList.add('active');
-    }
 }
 
 function createImageCard(image, type, index) {
@@ -354,7 +429,8 @@ function createImageCard(image, type, index) {
     card.dataset.index = index;
     
     const img = document.createElement('img');
-    img.src = image.url;
+    // Grid dùng thumbnail, modal/lightbox mới tải ảnh gốc
+    img.src = image.thumb_url || image.url;
     img.alt = image.name;
     img.loading = 'lazy';
     
@@ -420,81 +496,15 @@ function createImageCard(image, type, index) {
     return card;
 }
 
-function sortImages(images) {
-    return [...images].sort((a, b) => {
-        switch(currentSort) {
-            case 'name':
-                return a.name.localeCompare(b.name);
-            case 'date':
-                return new Date(b.date) - new Date(a.date);
-            case 'size':
-                const sizeA = parseSize(a.size);
-                const sizeB = parseSize(b.size);
-                return sizeB - sizeA;
-            default:
-                return 0;
-        }
-    });
-}
-
-function parseSize(sizeStr) {
-    if (!sizeStr) return 0;
-    const match = sizeStr.match(/(\d+\.?\d*)\s*(KB|MB|GB)/i);
-    if (!match) return 0;
-    
-    const value = parseFloat(match[1]);
-    const unit = match[2].toUpperCase();
-    
-    switch(unit) {
-        case 'KB': return value * 1024;
-        case 'MB': return value * 1024 * 1024;
-        case 'GB': return value * 1024 * 1024 * 1024;
-        default: return value;
-    }
-}
-
-function sortAndDisplayImages() {
-    displayDetectionImages();
-    displayCroppedImages();
-}
-
 function filterImages() {
-    const searchInput = document.getElementById('searchInput');
-    if (!searchInput) return;
-    
-    const searchTerm = searchInput.value.toLowerCase();
-    
-    if (!searchTerm) {
-        // Show all images
-        document.querySelectorAll('.image-card').forEach(card => {
-            card.style.display = 'block';
-        });
-        updateImageStats();
-        return;
-    }
-    
-    let visibleCount = 0;
-    
-    document.querySelectorAll('.image-card').forEach(card => {
-        const title = card.querySelector('.image-card-title');
-        if (title) {
-            const titleText = title.textContent.toLowerCase();
-            
-            if (titleText.includes(searchTerm)) {
-                card.style.display = 'block';
-                visibleCount++;
-            } else {
-                card.style.display = 'none';
-            }
-        }
-    });
-    
-    updateSearchStats(visibleCount);
+    // Tìm theo tên file phía server, chờ người dùng gõ xong
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(() => reloadGalleryPages(), 300);
 }
 
 function updateImageStats() {
-    const detectionCount = allDetectionImages.length;
-    const croppedCount = allCroppedImages.length;
+    const detectionCount = galleryState.detection.total;
+    const croppedCount = galleryState.cropped.total;
     const totalCount = detectionCount + croppedCount;
     
     const statsElement = document.getElementById('imageStats');
@@ -503,14 +513,6 @@ function updateImageStats() {
     }
 }
 
-function updateSearchStats(visibleCount) {
-    const totalCount = allDetectionImages.length + allCroppedImages.length;
-    const statsElement = document.getElementById('imageStats');
-    if (statsElement) {
-        statsElement.textContent = `Hiển thị: ${visibleCount}/${totalCount} ảnh`;
-    }
-}
-
 function openImageModal(image, type, index) {
     const modal = document.getElementById('imageModal');
     if (!modal) return;
@@ -525,9 +527,8 @@ function openImageModal(image, type, index) {
     
     // Set current image data
     currentImageIndex = index;
-    filteredImages = type === 'detection' ? allDetectionImages : 
-                    (currentFolder === 'all' ? allCroppedImages : 
-                     allCroppedImages.filter(img => img.folder === currentFolder));
+    // Điều hướng trong các ảnh đã tải của grid (đã lọc phía server)
+    filteredImages = galleryState[type].images;
     
     // Update modal content
     if (modalImage) modalImage.src = image.url;
@@ -668,8 +669,11 @@ function clearGallery() {
     if (croppedCount) croppedCount.textContent = '0';
     if (imageStats) imageStats.textContent = 'Chưa có dữ liệu';
     
-    allDetectionImages = [];
-    allCroppedImages = [];
+    ['detection', 'cropped'].forEach(type => {
+        galleryState[type] = createGridState();
+        galleryState[type].request = ++pageRequestSeq;
+        galleryState[type].nextOffset = null;
+    });
 }
 
 function showLoading(show) {
@@ -7,6 +7,12 @@ let editingQuestion = null;
 let currentBook = 'cropped'; // Default book
 let processingStatusId = null;
 let processingInterval = null;
+let processingEvents = null; // EventSource của /processing_events (SSE)
+
+// Phân trang danh sách câu hỏi (lọc/tìm kiếm ở server)
+const QUESTIONS_PAGE_SIZE = 50;
+let questionsNextCursor = null;
+let questionSearchTimer = null;
 
 // Global auth state
 let currentUser = null;
@@ -41,6 +47,15 @@ function setupEventListeners() {
     document.getElementById('questionForm').addEventListener('submit', handleAddQuestion);
     document.getElementById('editForm').addEventListener('submit', handleEditQuestion);
 
+    // Lọc / tìm kiếm / tải thêm câu hỏi
+    document.getElementById('questionSearch').addEventListener('input', () => {
+        clearTimeout(questionSearchTimer);
+        questionSearchTimer = setTimeout(loadQuestions, 300);
+    });
+    document.getElementById('questionDifficultyFilter').addEventListener('change', () => loadQuestions());
+    document.getElementById('questionSort').addEventListener('change', () => loadQuestions());
+    document.getElementById('loadMoreQuestions').addEventListener('click', () => loadQuestions(true));
+
     // Selection mode buttons
     document.getElementById('selectQuestionMode').addEventListener('click', () => setSelectionMode('question'));
     document.getElementById('selectAnswerMode').addEventListener('click', () => setSelectionMode('answer'));
@@ -543,10 +558,7 @@ function closeUploadModal() {
     modal.style.display = 'none';
     
     // Stop processing status check if running
-    if (processingInterval) {
-        clearInterval(processingInterval);
-        processingInterval = null;
-    }
+    stopProcessingMonitor();
 }
 
 function handleFileSelect(event) {
@@ -651,31 +663,68 @@ function handlePDFUpload(event) {
 
 function startProcessingMonitor() {
     if (!processingStatusId) return;
+    stopProcessingMonitor();
     
+    if (!window.EventSource) {
+        startProcessingPolling();
+        return;
+    }
+    
+    // Server đẩy trạng thái ngay khi có tiến trình mới (SSE), không cần poll
+    const events = new EventSource(`/processing_events/${processingStatusId}`);
+    processingEvents = events;
+    events.addEventListener('status', event => {
+        handleStatusUpdate(JSON.parse(event.data));
+    });
+    events.onerror = () => {
+        if (processingEvents !== events) return; // Stream đã đóng chủ động
+        // Mất kết nối: quay về poll định kỳ
+        console.warn('Processing event stream lost, falling back to polling');
+        events.close();
+        processingEvents = null;
+        startProcessingPolling();
+    };
+}
+
+function startProcessingPolling() {
     processingInterval = setInterval(() => {
         checkProcessingStatus();
     }, 2000); // Check every 2 seconds
 }
 
+function stopProcessingMonitor() {
+    if (processingEvents) {
+        const events = processingEvents;
+        processingEvents = null;
+        events.close();
+    }
+    if (processingInterval) {
+        clearInterval(processingInterval);
+        processingInterval = null;
+    }
+}
+
 function checkProcessingStatus() {
     if (!processingStatusId) return;
     
     fetch(`/processing_status/${processingStatusId}`)
         .then(response => response.json())
-        .then(status => {
-            updateProcessingProgress(status);
-            
-            if (status.status === 'completed') {
-                handleProcessingComplete(status);
-            } else if (status.status === 'error') {
-                handleProcessingError(status);
-            }
-        })
+        .then(handleStatusUpdate)
         .catch(error => {
             console.error('Error checking status:', error);
         });
 }
 
+function handleStatusUpdate(status) {
+    updateProcessingProgress(status);
+    
+    if (status.status === 'completed') {
+        handleProcessingComplete(status);
+    } else if (status.status === 'error' || status.status === 'cancelled' || status.status === 'not_found') {
+        handleProcessingError(status);
+    }
+}
+
 function updateProcessingProgress(status) {
     const progressBar = document.getElementById('progressBar');
     const progressText = document.getElementById('progressText');
@@ -690,6 +739,9 @@ function updateProcessingProgress(status) {
     if (status.stage) {
         let stageText = '';
         switch (status.stage) {
+            case 'queued':
+                stageText = 'Hàng đợi';
+                break;
             case 'pdf_convert':
                 stageText = 'Chuyển đổi PDF thành ảnh';
                 if (status.current_page && status.total_pages) {
@@ -704,7 +756,9 @@ function updateProcessingProgress(status) {
                 break;
             case 'ocr':
                 stageText = 'OCR Text Recognition';
-                if (status.current_folder) {
+                if (status.total_crops) {
+                    stageText += ` (${status.current_crop || 0}/${status.total_crops} ảnh)`;
+                } else if (status.current_folder) {
                     stageText += ` (Folder ${status.current_folder})`;
                 }
                 break;
@@ -718,10 +772,7 @@ function updateProcessingProgress(status) {
 
 function handleProcessingComplete(status) {
     // Stop monitoring
-    if (processingInterval) {
-        clearInterval(processingInterval);
-        processingInterval = null;
-    }
+    stopProcessingMonitor();
     
     const progressBar = document.getElementById('progressBar');
     const progressText = document.getElementById('progressText');
@@ -779,10 +830,7 @@ function handleProcessingComplete(status) {
 
 function handleProcessingError(status) {
     // Stop monitoring
-    if (processingInterval) {
-        clearInterval(processingInterval);
-        processingInterval = null;
-    }
+    stopProcessingMonitor();
     
     const progressText = document.getElementById('progressText');
     const uploadBtn = document.getElementById('submitUpload');
@@ -1112,11 +1160,28 @@ function handleAddQuestion(event) {
     });
 }
 
-function loadQuestions() {
-    fetch(`/api/questions?book=${currentBook}`)
+function loadQuestions(append = false) {
+    const params = new URLSearchParams({
+        book: currentBook,
+        limit: QUESTIONS_PAGE_SIZE,
+        sort: document.getElementById('questionSort').value
+    });
+    const search = document.getElementById('questionSearch').value.trim();
+    const difficulty = document.getElementById('questionDifficultyFilter').value;
+    if (search) params.set('q', search);
+    if (difficulty) params.set('difficulty', difficulty);
+    if (append && questionsNextCursor) params.set('cursor', questionsNextCursor);
+
+    fetch(`/api/questions?${params}`)
         .then(response => response.json())
-        .then(questions => {
-            renderQuestionsList(questions);
+        .then(page => {
+            questionsNextCursor = page.next_cursor;
+            renderQuestionsList(page.items || [], append);
+            if (!append) {
+                document.getElementById('questionsTotal').textContent =
+                    page.total !== undefined ? `(${page.total})` : '';
+            }
+            document.getElementById('loadMoreQuestions').style.display = questionsNextCursor ? 'block' : 'none';
         })
         .catch(error => {
             console.error('Error loading questions:', error);
@@ -1124,9 +1189,11 @@ function loadQuestions() {
         });
 }
 
-function renderQuestionsList(questions) {
+function renderQuestionsList(questions, append = false) {
     const container = document.getElementById('questionsList');
-    container.innerHTML = '';
+    if (!append) {
+        container.innerHTML = '';
+    }
 
     questions.forEach(question => {
         const questionDiv = document.createElement('div');
@@ -1135,6 +1202,7 @@ function renderQuestionsList(questions) {
         questionDiv.innerHTML = `
             <div class="question-header">
                 <span class="question-index">#${question.index}</span>
+                ${question.needs_review ? `<span class="question-review" title="Trang nguồn đã đổi khi upload lại PDF: ${(question.changed_folders || []).join(', ')}">Cần xem lại</span>` : ''}
                 <div class="question-actions">
                     <button class="btn btn-primary" onclick="editQuestion(${question.index})">Sửa</button>
                     <button class="btn btn-danger" onclick="deleteQuestion(${question.index})">Xóa</button>
@@ -1160,11 +1228,10 @@ function renderQuestionsList(questions) {
 }
 
 function editQuestion(questionIndex) {
-    fetch(`/api/questions?book=${currentBook}`)
+    fetch(`/api/questions/${questionIndex}?book=${currentBook}`)
         .then(response => response.json())
-        .then(questions => {
-            const question = questions.find(q => q.index === questionIndex);
-            if (question) {
+        .then(question => {
+            if (question && question.index !== undefined) {
                 editingQuestion = { ...question };
                 
                 // Fill form with current data
@@ -1290,21 +1357,27 @@ function showAlert(message, type) {
 function setupJsonViewer() {
     document.getElementById('loadJsonBtn').addEventListener('click', loadJsonContent);
     document.getElementById('saveJsonBtn').addEventListener('click', saveJsonContent);
+    document.getElementById('downloadJsonBtn').addEventListener('click', downloadJsonExport);
 }
 
 function loadJsonContent() {
-    fetch(`/api/json/raw?book=${currentBook}`)
-        .then(response => response.json())
-        .then(data => {
-            if (data.success) {
-                const editor = document.getElementById('jsonEditor');
-                editor.value = data.content;
-                showAlert('Tải JSON thành công!', 'success');
-                editor.classList.remove('error');
-                editor.classList.add('success');
-            } else {
-                showAlert('Lỗi khi tải JSON: ' + data.error, 'error');
+    // Lấy thẳng mapping.json (không bọc trong JSON envelope, không phải parse hai lần)
+    fetch(`/api/json/export?book=${encodeURIComponent(currentBook)}`)
+        .then(response => {
+            if (response.status === 404) {
+                return '[]';
             }
+            if (!response.ok) {
+                return response.json().then(data => { throw new Error(data.error); });
+            }
+            return response.text();
+        })
+        .then(content => {
+            const editor = document.getElementById('jsonEditor');
+            editor.value = content;
+            showAlert('Tải JSON thành công!', 'success');
+            editor.classList.remove('error');
+            editor.classList.add('success');
         })
         .catch(error => {
             console.error('Error:', error);
@@ -1312,6 +1385,11 @@ function loadJsonContent() {
         });
 }
 
+function downloadJsonExport() {
+    const format = document.getElementById('jsonExportFormat').value;
+    window.location.href = `/api/json/export?book=${encodeURIComponent(currentBook)}&format=${format}&compress=gzip&download=1`;
+}
+
 function saveJsonContent() {
     const editor = document.getElementById('jsonEditor');
     const content = editor.value;
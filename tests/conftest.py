@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Chạy `python -m pytest` từ thư mục gốc của repo: import được modules/ và modules_auto_mapping/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,124 @@
+import os
+import json
+from pathlib import Path
+from types import SimpleNamespace
+
+from modules.book_checkpoint import BookCheckpoint
+from modules.processing_manager import ProcessingManager
+from modules_auto_mapping.engine import CropStage
+
+
+def make_checkpoint(tmp_path, page_hashes):
+    """Checkpoint của một sách đã render với các hash trang cho trước"""
+    checkpoint = BookCheckpoint('bk', cropped_root=str(tmp_path))
+    for page_no, page_hash in enumerate(page_hashes, 1):
+        checkpoint.mark(page_no, 'render', f'render-{page_hash}', outputs=[], page_hash=page_hash)
+    return checkpoint
+
+
+def diff(tmp_path, old, new):
+    report = make_checkpoint(tmp_path, old).diff_pages(new)
+    return {key: report[key] for key in ('unchanged', 'changed', 'added', 'removed', 'moved')}
+
+
+# === diff_pages ===
+def test_insert_in_middle_moves_later_pages(tmp_path):
+    assert diff(tmp_path, ['a', 'b', 'c'], ['a', 'x', 'b', 'c']) == {
+        'unchanged': [1], 'changed': [], 'added': [2], 'removed': [], 'moved': [[2, 3], [3, 4]]
+    }
+
+
+def test_delete_in_middle_moves_later_pages(tmp_path):
+    assert diff(tmp_path, ['a', 'b', 'c', 'd'], ['a', 'c', 'd']) == {
+        'unchanged': [1], 'changed': [], 'added': [], 'removed': [2], 'moved': [[3, 2], [4, 3]]
+    }
+
+
+def test_duplicate_blank_pages_are_matched_once_each(tmp_path):
+    assert diff(tmp_path, ['a', 'blank', 'blank', 'b'], ['a', 'blank', 'blank', 'blank', 'b']) == {
+        'unchanged': [1, 2, 3], 'changed': [], 'added': [4], 'removed': [], 'moved': [[4, 5]]
+    }
+
+
+def test_in_place_edit_is_changed(tmp_path):
+    assert diff(tmp_path, ['a', 'b', 'c'], ['a', 'x', 'c']) == {
+        'unchanged': [1, 3], 'changed': [2], 'added': [], 'removed': [], 'moved': []
+    }
+
+
+def test_shorter_pdf_removes_last_pages(tmp_path):
+    assert diff(tmp_path, ['a', 'b', 'c'], ['a', 'b']) == {
+        'unchanged': [1, 2], 'changed': [], 'added': [], 'removed': [3], 'moved': []
+    }
+
+
+def test_first_upload_has_no_previous_pages(tmp_path):
+    report = BookCheckpoint('bk', cropped_root=str(tmp_path)).diff_pages(['a', 'b'])
+    assert report['previous_pages'] == 0
+    assert report['added'] == [1, 2]
+
+
+# === move_pages ===
+def test_move_pages_rekeys_chained_moves(tmp_path):
+    checkpoint = make_checkpoint(tmp_path, ['a', 'b', 'c'])
+    checkpoint.mark(2, 'crop', 'crop-b', outputs=[], folder='image_0001')
+    checkpoint.mark(3, 'crop', 'crop-c', outputs=[], folder='image_0002')
+
+    def rewrite(stage, record, old_page_no, new_page_no):
+        if stage == 'crop':
+            record['folder'] = CropStage.folder_name(new_page_no - 1)
+        return record
+
+    checkpoint.move_pages([[2, 3], [3, 4]], rewrite)
+
+    assert checkpoint.record(2, 'render') is None
+    assert checkpoint.record(3, 'render')['page_hash'] == 'b'
+    assert checkpoint.record(3, 'crop')['folder'] == 'image_0002'
+    assert checkpoint.record(4, 'render')['page_hash'] == 'c'
+    assert checkpoint.record(4, 'crop')['folder'] == 'image_0003'
+    # Đã lưu ra file: mở lại thấy cùng kết quả
+    reopened = BookCheckpoint('bk', cropped_root=str(tmp_path))
+    assert reopened.record(4, 'crop')['input'] == 'crop-c'
+
+
+# === ProcessingManager._move_page_outputs ===
+def write_page(page_no, label):
+    folder = CropStage.folder_name(page_no - 1)
+    with open(os.path.join('books_to_images', 'bk', f'bk_page_{page_no:03d}.png'), 'w') as f:
+        f.write(label)
+    os.makedirs(os.path.join('books_cropped', 'bk', folder))
+    with open(os.path.join('books_cropped', 'bk', folder, 'text.txt'), 'w') as f:
+        f.write(label)
+    CropStage.write_index(
+        Path('books_cropped', 'bk', folder),
+        [{'crop_filename': 'crop_000_cls0.png', 'class_id': 0, 'bbox': [0, 0, 1, 1], 'page_index': page_no - 1}]
+    )
+    with open(os.path.join('books_detections', 'bk', f'{folder}_detections.jpg'), 'w') as f:
+        f.write(label)
+
+
+def read(*parts):
+    with open(os.path.join(*parts)) as f:
+        return f.read()
+
+
+def test_move_page_outputs_follows_rename_chain(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for directory in ('books_to_images', 'books_cropped', 'books_detections'):
+        os.makedirs(os.path.join(directory, 'bk'))
+    for page_no, label in ((3, 'page c'), (4, 'page d')):
+        write_page(page_no, label)
+
+    manager = SimpleNamespace(engine=SimpleNamespace(cropper=CropStage()))
+    ProcessingManager._move_page_outputs(manager, 'bk', os.path.join('books_to_images', 'bk'), [[3, 4], [4, 5]])
+
+    assert not os.path.exists(os.path.join('books_to_images', 'bk', 'bk_page_003.png'))
+    assert not os.path.exists(os.path.join('books_cropped', 'bk', 'image_0002'))
+    assert read('books_to_images', 'bk', 'bk_page_004.png') == 'page c'
+    assert read('books_to_images', 'bk', 'bk_page_005.png') == 'page d'
+    assert read('books_cropped', 'bk', 'image_0003', 'text.txt') == 'page c'
+    assert read('books_cropped', 'bk', 'image_0004', 'text.txt') == 'page d'
+    assert read('books_detections', 'bk', 'image_0004_detections.jpg') == 'page d'
+    crops = json.loads(read('books_cropped', 'bk', 'image_0004', 'crops.json'))
+    assert crops[0]['page_index'] == 4
+    assert not [name for name in os.listdir(os.path.join('books_cropped', 'bk')) if name.endswith('.moving')]
@@ -0,0 +1,64 @@
+import os
+
+from modules.job_scheduler import JobScheduler
+from modules.status_store import StatusStore
+
+
+class FakeManager:
+    """Thay ProcessingManager: chỉ cần status_store và get_status"""
+
+    def __init__(self):
+        self.status_store = StatusStore()
+
+    def get_status(self, status_id):
+        return self.status_store.get(status_id) or {'status': 'not_found'}
+
+
+def upload(tmp_path, name):
+    path = tmp_path / f"{name}.pdf"
+    path.write_bytes(b"%PDF-1.4")
+    return str(path)
+
+
+def test_running_job_is_requeued_after_restart(tmp_path):
+    db_path = str(tmp_path / "jobs.db")
+    scheduler = JobScheduler(FakeManager(), db_path=db_path)
+    scheduler.submit(upload(tmp_path, 'a'), 'book_a', 'job-a')
+    assert scheduler._claim_next()['id'] == 'job-a'
+    assert scheduler.get_job('job-a')['state'] == 'running'
+
+    # Server dừng giữa chừng: scheduler mới mở cùng file SQLite
+    manager = FakeManager()
+    restarted = JobScheduler(manager, db_path=db_path)
+
+    job = restarted.get_job('job-a')
+    assert job['state'] == 'queued'
+    assert job['attempts'] == 1
+    assert manager.status_store.get('job-a')['status'] == 'queued'
+    assert restarted._claim_next()['id'] == 'job-a'
+
+
+def test_jobs_are_claimed_by_priority_then_upload_order(tmp_path):
+    scheduler = JobScheduler(FakeManager(), db_path=str(tmp_path / "jobs.db"))
+    scheduler.submit(upload(tmp_path, 'low1'), 'low1', 'low1')
+    scheduler.submit(upload(tmp_path, 'high'), 'high', 'high', priority=5)
+    scheduler.submit(upload(tmp_path, 'low2'), 'low2', 'low2')
+
+    assert scheduler.get_job('high')['queue_position'] == 1
+    assert [scheduler._claim_next()['id'] for _ in range(3)] == ['high', 'low1', 'low2']
+    assert scheduler._claim_next() is None
+
+
+def test_cancel_queued_job(tmp_path):
+    manager = FakeManager()
+    scheduler = JobScheduler(manager, db_path=str(tmp_path / "jobs.db"))
+    pdf_path = upload(tmp_path, 'a')
+    scheduler.submit(pdf_path, 'book_a', 'job-a')
+
+    assert scheduler.cancel('job-a')
+    assert scheduler.get_job('job-a')['state'] == 'cancelled'
+    assert manager.status_store.get('job-a')['status'] == 'cancelled'
+    assert not os.path.exists(pdf_path)
+    assert scheduler._claim_next() is None
+    # Job đã kết thúc không hủy lại được
+    assert not scheduler.cancel('job-a')
@@ -0,0 +1,114 @@
+import os
+import sys
+import json
+import hashlib
+import subprocess
+
+import pytest
+
+from modules_auto_mapping.mapping_writer import MappingWriter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def questions(*names):
+    return [{'question': name} for name in names]
+
+
+def test_append_is_visible_before_compaction(tmp_path):
+    writer = MappingWriter(str(tmp_path))
+    writer.append(questions('a'))
+    writer.append(questions('b'))
+
+    assert writer.has_pending()
+    assert not os.path.exists(writer.mapping_path)
+    assert writer.read() == questions('a', 'b')
+
+
+def test_torn_last_line_is_ignored_and_cut_on_next_append(tmp_path):
+    writer = MappingWriter(str(tmp_path))
+    writer.append(questions('a'))
+    # Crash mid-append: half a JSON line at the end of the journal
+    with open(writer.journal_path, 'a', encoding='utf-8') as f:
+        f.write('{"op": "append", "questions": [{"question": "lo')
+
+    assert writer.read() == questions('a')
+
+    writer.append(questions('b'))
+    assert writer.read() == questions('a', 'b')
+    with open(writer.journal_path, encoding='utf-8') as f:
+        assert all(json.loads(line) for line in f if line.strip())
+
+
+def test_corrupt_line_before_the_end_is_an_error(tmp_path):
+    writer = MappingWriter(str(tmp_path))
+    writer.append(questions('a'))
+    with open(writer.journal_path, 'a', encoding='utf-8') as f:
+        f.write('not json\n')
+    writer.append(questions('b'))
+
+    with pytest.raises(ValueError):
+        writer.read()
+
+
+def test_crash_after_rename_before_journal_truncate_does_not_duplicate(tmp_path):
+    writer = MappingWriter(str(tmp_path))
+    writer.append(questions('a'))
+    writer.append(questions('b'))
+    with open(writer.journal_path, encoding='utf-8') as f:
+        journal = f.read()
+    writer.flush()
+
+    # State left by a crash between os.replace(mapping.json) and truncating the journal:
+    # the old operations plus the checkpoint with the sha1 of the new mapping.json
+    with open(writer.mapping_path, 'rb') as f:
+        sha1 = hashlib.sha1(f.read()).hexdigest()
+    with open(writer.journal_path, 'w', encoding='utf-8') as f:
+        f.write(journal + json.dumps({'op': 'checkpoint', 'sha1': sha1}) + '\n')
+
+    assert writer.read() == questions('a', 'b')
+
+
+def test_crash_before_rename_replays_journal(tmp_path):
+    writer = MappingWriter(str(tmp_path))
+    writer.replace(questions('a'))
+    writer.append(questions('b'))
+    # Checkpoint journaled but the new mapping.json never renamed into place
+    with open(writer.journal_path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'op': 'checkpoint', 'sha1': 'not-the-current-file'}) + '\n')
+
+    assert writer.read() == questions('a', 'b')
+
+
+def test_compaction_keeps_content_and_clears_journal(tmp_path):
+    writer = MappingWriter(str(tmp_path))
+    for number in range(MappingWriter.COMPACT_EVERY):
+        writer.append(questions(str(number)))
+
+    assert not writer.has_pending()
+    with open(writer.mapping_path, encoding='utf-8') as f:
+        assert json.load(f) == questions(*(str(number) for number in range(MappingWriter.COMPACT_EVERY)))
+
+
+def test_killed_process_keeps_committed_appends(tmp_path):
+    # The child appends, then dies without flush()/compaction
+    script = (
+        "import os, sys\n"
+        "from modules_auto_mapping.mapping_writer import MappingWriter\n"
+        "writer = MappingWriter(sys.argv[1])\n"
+        "writer.replace([{'question': 'a'}])\n"
+        "writer.append([{'question': 'b'}])\n"
+        "writer.append([{'question': 'c'}])\n"
+        "os._exit(1)\n"
+    )
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    result = subprocess.run([sys.executable, '-c', script, str(tmp_path)], env=env, cwd=ROOT)
+    assert result.returncode == 1
+
+    writer = MappingWriter(str(tmp_path))
+    assert writer.has_pending()
+    assert writer.read() == questions('a', 'b', 'c')
+    writer.flush()
+    assert not writer.has_pending()
+    with open(writer.mapping_path, encoding='utf-8') as f:
+        assert json.load(f) == questions('a', 'b', 'c')